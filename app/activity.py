@@ -0,0 +1,104 @@
+from datetime import date, datetime
+from typing import Union
+from sqlalchemy import and_, delete, exists, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .config import DATABASE_URL
+from .models import ConversationScore, StudentDailyActivity
+
+activity = StudentDailyActivity.__table__
+
+# 写入某学生某天的汇总行：accumulate 为真时在已有值上累加，否则直接覆盖为给定值
+def _upsert_daily_activity(conn, dialect: str, studentname: str, day: date, count: int, score_sum: float, accumulate: bool):
+    values = {"studentname": studentname, "day": day, "question_count": count, "total_score_sum": score_sum}
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(activity).values(**values)
+        new_count, new_sum = stmt.inserted.question_count, stmt.inserted.total_score_sum
+        if accumulate:
+            new_count, new_sum = activity.c.question_count + new_count, activity.c.total_score_sum + new_sum
+        conn.execute(stmt.on_duplicate_key_update(question_count=new_count, total_score_sum=new_sum))
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        stmt = upsert_insert(activity).values(**values)
+        new_count, new_sum = stmt.excluded.question_count, stmt.excluded.total_score_sum
+        if accumulate:
+            new_count, new_sum = activity.c.question_count + new_count, activity.c.total_score_sum + new_sum
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=["studentname", "day"],
+            set_={"question_count": new_count, "total_score_sum": new_sum},
+        ))
+    else:
+        # 其他数据库：先更新，不存在再插入
+        new_count, new_sum = count, score_sum
+        if accumulate:
+            new_count, new_sum = activity.c.question_count + count, activity.c.total_score_sum + score_sum
+        updated = conn.execute(
+            update(activity)
+            .where(activity.c.studentname == studentname, activity.c.day == day)
+            .values(question_count=new_count, total_score_sum=new_sum)
+        ).rowcount
+        if not updated:
+            conn.execute(insert(activity).values(**values))
+
+# 累加某学生某天的提问次数与评分，与评分记录在同一事务内执行
+def add_daily_activity(session: Session, studentname: str, day: date, count: int = 1, score_sum: float = 0):
+    _upsert_daily_activity(session, session.get_bind().dialect.name, studentname, day, count, score_sum, accumulate=True)
+
+# SQLite 的 date() 返回字符串，统一转为 date
+def _as_date(value: Union[date, datetime, str]) -> date:
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date() if isinstance(value, datetime) else value
+
+# 查询语句单独构造，migrations 的索引检查对同一语句执行 EXPLAIN
+def daily_counts_query(studentname: str, start: Union[date, datetime], end: Union[date, datetime, None] = None):
+    query = select(activity.c.day, activity.c.question_count).where(activity.c.studentname == studentname, activity.c.day >= _as_date(start))
+    if end is not None:
+        query = query.where(activity.c.day <= _as_date(end))
+    return query.order_by(activity.c.day)
+
+def count_questions_query(studentname: str, start: Union[date, datetime], end: Union[date, datetime]):
+    return (
+        select(func.coalesce(func.sum(activity.c.question_count), 0))
+        .where(activity.c.studentname == studentname, activity.c.day >= _as_date(start), activity.c.day <= _as_date(end))
+    )
+
+# 每日提问次数 [(日期, 次数)]，按日期排序
+def daily_counts(session: Session, studentname: str, start: Union[date, datetime], end: Union[date, datetime, None] = None) -> list:
+    return [(row.day, row.question_count) for row in session.execute(daily_counts_query(studentname, start, end))]
+
+# 区间内提问总次数（按天汇总，区间两端的日期均包含在内）
+def count_questions(session: Session, studentname: str, start: Union[date, datetime], end: Union[date, datetime]) -> int:
+    return int(session.execute(count_questions_query(studentname, start, end)).scalar())
+
+# 由原始评分记录重建汇总表（studentname 为空时重建全部），返回写入的行数。
+# 逐行覆盖为重新统计的值，再删除已没有评分记录的日期，不先清空整表：MySQL 上中途失败不会回滚已写入的部分，
+# 但每一步都可重复执行，重新运行即可得到正确结果。回填期间新写入的评分可能未计入，应在停止写入时执行
+def backfill_daily_activity(db_url: str = DATABASE_URL, studentname: str = None) -> int:
+    scores = ConversationScore.__table__
+    day = func.date(scores.c.timestamp)
+    source = (
+        select(scores.c.studentname, day.label("day"), func.count(scores.c.id).label("question_count"),
+               func.coalesce(func.sum(scores.c.total_score), 0).label("total_score_sum"))
+        .where(scores.c.timestamp.isnot(None))
+        .group_by(scores.c.studentname, day)
+    )
+    stale = delete(activity).where(~exists().where(and_(
+        scores.c.studentname == activity.c.studentname, func.date(scores.c.timestamp) == activity.c.day,
+    )))
+    if studentname:
+        source = source.where(scores.c.studentname == studentname)
+        stale = stale.where(activity.c.studentname == studentname)
+    # database 模块依赖本模块的统计函数，此处延迟导入
+    from .database import get_engine
+    with get_engine(db_url).begin() as conn:
+        rows = conn.execute(source).all()
+        for row in rows:
+            _upsert_daily_activity(conn, conn.dialect.name, row.studentname, _as_date(row.day), row.question_count,
+                                   row.total_score_sum, accumulate=False)
+        conn.execute(stale)
+        return len(rows)
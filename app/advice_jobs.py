@@ -0,0 +1,150 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException
+
+from .config import ENVPATH, ADVICE_WORKERS, ADVICE_QUEUE_MAX, ADVICE_JOB_HISTORY
+from .metrics import incr, observe
+from .profile_store import profile_store
+from .services import generate_study_advice, append_advice_file
+
+# 学习建议生成任务队列：请求只负责提交任务，固定数量的后台协程调用推理模型；
+# 结果按 profile_store 的画像版本号缓存，画像未变化时直接返回上次的建议，不再调用模型、也不重复追加 _advice.txt
+
+ADVICE_MS_BUCKETS = (1000, 5000, 10000, 20000, 30000, 60000, 120000, 300000)
+QUEUE_WAIT_BUCKETS = (10, 100, 500, 1000, 5000, 10000, 30000, 60000, 300000)
+
+def _cache_path(username: str) -> Path:
+    return Path(ENVPATH) / username / f"{username}_advice.json"
+
+# 读取上次生成的建议 {"profile_version", "advice", "generated_at"}，不存在或损坏时返回 None
+def load_cached_advice(username: str) -> Optional[dict]:
+    try:
+        with open(_cache_path(username), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_cached_advice(username: str, version: str, advice_list: list) -> dict:
+    cached = {"profile_version": version, "advice": advice_list, "generated_at": datetime.now().isoformat(timespec="seconds")}
+    path = _cache_path(username)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cached, f, ensure_ascii=False)
+    tmp_path.replace(path)
+    return cached
+
+# 读取画像与上次生成的建议（涉及文件读取与文件锁，在线程中执行）
+def _load_state(username: str) -> tuple:
+    return profile_store.get(username), load_cached_advice(username)
+
+class AdviceJobQueue:
+    def __init__(self, workers: int = ADVICE_WORKERS, max_queue: int = ADVICE_QUEUE_MAX, history: int = ADVICE_JOB_HISTORY):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.history = history
+        self._jobs = OrderedDict()     # {job_id: 任务}，只保留最近 history 个
+        self._active = {}              # {(username, 画像版本): job_id}，同一画像只生成一次
+        self._queue = None
+        self._tasks = []
+        self.running = 0
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._run()))
+
+    # 只淘汰已结束的任务，排队/执行中的任务始终可查
+    def _remember(self, job: dict):
+        self._jobs[job["job_id"]] = job
+        while len(self._jobs) > self.history:
+            finished = next((job_id for job_id, old in self._jobs.items() if old["status"] in ("done", "failed")), None)
+            if finished is None:
+                break
+            del self._jobs[finished]
+
+    # 提交任务：画像未变化时直接返回已完成的任务，同一画像已在生成时复用该任务
+    async def submit(self, username: str) -> dict:
+        (user_profile, version), cached = await asyncio.to_thread(_load_state, username)
+        if not user_profile:
+            raise HTTPException(status_code=404, detail="用户画像为空")
+        job = {"job_id": uuid.uuid4().hex, "username": username, "profile_version": version, "status": "queued",
+               "cached": False, "created_at": time.time(), "started_at": None, "finished_at": None, "result": None, "error": None}
+
+        if cached and cached.get("profile_version") == version:
+            incr("advice_jobs.cache_hits")
+            job.update(status="done", cached=True, finished_at=job["created_at"], result=cached)
+            self._remember(job)
+            return job
+
+        active_id = self._active.get((username, version))
+        if active_id in self._jobs:
+            incr("advice_jobs.deduplicated")
+            return self._jobs[active_id]
+
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((job, user_profile))
+        except asyncio.QueueFull:
+            incr("advice_jobs.rejected")
+            raise HTTPException(status_code=503, detail="学习建议生成任务繁忙，请稍后再试")
+        incr("advice_jobs.submitted")
+        self._active[(username, version)] = job["job_id"]
+        self._remember(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    async def _run(self):
+        while True:
+            job, user_profile = await self._queue.get()
+            job["status"], job["started_at"] = "running", time.time()
+            observe("advice_jobs.queue_wait_ms", (job["started_at"] - job["created_at"]) * 1000, QUEUE_WAIT_BUCKETS)
+            self.running += 1
+            try:
+                advice_list = await generate_study_advice(user_profile)
+                await asyncio.to_thread(append_advice_file, job["username"], advice_list)
+                job["result"] = await asyncio.to_thread(_save_cached_advice, job["username"], job["profile_version"], advice_list)
+                job["status"] = "done"
+                incr("advice_jobs.completed")
+            except Exception as e:
+                job["status"], job["error"] = "failed", str(getattr(e, "detail", e))
+                incr("advice_jobs.failed")
+                print(f"学习建议生成失败 {job['username']}: {job['error']}")
+            finally:
+                job["finished_at"] = time.time()
+                observe("advice_jobs.run_ms", (job["finished_at"] - job["started_at"]) * 1000, ADVICE_MS_BUCKETS)
+                self.running -= 1
+                self._active.pop((job["username"], job["profile_version"]), None)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len([task for task in self._tasks if not task.done()]),
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "jobs": len(self._jobs),
+        }
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+# 对外展示的任务信息
+def job_view(job: dict) -> dict:
+    return {key: job[key] for key in ("job_id", "username", "profile_version", "status", "cached", "error")}
+
+advice_jobs = AdviceJobQueue()
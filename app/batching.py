@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List
+
+from .metrics import observe
+
+# 分桶：批大小与排队等待时间（毫秒）
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+QUEUE_WAIT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 30000)
+
+# 动态微批调度：把并发到达的请求在 max_wait_ms 内攒成一批（最多 max_batch_size 条），
+# 相同 group_key（如相同生成参数）的请求合并为一次批量推理，结果按顺序分发给各调用方；
+# 最多 max_concurrency 批同时执行（与推理工作进程数一致），其余批次等待空闲
+class MicroBatcher:
+    def __init__(self, process_batch: Callable[[Hashable, List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float, name: str,
+                 max_concurrency: int = 1):
+        # process_batch(group_key, items) -> results，可为协程函数；普通阻塞函数在线程中执行
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._inflight = set()
+
+    def _ensure_worker(self):
+        # 调度协程异常退出时重新启动，保留原队列，已排队的请求不会丢失
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item: Any, group_key: Hashable = None) -> Any:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((group_key, item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        pending = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return pending
+
+    async def _run(self):
+        while True:
+            # 先等到空闲槽位再收集请求：所有槽位都在执行时新请求继续排队，下一批自然更大
+            await self._slots.acquire()
+            pending = await self._collect()
+            groups = OrderedDict()
+            for entry in pending:
+                groups.setdefault(entry[0], []).append(entry)
+            holding = True
+            for group_key, entries in groups.items():
+                entries = [entry for entry in entries if not entry[2].cancelled()]
+                if not entries:
+                    continue
+                if not holding:
+                    await self._slots.acquire()
+                holding = False
+                task = asyncio.get_running_loop().create_task(self._process(group_key, entries))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            if holding:
+                self._slots.release()
+
+    async def _process(self, group_key: Hashable, entries: list):
+        try:
+            started = time.perf_counter()
+            for entry in entries:
+                observe(f"{self.name}.queue_wait_ms", (started - entry[3]) * 1000, QUEUE_WAIT_BUCKETS)
+            observe(f"{self.name}.batch_size", len(entries), BATCH_SIZE_BUCKETS)
+            try:
+                items = [entry[1] for entry in entries]
+                if asyncio.iscoroutinefunction(self.process_batch):
+                    results = await self.process_batch(group_key, items)
+                else:
+                    results = await asyncio.to_thread(self.process_batch, group_key, items)
+            except Exception as e:
+                for entry in entries:
+                    if not entry[2].done():
+                        entry[2].set_exception(e)
+                return
+            for entry, result in zip(entries, results):
+                if not entry[2].done():
+                    entry[2].set_result(result)
+        finally:
+            self._slots.release()
@@ -0,0 +1,162 @@
+import json
+import os
+import struct
+import threading
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+# 聊天记录：每轮对话一行 JSON 追加写入 <user>_chat_history.jsonl，
+# 旁路索引 <user>_chat_history.idx 顺序保存每条记录的起始偏移（8 字节小端无符号整数），
+# 因此读取最后 N 轮或任意一页只需两次 seek，不必扫描整个文件
+OFFSET = struct.Struct("<Q")
+
+_locks = defaultdict(threading.Lock)
+_checked = set()
+
+def _log_path(user_folder: Path, username: str) -> Path:
+    return user_folder / f"{username}_chat_history.jsonl"
+
+def _index_path(user_folder: Path, username: str) -> Path:
+    return user_folder / f"{username}_chat_history.idx"
+
+def _txt_path(user_folder: Path, username: str) -> Path:
+    return user_folder / f"{username}_chat_history.txt"
+
+# 解析旧版 “用户: / AI:” 文本格式，未带前缀的行视为上一条消息的续行（多行回复）
+def _parse_legacy_txt(file_path: Path) -> list:
+    turns = []
+    current = None
+    field = None
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith("用户: "):
+                current = {"ts": None, "user": line[4:], "ai": ""}
+                turns.append(current)
+                field = "user"
+            elif line.startswith("AI: ") and current is not None:
+                current["ai"] = line[4:]
+                field = "ai"
+            elif current is not None and field:
+                current[field] += "\n" + line
+    for turn in turns:
+        turn["user"] = turn["user"].strip()
+        turn["ai"] = turn["ai"].strip()
+    return turns
+
+def _write_records(user_folder: Path, username: str, turns: list):
+    with open(_log_path(user_folder, username), "ab") as log, open(_index_path(user_folder, username), "ab") as index:
+        offset = log.seek(0, os.SEEK_END)
+        for turn in turns:
+            line = (json.dumps(turn, ensure_ascii=False) + "\n").encode("utf-8")
+            log.write(line)
+            index.write(OFFSET.pack(offset))
+            offset += len(line)
+
+# 重新扫描日志生成索引（仅在索引缺失或与日志不一致时执行）
+def _rebuild_index(user_folder: Path, username: str):
+    offsets = []
+    with open(_log_path(user_folder, username), "rb") as log:
+        offset = 0
+        for line in log:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+    with open(_index_path(user_folder, username), "wb") as index:
+        index.write(b"".join(OFFSET.pack(o) for o in offsets))
+
+# 首次访问时：迁移旧版 txt 记录，并校验索引最后一项是否正好指向日志末行
+def _ensure_ready(user_folder: Path, username: str):
+    key = (str(user_folder), username)
+    if key in _checked:
+        return
+    log_path = _log_path(user_folder, username)
+    index_path = _index_path(user_folder, username)
+    if not log_path.exists():
+        txt_path = _txt_path(user_folder, username)
+        if txt_path.exists():
+            _write_records(user_folder, username, _parse_legacy_txt(txt_path))
+    elif not index_path.exists():
+        _rebuild_index(user_folder, username)
+    else:
+        with open(log_path, "rb") as log, open(index_path, "rb") as index:
+            log_size = log.seek(0, os.SEEK_END)
+            index_size = index.seek(0, os.SEEK_END)
+            consistent = index_size % OFFSET.size == 0 and (index_size > 0 or log_size == 0)
+            if consistent and index_size:
+                index.seek(index_size - OFFSET.size)
+                log.seek(OFFSET.unpack(index.read(OFFSET.size))[0])
+                log.readline()
+                consistent = log.tell() == log_size
+        if not consistent:
+            _rebuild_index(user_folder, username)
+    _checked.add(key)
+
+def count_turns(user_folder: Path, username: str) -> int:
+    with _locks[username]:
+        _ensure_ready(user_folder, username)
+        index_path = _index_path(user_folder, username)
+        return index_path.stat().st_size // OFFSET.size if index_path.exists() else 0
+
+# 追加一轮对话
+def append_turn(user_folder: Path, username: str, prompt: str, reply: str):
+    turn = {"ts": datetime.now().isoformat(timespec="seconds"), "user": prompt, "ai": reply}
+    with _locks[username]:
+        _ensure_ready(user_folder, username)
+        _write_records(user_folder, username, [turn])
+
+# 读取第 [start, end) 轮对话
+def read_range(user_folder: Path, username: str, start: int, end: int) -> list:
+    with _locks[username]:
+        _ensure_ready(user_folder, username)
+        index_path = _index_path(user_folder, username)
+        if not index_path.exists():
+            return []
+        with open(index_path, "rb") as index, open(_log_path(user_folder, username), "rb") as log:
+            total = index.seek(0, os.SEEK_END) // OFFSET.size
+            start, end = max(0, start), min(end, total)
+            if start >= end:
+                return []
+            index.seek(start * OFFSET.size)
+            begin = OFFSET.unpack(index.read(OFFSET.size))[0]
+            if end < total:
+                index.seek(end * OFFSET.size)
+                stop = OFFSET.unpack(index.read(OFFSET.size))[0]
+            else:
+                stop = log.seek(0, os.SEEK_END)
+            log.seek(begin)
+            data = log.read(stop - begin)
+    # 只按 \n 切分：str.splitlines 还会在 U+2028、\x85 等字符处断行，而 json.dumps(ensure_ascii=False) 不转义这些字符
+    return [json.loads(line) for line in data.split(b"\n") if line.strip()]
+
+# 读取最近 n 轮对话
+def read_last(user_folder: Path, username: str, n: int) -> list:
+    total = count_turns(user_folder, username)
+    return read_range(user_folder, username, total - n, total)
+
+# 分页读取：第 1 页为最近的 page_size 轮，页内按时间正序
+def read_page(user_folder: Path, username: str, page: int, page_size: int) -> dict:
+    total = count_turns(user_folder, username)
+    end = total - (page - 1) * page_size
+    turns = read_range(user_folder, username, end - page_size, end) if end > 0 else []
+    return {"total": total, "page": page, "page_size": page_size, "turns": turns}
+
+# 导出为旧版 txt 格式供下载，日志未更新时直接复用上次导出的文件
+def export_txt(user_folder: Path, username: str) -> Path:
+    txt_path = _txt_path(user_folder, username)
+    with _locks[username]:
+        _ensure_ready(user_folder, username)
+        log_path = _log_path(user_folder, username)
+        if not log_path.exists():
+            return txt_path
+        if txt_path.exists() and txt_path.stat().st_mtime >= log_path.stat().st_mtime:
+            return txt_path
+        tmp_path = txt_path.with_suffix(".txt.tmp")
+        with open(log_path, "r", encoding="utf-8") as log, open(tmp_path, "w", encoding="utf-8") as f:
+            for line in log:
+                if line.strip():
+                    turn = json.loads(line)
+                    f.write(f"用户: {turn['user']}\n\nAI: {turn['ai']}\n\n")
+        os.replace(tmp_path, txt_path)
+    return txt_path
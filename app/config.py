@@ -11,4 +11,113 @@ DASHSCOPE_API_KEY = os.environ.get('dashscope_api_key')
 
 model_dir = os.environ.get('model_dir')
 Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir = os.environ.get("QWEN2_5_MATH_1_5B_INSTRUCT_BNB_4BIT_DIR")
-Qwen2_5_VL_3B_Instruct_gptq_Int4_dir = os.environ.get("QWEN2_5_VL_3B_INSTRUCT_GPTQ_INT4_DIR")
\ No newline at end of file
+Qwen2_5_VL_3B_Instruct_gptq_Int4_dir = os.environ.get("QWEN2_5_VL_3B_INSTRUCT_GPTQ_INT4_DIR")
+
+# 数据库连接池配置
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+# DashScope HTTP 客户端配置（可指向本地替身服务进行离线测试）
+DASHSCOPE_BASE_URL = os.environ.get('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com').rstrip('/')
+DASHSCOPE_CONNECT_TIMEOUT = float(os.environ.get('DASHSCOPE_CONNECT_TIMEOUT', 10))
+DASHSCOPE_READ_TIMEOUT = float(os.environ.get('DASHSCOPE_READ_TIMEOUT', 120))
+DASHSCOPE_MAX_CONNECTIONS = int(os.environ.get('DASHSCOPE_MAX_CONNECTIONS', 50))
+DASHSCOPE_MAX_KEEPALIVE = int(os.environ.get('DASHSCOPE_MAX_KEEPALIVE', 20))
+DASHSCOPE_MAX_CONCURRENCY = int(os.environ.get('DASHSCOPE_MAX_CONCURRENCY', 16))
+
+# 多轮对话上下文窗口（token 预算）与滚动摘要配置
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 2000))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.environ.get('CHAT_SUMMARY_TOKEN_BUDGET', 300))
+CHAT_SUMMARY_ITEM_CHARS = int(os.environ.get('CHAT_SUMMARY_ITEM_CHARS', 60))
+
+# 对话历史内存缓存（LRU）配置
+HISTORY_MAX_USERS = int(os.environ.get('HISTORY_MAX_USERS', 1000))
+HISTORY_MAX_BYTES = int(os.environ.get('HISTORY_MAX_BYTES', 64 * 1024 * 1024))
+HISTORY_MAX_TURNS = int(os.environ.get('HISTORY_MAX_TURNS', 200))
+HISTORY_LOAD_TURNS = int(os.environ.get('HISTORY_LOAD_TURNS', 50))
+
+# 离线解题模型微批调度配置
+TEXT_BATCH_MAX_SIZE = int(os.environ.get('TEXT_BATCH_MAX_SIZE', 8))
+TEXT_BATCH_MAX_WAIT_MS = float(os.environ.get('TEXT_BATCH_MAX_WAIT_MS', 20))
+
+# 离线模型生命周期配置（显存/内存预算为 0 表示不限制，空闲时间为 0 表示不自动卸载）
+OFFLINE_MODEL_MEMORY_BUDGET_MB = float(os.environ.get('OFFLINE_MODEL_MEMORY_BUDGET_MB', 0))
+OFFLINE_MODEL_IDLE_SECONDS = float(os.environ.get('OFFLINE_MODEL_IDLE_SECONDS', 600))
+OFFLINE_MODEL_REAP_INTERVAL = float(os.environ.get('OFFLINE_MODEL_REAP_INTERVAL', 30))
+OFFLINE_MATH_MODEL_MB = float(os.environ.get('OFFLINE_MATH_MODEL_MB', 1500))
+OFFLINE_VL_MODEL_MB = float(os.environ.get('OFFLINE_VL_MODEL_MB', 3000))
+
+# 离线推理工作进程池配置
+OFFLINE_WORKERS = int(os.environ.get('OFFLINE_WORKERS', 1))
+OFFLINE_TASK_TIMEOUT = float(os.environ.get('OFFLINE_TASK_TIMEOUT', 180))
+OFFLINE_STREAM_IDLE_TIMEOUT = float(os.environ.get('OFFLINE_STREAM_IDLE_TIMEOUT', 60))
+
+# 拍照识题结果缓存配置
+VL_CACHE_MAX_ENTRIES = int(os.environ.get('VL_CACHE_MAX_ENTRIES', 512))
+VL_CACHE_MAX_BYTES = int(os.environ.get('VL_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+VL_CACHE_DIR = os.environ.get('VL_CACHE_DIR', os.path.join(ENVPATH or '.', '_cache', 'vl'))
+VL_CACHE_DISK = os.environ.get('VL_CACHE_DISK', 'true').lower() in ('1', 'true', 'yes')
+VL_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('VL_CACHE_DISK_MAX_ENTRIES', 10000))
+# 近似重复模式：感知哈希的汉明距离不超过阈值即视为同一张图
+VL_CACHE_NEAR_DUPLICATE = os.environ.get('VL_CACHE_NEAR_DUPLICATE', 'false').lower() in ('1', 'true', 'yes')
+VL_CACHE_PHASH_DISTANCE = int(os.environ.get('VL_CACHE_PHASH_DISTANCE', 4))
+
+# 离线解题结果缓存配置（解码为贪心解码，相同输入结果确定）
+TEXT_CACHE_MAX_ENTRIES = int(os.environ.get('TEXT_CACHE_MAX_ENTRIES', 2048))
+TEXT_CACHE_MAX_BYTES = int(os.environ.get('TEXT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+TEXT_CACHE_DIR = os.environ.get('TEXT_CACHE_DIR', os.path.join(ENVPATH or '.', '_cache', 'text'))
+TEXT_CACHE_DISK = os.environ.get('TEXT_CACHE_DISK', 'false').lower() in ('1', 'true', 'yes')
+TEXT_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('TEXT_CACHE_DISK_MAX_ENTRIES', 20000))
+# 模型版本，未设置时取模型目录下 config.json 的哈希
+OFFLINE_MATH_MODEL_REVISION = os.environ.get('OFFLINE_MATH_MODEL_REVISION')
+
+# 视觉模型输入预处理配置（自动旋转、裁边、按像素预算缩放、文字页转灰度、重新压缩）
+IMAGE_PREP_ENABLED = os.environ.get('IMAGE_PREP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# 像素预算：Qwen2.5-VL 每 28x28 像素对应 1 个视觉 token，默认约 1280 个 token
+IMAGE_PREP_MAX_PIXELS = int(os.environ.get('IMAGE_PREP_MAX_PIXELS', 1280 * 28 * 28))
+IMAGE_PREP_JPEG_QUALITY = int(os.environ.get('IMAGE_PREP_JPEG_QUALITY', 85))
+IMAGE_PREP_CROP_BORDERS = os.environ.get('IMAGE_PREP_CROP_BORDERS', 'true').lower() in ('1', 'true', 'yes')
+IMAGE_PREP_BORDER_TOLERANCE = int(os.environ.get('IMAGE_PREP_BORDER_TOLERANCE', 24))
+# 平均饱和度（0-255）低于阈值时视为文字页，转为灰度
+IMAGE_PREP_GRAYSCALE = os.environ.get('IMAGE_PREP_GRAYSCALE', 'true').lower() in ('1', 'true', 'yes')
+IMAGE_PREP_GRAYSCALE_SATURATION = float(os.environ.get('IMAGE_PREP_GRAYSCALE_SATURATION', 30))
+
+# 图片上传（multipart）配置：请求体超过上限时在接收阶段返回 413；文件分块读写的块大小
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get('IMAGE_UPLOAD_MAX_BYTES', 15 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 256 * 1024))
+# 教师上传资料大小上限
+TEACHER_UPLOAD_MAX_BYTES = int(os.environ.get('TEACHER_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+
+# 启动时自动执行数据库迁移（python -m app.migrations 可手动执行）
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+# 多个进程同时启动时等待其他进程执行迁移的最长秒数
+DB_MIGRATION_LOCK_TIMEOUT = int(os.environ.get('DB_MIGRATION_LOCK_TIMEOUT', 300))
+
+# 评分导出每批读取的行数（服务端游标分批读取，内存占用与总行数无关）
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+# 批量名单操作单次最多处理的学生数
+ROSTER_BULK_MAX = int(os.environ.get('ROSTER_BULK_MAX', 500))
+
+# 学生/教师身份（ID <-> 姓名）缓存：条目上限与过期时间（秒）
+IDENTITY_CACHE_MAX_ENTRIES = int(os.environ.get('IDENTITY_CACHE_MAX_ENTRIES', 20000))
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 600))
+
+# 学习建议生成任务：后台并发数、排队上限、保留的任务记录数
+ADVICE_WORKERS = int(os.environ.get('ADVICE_WORKERS', 2))
+ADVICE_QUEUE_MAX = int(os.environ.get('ADVICE_QUEUE_MAX', 100))
+ADVICE_JOB_HISTORY = int(os.environ.get('ADVICE_JOB_HISTORY', 1000))
+
+# 学习状态分数延迟写入：是否开启、攒满多少条或间隔多少秒写入一次、临时错误重试次数、缓冲上限
+SCORE_BUFFER_ENABLED = os.environ.get('SCORE_BUFFER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SCORE_BUFFER_MAX_ROWS = int(os.environ.get('SCORE_BUFFER_MAX_ROWS', 200))
+SCORE_BUFFER_FLUSH_INTERVAL = float(os.environ.get('SCORE_BUFFER_FLUSH_INTERVAL', 1.0))
+SCORE_BUFFER_MAX_RETRIES = int(os.environ.get('SCORE_BUFFER_MAX_RETRIES', 3))
+SCORE_BUFFER_MAX_PENDING = int(os.environ.get('SCORE_BUFFER_MAX_PENDING', 10000))
+
+# 学生画像存储：file（{用户}_profile.txt）或 db（student_profile 表），内存缓存的用户数上限
+PROFILE_STORE_BACKEND = os.environ.get('PROFILE_STORE_BACKEND', 'file').lower()
+PROFILE_CACHE_MAX_USERS = int(os.environ.get('PROFILE_CACHE_MAX_USERS', 10000))
@@ -0,0 +1,111 @@
+import math
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .config import CHAT_CONTEXT_TOKEN_BUDGET, CHAT_SUMMARY_TOKEN_BUDGET, CHAT_SUMMARY_ITEM_CHARS, HISTORY_MAX_USERS
+from .metrics import incr, observe
+
+# token 数分桶
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# 用户摘要缓存 {username: [摘要行]} 与已折叠到的位置 {username: (加载批次, 绝对位置)}，
+# 按最近使用淘汰，上限与 HistoryStore 的用户数一致（摘要可从磁盘重新加载）
+_summaries = OrderedDict()
+_folded = OrderedDict()
+_lock = threading.Lock()
+
+def _touch(cache: OrderedDict, username: str):
+    cache.move_to_end(username)
+    while len(cache) > HISTORY_MAX_USERS:
+        cache.popitem(last=False)
+
+# 粗略估算 token 数：中日韩字符按 1 个 token 计，其余字符按 4 个字符 1 个 token 计
+def estimate_tokens(text: str) -> int:
+    cjk = sum(1 for ch in text if "\u3000" <= ch <= "\u9fff" or "\uff00" <= ch <= "\uffef")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def _summary_path(user_folder: Path, username: str) -> Path:
+    return user_folder / f"{username}_summary.txt"
+
+# 加载滚动摘要（与用户画像存放在同一目录）
+def load_summary(user_folder: Path, username: str) -> list:
+    if username not in _summaries:
+        path = _summary_path(user_folder, username)
+        lines = []
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [line.rstrip("\n") for line in f if line.strip()]
+        _summaries[username] = lines
+    lines = _summaries[username]
+    _touch(_summaries, username)
+    return lines
+
+def _save_summary(user_folder: Path, username: str, lines: list):
+    with open(_summary_path(user_folder, username), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def _strip_role(message: str) -> str:
+    for prefix in ("用户: ", "AI: "):
+        if message.startswith(prefix):
+            return message[len(prefix):]
+    return message
+
+# 将移出窗口的对话折叠进摘要：每轮仅保留截断后的学生提问，超出摘要预算时丢弃最早的条目
+def _fold(lines: list, evicted: list) -> bool:
+    existing = set(lines)
+    changed = False
+    for i in range(0, len(evicted), 2):
+        question = " ".join(_strip_role(evicted[i]).split())
+        if not question:
+            continue
+        if len(question) > CHAT_SUMMARY_ITEM_CHARS:
+            question = question[:CHAT_SUMMARY_ITEM_CHARS] + "…"
+        line = f"- 学生曾问：{question}"
+        if line not in existing:
+            lines.append(line)
+            existing.add(line)
+            changed = True
+    while lines and sum(estimate_tokens(line) for line in lines) > CHAT_SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+        changed = True
+    return changed
+
+# 构建发送给模型的上下文：保留预算内最近的若干轮对话，其余折叠为摘要
+# history 为 ["用户: ...", "AI: ...", ...] 交替排列的列表；offset 为 HistoryStore.offset() 返回的
+# (加载批次, history[0] 的绝对位置)，头部被裁剪后仍能找到上次折叠到的位置
+def build_context(username: str, user_folder: Path, history: list, offset: tuple = (0, 0)) -> dict:
+    # 从最新一轮开始按“一问一答”回溯，直到超出 token 预算
+    used = 0
+    start = len(history)
+    while start > 0:
+        turn_start = max(0, start - 2)
+        cost = sum(estimate_tokens(message) for message in history[turn_start:start])
+        if used + cost > CHAT_CONTEXT_TOKEN_BUDGET:
+            break
+        used += cost
+        start = turn_start
+    window = history[start:]
+
+    with _lock:
+        lines = load_summary(user_folder, username)
+        generation, base = offset
+        # 历史被重新加载（批次变化）或折叠位置已被淘汰时从头折叠，重复条目会被去重
+        last_generation, folded = _folded.get(username, (None, base))
+        folded = folded - base if last_generation == generation else 0
+        folded = max(0, min(folded, start))
+        if start > folded and _fold(lines, history[folded:start]):
+            _save_summary(user_folder, username, lines)
+        _folded[username] = (generation, base + start)
+        _touch(_folded, username)
+        summary = "\n".join(lines)
+
+    # 统计本次节省的 prompt token
+    full_tokens = used + sum(estimate_tokens(message) for message in history[:start])
+    sent_tokens = used + (estimate_tokens(summary) if summary else 0)
+    saved = max(0, full_tokens - sent_tokens)
+    incr("chat_context.requests")
+    incr("chat_context.prompt_tokens_saved", saved)
+    observe("chat_context.history_tokens_sent", sent_tokens, TOKEN_BUCKETS)
+    observe("chat_context.prompt_tokens_saved", saved, TOKEN_BUCKETS)
+    return {"window": window, "summary": summary, "history_tokens": full_tokens, "sent_tokens": sent_tokens, "saved_tokens": saved}
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+import httpx
+
+from .config import (DASHSCOPE_API_KEY, DASHSCOPE_BASE_URL, DASHSCOPE_CONNECT_TIMEOUT, DASHSCOPE_READ_TIMEOUT,
+                     DASHSCOPE_MAX_CONNECTIONS, DASHSCOPE_MAX_KEEPALIVE, DASHSCOPE_MAX_CONCURRENCY)
+
+# OpenAI 兼容接口与原生文本生成接口
+CHAT_COMPLETIONS_PATH = "/compatible-mode/v1/chat/completions"
+TEXT_GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+
+# 进程内共享的异步客户端（长连接复用）与并发上限
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=DASHSCOPE_BASE_URL,
+            headers={
+                "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
+                "Content-Type": "application/json",
+            },
+            timeout=httpx.Timeout(DASHSCOPE_READ_TIMEOUT, connect=DASHSCOPE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=DASHSCOPE_MAX_CONNECTIONS, max_keepalive_connections=DASHSCOPE_MAX_KEEPALIVE),
+        )
+    return _client
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(DASHSCOPE_MAX_CONCURRENCY)
+    return _semaphore
+
+# 发送 JSON 请求并返回响应（调用方自行检查状态码）
+async def post_json(path: str, payload: dict) -> httpx.Response:
+    async with _get_semaphore():
+        return await get_client().post(path, json=payload)
+
+# 以流式模式请求 OpenAI 兼容接口，逐段产出增量文本
+async def stream_chat(payload: dict) -> AsyncIterator[str]:
+    async with _get_semaphore():
+        async with get_client().stream("POST", CHAT_COMPLETIONS_PATH, json={**payload, "stream": True}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                if choices:
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+# 应用关闭时释放连接池
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,57 +1,122 @@
 from datetime import datetime
-from typing import Union, Dict, List
-from sqlalchemy import create_engine
+from pathlib import Path
+from threading import Lock
+from collections import namedtuple
+from typing import Union, Dict, List, Optional
+from sqlalchemy import create_engine, delete, func, insert, or_, select
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 import pandas as pd
 
-from .config import DATABASE_URL
-from .models import ConversationScore, Class, Student, Teacher
-
-engine = create_engine(DATABASE_URL)
+from .config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING
+from .activity import count_questions
+from .identity_cache import identity_cache
+from .models import ClassMembership, Classroom, ConversationScore, Student, StudentDailyActivity, Teacher
+
+# 进程内共享的引擎与会话工厂（按连接串缓存，避免每次调用都新建连接池）
+_engines = {}
+_session_factories = {}
+_engine_lock = Lock()
+
+def get_engine(db_url: str = DATABASE_URL):
+    with _engine_lock:
+        if db_url not in _engines:
+            options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+            # sqlite 等无连接池方言不支持以下参数
+            if not db_url.startswith("sqlite"):
+                options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+            _engines[db_url] = create_engine(db_url, **options)
+            _session_factories[db_url] = sessionmaker(bind=_engines[db_url])
+        return _engines[db_url]
+
+def get_session_factory(db_url: str = DATABASE_URL):
+    get_engine(db_url)
+    return _session_factories[db_url]
+
+engine = get_engine(DATABASE_URL)
+SessionLocal = get_session_factory(DATABASE_URL)
+
+# 请求级会话依赖，请求结束后无论成功与否都归还连接
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-# 从MySQL数据库提取学习状态得分并转化为execl表
+# 从MySQL数据库提取学习状态得分并转化为execl表（分批读取、逐行写入，内存占用与记录数无关）
 def export_studentname_to_excel(db_url, studentname, excel_file):
+    # 延迟导入：score_export 依赖本模块的引擎
+    from .score_export import export_key, write_xlsx
     try:
-        # 创建数据库引擎和会话
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-
-        # 查询指定username的行
-        results = session.query(ConversationScore).filter_by(stundentrname=studentname).all()
-
-        if not results:
-            print(f"未找到与用户名 '{studentname}' 相关的数据。")
-            return
-
-        # 将查询结果转换为字典列表
-        data = [
-            {
-                "ID": row.studentid,
-                "用户名": row.studentname,
-                "时间戳": row.timestamp,
-                "问题深度": row.question_depth,
-                "响应及时性": row.response_timeliness,
-                "纠正主动性": row.correction_proactivity,
-                "情感参与度": row.emotional_engagement,
-                "总分": row.total_score,
-            }
-            for row in results
-        ]
-
-        # 转换为DataFrame
-        df = pd.DataFrame(data)
-
-        # 导出为Excel文件
-        df.to_excel(excel_file, index=False, engine='openpyxl')
-
+        write_xlsx(db_url, studentname, Path(excel_file), export_key(db_url, studentname))
         print(f"成功将用户名 '{studentname}' 的数据导出到 {excel_file}")
     except Exception as e:
         print(f"发生错误: {e}")
-    finally:
-        # 关闭会话
-        session.close()
+
+# --- 账号身份解析 ---
+# 学生/教师 ID 与姓名互查经由进程内缓存，未命中的标识合并为一次 IN 查询；返回只读的身份元组而不是 ORM 对象
+StudentIdentity = namedtuple("StudentIdentity", ["studentid", "studentname"])
+TeacherIdentity = namedtuple("TeacherIdentity", ["teacherid", "teachername"])
+_IDENTITY_ROLES = {
+    "student": (Student.studentid, Student.studentname, StudentIdentity),
+    "teacher": (Teacher.teacherid, Teacher.teachername, TeacherIdentity),
+}
+
+# 返回 {标识: 身份元组}，int 标识按 ID、str 标识按姓名查找，不存在的标识不在结果中
+def resolve_identities(session, role: str, identifiers: List[Union[int, str]]) -> Dict[Union[int, str], tuple]:
+    id_column, name_column, identity = _IDENTITY_ROLES[role]
+    found, missing = identity_cache.get_many(role, identifiers)
+    if missing:
+        ids = [i for i in missing if isinstance(i, int)]
+        names = [i for i in missing if isinstance(i, str)]
+        for row in session.execute(select(id_column, name_column).where(or_(id_column.in_(ids), name_column.in_(names)))):
+            identity_cache.put(role, row[0], row[1])
+            for identifier in (row[0], row[1]):
+                if identifier in missing:
+                    found[identifier] = (row[0], row[1])
+    return {identifier: identity(*found[identifier]) for identifier in identifiers if identifier in found}
+
+def resolve_identity(session, role: str, identifier: Union[int, str]) -> Optional[tuple]:
+    return resolve_identities(session, role, [identifier]).get(identifier)
+
+# 高频查询语句单独构造，migrations 的索引检查对同一语句执行 EXPLAIN
+def latest_score_query(studentname: str):
+    return (
+        select(ConversationScore)
+        .where(ConversationScore.studentname == studentname)
+        .order_by(ConversationScore.timestamp.desc())
+        .limit(1)
+    )
+
+def classroom_query(teacherid: int, classname: str):
+    return select(Classroom).where(Classroom.teacherid == teacherid, Classroom.classname == classname)
+
+def membership_query(class_id: int, studentid: int):
+    return select(ClassMembership.id).where(ClassMembership.class_id == class_id, ClassMembership.studentid == studentid)
+
+# 从某教师的某个班级移除学生（班级按 教师+班级名 子查询定位）
+def remove_member_statement(teacherid: int, classname: str, studentid: int):
+    return delete(ClassMembership).where(
+        ClassMembership.studentid == studentid,
+        ClassMembership.class_id.in_(select(Classroom.id).where(Classroom.teacherid == teacherid, Classroom.classname == classname)),
+    )
+
+# 按教师与班级名查找班级（命中唯一索引）
+def _find_classroom(session, teacherid: int, classname: str) -> Optional[Classroom]:
+    return session.execute(classroom_query(teacherid, classname)).scalar_one_or_none()
+
+def _get_or_create_classroom(session, teacherid: int, classname: str) -> Classroom:
+    classroom = _find_classroom(session, teacherid, classname)
+    if classroom is None:
+        classroom = Classroom(teacherid=teacherid, classname=classname)
+        session.add(classroom)
+        session.flush()
+        print(f"创建班级 {classname}")
+    return classroom
+
+def _is_member(session, class_id: int, studentid: int) -> bool:
+    return session.execute(membership_query(class_id, studentid)).first() is not None
 
 # 创建班级/拉学生进班级
 def create_or_add_class(db_url: str, teacherid: int, student_identifier: Union[int, str], classname: str) -> bool:
@@ -64,58 +129,31 @@ def create_or_add_class(db_url: str, teacherid: int, student_identifier: Union[i
             raise ValueError("班级名称不能为空")
         if not isinstance(student_identifier, (int, str)):
             raise TypeError("学生标识符必须是整数或字符串")
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
 
         with Session() as session:  # 自动会话管理
             try:
                 # 验证教师存在性
-                teacher = session.query(Teacher).get(teacherid)
+                teacher = resolve_identity(session, "teacher", teacherid)
                 if not teacher:
                     print(f"教师ID {teacherid} 不存在")
                     return False
                 # 学生查询逻辑
-                if isinstance(student_identifier, int):
-                    student = session.query(Student).get(student_identifier)
-                else:
-                    student = session.query(Student).filter(Student.studentname == student_identifier).first()
+                student = resolve_identity(session, "student", student_identifier)
                 if not student:
                     print(f"学生不存在: {student_identifier}")
                     return False
 
-                # 检查班级是否已存在
-                existing_class = session.query(Class).filter(Class.teacherid == teacherid, Class.classname == classname).first()
-
-                if existing_class:
-                    print(f"班级 {classname} 已存在")
-                    existing_student = session.query(Student).filter(Class.teacherid == teacherid, Class.classname == classname, Class.studentid == student.studentid).first()
-                    if existing_student:
-                        print("已实现，无需创建或添加")
-                        return True
-                    else:
-                        # 创建班级记录
-                        new_roll = Class(
-                            teacherid=teacherid,
-                            classname=classname,
-                            studentid=student.studentid
-                        )
-                        session.add(new_roll)
-                        session.commit()
-                        print(f"教师 {teacher.teachername} 成功创建班级 {classname}")
-                        print(f"关联学生: {student.studentname}(ID:{student.studentid})")
-                        return True
-                else:
-                    # 创建班级记录
-                    new_class = Class(
-                        teacherid=teacherid,
-                        classname=classname,
-                        studentid=student.studentid
-                    )
-                    session.add(new_class)
-                    session.commit()
-                    print(f"教师 {teacher.teachername} 成功创建班级 {classname}")
-                    print(f"关联学生: {student.studentname}(ID:{student.studentid})")
+                # 班级不存在时先创建
+                classroom = _get_or_create_classroom(session, teacherid, classname)
+                if _is_member(session, classroom.id, student.studentid):
+                    print("已实现，无需创建或添加")
                     return True
+                session.add(ClassMembership(class_id=classroom.id, studentid=student.studentid))
+                session.commit()
+                print(f"教师 {teacher.teachername} 成功创建班级 {classname}")
+                print(f"关联学生: {student.studentname}(ID:{student.studentid})")
+                return True
             except Exception as inner_e:
                 session.rollback()  # 回滚事务
                 print(f"数据库操作失败: {inner_e}")
@@ -136,19 +174,20 @@ def dissolve_class(db_url: str, teacherid: int, classname: str) -> bool:
         if not classname.strip():
             raise ValueError("班级名称不能为空")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
         with Session() as session:  # 使用上下文管理器自动处理会话
             try:
                 # 精确查询：确保教师ID和班级名匹配
-                deleted_count = session.query(Class).filter(Class.teacherid == teacherid, Class.classname == classname).delete()
-                session.commit()
-                if deleted_count > 0:
-                    print(f"成功删除班级: {classname}，共{deleted_count} 名学生")
-                    return True
-                else:
-                    print(print(f"未找到教师 {teacherid} 创建的班级 {classname}"))
+                classroom = _find_classroom(session, teacherid, classname)
+                if classroom is None:
+                    print(f"未找到教师 {teacherid} 创建的班级 {classname}")
                     return False
+                # 先删成员再删班级（不依赖数据库的级联删除）
+                deleted_count = session.execute(delete(ClassMembership).where(ClassMembership.class_id == classroom.id)).rowcount
+                session.delete(classroom)
+                session.commit()
+                print(f"成功删除班级: {classname}，共{deleted_count} 名学生")
+                return True
             except Exception as inner_e:
                 session.rollback()  # 回滚事务
                 print(f"数据库操作失败: {inner_e}")
@@ -171,36 +210,23 @@ def delete_member_from_class(db_url: str, teacher_identifier: Union[int, str], s
         if not isinstance(student_identifier, (int, str)):
             raise TypeError("学生标识符类型错误")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
         with Session() as session:
             with session.begin():
             # 验证教师权限
-                if isinstance(teacher_identifier, int):
-                    teacher = session.query(Teacher).get(teacher_identifier)
-                else:
-                    teacher = session.query(Teacher).filter(Teacher.teachername == teacher_identifier).first()
+                teacher = resolve_identity(session, "teacher", teacher_identifier)
                 if not teacher:
                     print("教师账号不存在")
                     return False
-
-                # 查询目标班级
-                target_class = session.query(Class).filter(Class.teacherid == teacher.teacherid, Class.classname == classname).first()
-                if not target_class:
-                    print(f"教师 {teacher.teachername} 未创建班级 {classname}")
-                    return False
                 # 查询要移除的学生
-                if isinstance(student_identifier, int):
-                    student = session.query(Student).get(student_identifier)
-                else:
-                    student = session.query(Student).filter(Student.studentname == student_identifier).first()
+                student = resolve_identity(session, "student", student_identifier)
                 if not student:
                     print("学生账号不存在")
                     return False
-                # 执行删除操作
-                result = session.query(Class).filter(Class.teacherid == teacher.teacherid, Class.classname == classname, Class.studentid == student.studentid).delete()
+                # 执行删除操作（班级按 教师+班级名 子查询定位）
+                result = session.execute(remove_member_statement(teacher.teacherid, classname, student.studentid)).rowcount
                 if not result:
-                    print("踢出失败")
+                    print(f"踢出失败：教师 {teacher.teachername} 的班级 {classname} 中没有该学生")
                     return False
                 else:
                     print(f"已从班级 {classname} 移除学生 {student.studentname}")
@@ -212,6 +238,112 @@ def delete_member_from_class(db_url: str, teacher_identifier: Union[int, str], s
         print(f"操作失败: {str(e)}")
         return False
 
+# --- 批量名单管理 ---
+# 每个批量操作固定执行少量查询：教师 1 次、学生 1 次 IN 查询、班级 1 次、现有成员 1 次，写入为单条多行 INSERT / DELETE，全部在一个事务内完成
+# 返回逐个学生的处理结果 {"identifier", "studentid", "studentname", "status"}
+
+def _resolve_teacher(session, teacher_identifier: Union[int, str]) -> TeacherIdentity:
+    teacher = resolve_identity(session, "teacher", teacher_identifier)
+    if not teacher:
+        raise ValueError("教师账号不存在")
+    return teacher
+
+# 解析学生 ID/姓名，返回 {标识: (studentid, studentname)}，不存在的标识不在结果中
+def _resolve_students(session, student_identifiers: List[Union[int, str]]) -> Dict[Union[int, str], tuple]:
+    return resolve_identities(session, "student", student_identifiers)
+
+def _members(session, classroom: Optional[Classroom], student_ids: List[int]) -> set:
+    if classroom is None:
+        return set()
+    return set(session.execute(
+        select(ClassMembership.studentid).where(ClassMembership.class_id == classroom.id, ClassMembership.studentid.in_(student_ids))
+    ).scalars())
+
+# 逐个标识生成报告，statuses 为 {studentid: 状态}；重复出现的学生只处理第一次
+def _roster_report(student_identifiers: list, resolved: dict, statuses: dict) -> List[Dict]:
+    report = []
+    seen = set()
+    for identifier in student_identifiers:
+        student = resolved.get(identifier)
+        if student is None:
+            report.append({"identifier": identifier, "studentid": None, "studentname": None, "status": "not_found"})
+            continue
+        status = "duplicate" if student[0] in seen else statuses[student[0]]
+        seen.add(student[0])
+        report.append({"identifier": identifier, "studentid": student[0], "studentname": student[1], "status": status})
+    return report
+
+def _validate_roster_args(classnames: list, student_identifiers: list):
+    if any(not classname or not classname.strip() for classname in classnames):
+        raise ValueError("班级名称不能为空")
+    if not student_identifiers:
+        raise ValueError("学生列表不能为空")
+
+# 批量拉学生进班级（班级不存在时自动创建）
+def bulk_add_to_class(db_url: str, teacher_identifier: Union[int, str], classname: str, student_identifiers: List[Union[int, str]]) -> Dict:
+    _validate_roster_args([classname], student_identifiers)
+    Session = get_session_factory(db_url)
+    with Session() as session, session.begin():
+        teacherid, teachername = _resolve_teacher(session, teacher_identifier)
+        resolved = _resolve_students(session, student_identifiers)
+        student_ids = list({student[0] for student in resolved.values()})
+        classroom = _get_or_create_classroom(session, teacherid, classname)
+        existing = _members(session, classroom, student_ids)
+        to_add = [sid for sid in student_ids if sid not in existing]
+        if to_add:
+            session.execute(insert(ClassMembership), [{"class_id": classroom.id, "studentid": sid} for sid in to_add])
+        statuses = {sid: "already_member" if sid in existing else "added" for sid in student_ids}
+    print(f"教师 {teachername} 向班级 {classname} 批量添加 {len(to_add)} 名学生")
+    return {"teacher": teachername, "classname": classname, "added": len(to_add),
+            "results": _roster_report(student_identifiers, resolved, statuses)}
+
+# 批量移出班级成员
+def bulk_remove_from_class(db_url: str, teacher_identifier: Union[int, str], classname: str, student_identifiers: List[Union[int, str]]) -> Dict:
+    _validate_roster_args([classname], student_identifiers)
+    Session = get_session_factory(db_url)
+    with Session() as session, session.begin():
+        teacherid, teachername = _resolve_teacher(session, teacher_identifier)
+        resolved = _resolve_students(session, student_identifiers)
+        student_ids = list({student[0] for student in resolved.values()})
+        classroom = _find_classroom(session, teacherid, classname)
+        existing = _members(session, classroom, student_ids)
+        if existing:
+            session.execute(
+                delete(ClassMembership).where(ClassMembership.class_id == classroom.id, ClassMembership.studentid.in_(existing))
+            )
+        statuses = {sid: "removed" if sid in existing else "not_member" for sid in student_ids}
+    print(f"教师 {teachername} 从班级 {classname} 批量移出 {len(existing)} 名学生")
+    return {"teacher": teachername, "classname": classname, "removed": len(existing),
+            "results": _roster_report(student_identifiers, resolved, statuses)}
+
+# 批量把学生从一个班级调到另一个班级（同一教师名下）
+def bulk_move_between_classes(db_url: str, teacher_identifier: Union[int, str], from_classname: str, to_classname: str, student_identifiers: List[Union[int, str]]) -> Dict:
+    _validate_roster_args([from_classname, to_classname], student_identifiers)
+    if from_classname == to_classname:
+        raise ValueError("源班级与目标班级不能相同")
+    Session = get_session_factory(db_url)
+    with Session() as session, session.begin():
+        teacherid, teachername = _resolve_teacher(session, teacher_identifier)
+        resolved = _resolve_students(session, student_identifiers)
+        student_ids = list({student[0] for student in resolved.values()})
+        source = _find_classroom(session, teacherid, from_classname)
+        if source is None:
+            raise ValueError(f"教师 {teachername} 未创建班级 {from_classname}")
+        target = _get_or_create_classroom(session, teacherid, to_classname)
+        in_source = _members(session, source, student_ids)
+        in_target = _members(session, target, student_ids)
+        to_insert = [sid for sid in in_source if sid not in in_target]
+        if in_source:
+            session.execute(
+                delete(ClassMembership).where(ClassMembership.class_id == source.id, ClassMembership.studentid.in_(in_source))
+            )
+        if to_insert:
+            session.execute(insert(ClassMembership), [{"class_id": target.id, "studentid": sid} for sid in to_insert])
+        statuses = {sid: "moved" if sid in in_source else ("already_member" if sid in in_target else "not_member") for sid in student_ids}
+    print(f"教师 {teachername} 将 {len(in_source)} 名学生从班级 {from_classname} 调到 {to_classname}")
+    return {"teacher": teachername, "from_classname": from_classname, "to_classname": to_classname, "moved": len(in_source),
+            "results": _roster_report(student_identifiers, resolved, statuses)}
+
 # 获取指定班级学生列表
 def get_class_details(db_url: str, teacherid: int, classname: str) -> Dict[str, Union[str, List[str]]]:
     # Returns:
@@ -234,27 +366,24 @@ def get_class_details(db_url: str, teacherid: int, classname: str) -> Dict[str,
         if not classname.strip():
             raise ValueError("班级名称不能为空")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
 
         with (Session() as session):
             # 获取教师信息
-            teacher = session.query(Teacher).get(teacherid)
+            teacher = resolve_identity(session, "teacher", teacherid)
             if not teacher:
                 print(f"教师ID {teacherid} 不存在")
                 return result_template
             result_template["teacher"] = teacher.teachername
 
-            # 获取班级所有学生ID
-            class_records = session.query(Class).filter(Class.teacherid == teacherid, Class.classname == classname, Class.studentid.isnot(None)) .all()
-
-            # 提取有效学生ID
-            student_ids = [cr.studentid for cr in class_records if cr.studentid]
-            if not student_ids:
-                return result_template
-
-            # 批量获取学生详细信息
-            students = session.query(Student.studentid, Student.studentname).filter(Student.studentid.in_(student_ids)).all()
+            # 一次联表查询获取班级成员（按加入顺序）
+            students = session.execute(
+                select(Student.studentid, Student.studentname)
+                .join(ClassMembership, ClassMembership.studentid == Student.studentid)
+                .join(Classroom, Classroom.id == ClassMembership.class_id)
+                .where(Classroom.teacherid == teacherid, Classroom.classname == classname)
+                .order_by(ClassMembership.id)
+            ).all()
 
             # 构造学生信息字典列表
             result_template["students"] = [{"id": s.studentid, "name": s.studentname}for s in students]
@@ -267,6 +396,99 @@ def get_class_details(db_url: str, teacherid: int, classname: str) -> Dict[str,
         print(f"查询失败: {str(e)}")
         return result_template
 
+# 评分维度（数据库列名 -> 返回字段名），与 /evaluation 接口一致
+SCORE_COLUMNS = {
+    "question_depth": "追问深度",
+    "response_timeliness": "反馈及时性",
+    "correction_proactivity": "修正主动性",
+    "emotional_engagement": "情感参与度",
+    "total_score": "综合评分",
+}
+
+# 班级整体学情：每名成员的最新评分、时间窗口内各维度平均分与提问次数
+# 无论班级人数多少只执行固定数量的查询，统计在 pandas 中按列向量化完成
+def get_class_analytics(db_url: str, teacherid: int, classname: str, starttime: datetime, endtime: datetime) -> Dict[str, Union[str, List]]:
+    result_template = {
+        "teacher": "",
+        "classname": classname,
+        "start": starttime.strftime("%Y-%m-%d"),
+        "end": endtime.strftime("%Y-%m-%d"),
+        "students": []
+    }
+    if starttime > endtime:
+        raise ValueError("起始时间不能晚于结束时间")
+    Session = get_session_factory(db_url)
+    with Session() as session:
+        teacher = resolve_identity(session, "teacher", teacherid)
+        if not teacher:
+            raise ValueError(f"教师ID {teacherid} 不存在")
+        result_template["teacher"] = teacher.teachername
+
+        # 1. 班级成员（一次联表查询）
+        members = pd.read_sql(
+            select(Student.studentid, Student.studentname)
+            .join(ClassMembership, ClassMembership.studentid == Student.studentid)
+            .join(Classroom, Classroom.id == ClassMembership.class_id)
+            .where(Classroom.teacherid == teacherid, Classroom.classname == classname)
+            .distinct(),
+            session.connection(),
+        )
+        if members.empty:
+            return result_template
+        names = members["studentname"].tolist()
+        score_fields = [getattr(ConversationScore, column) for column in SCORE_COLUMNS]
+
+        # 2. 每名成员的最新一条评分（与 /evaluation 相同，按日期倒序，同一天取最后写入的一条）
+        ranked = (
+            select(ConversationScore.studentname, ConversationScore.timestamp, *score_fields,
+                   func.row_number().over(partition_by=ConversationScore.studentname,
+                                          order_by=(ConversationScore.timestamp.desc(), ConversationScore.id.desc())).label("rn"))
+            .where(ConversationScore.studentname.in_(names))
+            .subquery()
+        )
+        latest = pd.read_sql(
+            select(*[column for column in ranked.c if column.name != "rn"]).where(ranked.c.rn == 1),
+            session.connection(),
+        ).set_index("studentname")
+
+        # 3. 时间窗口内的评分，按学生求各维度平均值
+        window = pd.read_sql(
+            select(ConversationScore.studentname, *score_fields)
+            .where(ConversationScore.studentname.in_(names),
+                   ConversationScore.timestamp >= starttime.date(), ConversationScore.timestamp <= endtime.date()),
+            session.connection(),
+        )
+        averages = window.groupby("studentname")[list(SCORE_COLUMNS)].mean().round(2)
+
+        # 4. 时间窗口内的提问次数（读取每日汇总表）
+        activity = pd.read_sql(
+            select(StudentDailyActivity.studentname, StudentDailyActivity.question_count)
+            .where(StudentDailyActivity.studentname.in_(names),
+                   StudentDailyActivity.day >= starttime.date(), StudentDailyActivity.day <= endtime.date()),
+            session.connection(),
+        )
+        counts = activity.groupby("studentname")["question_count"].sum()
+
+    # 按成员对齐各项统计，缺失值（无记录）转为 None / 0
+    members = members.set_index("studentname")
+    members["frequency"] = counts.reindex(members.index, fill_value=0).astype(int)
+    latest = latest.reindex(members.index).astype(object).where(latest.reindex(members.index).notna(), None)
+    averages = averages.reindex(members.index).astype(object).where(averages.reindex(members.index).notna(), None)
+    for name, row in members.iterrows():
+        result_template["students"].append({
+            "id": int(row["studentid"]),
+            "name": name,
+            "frequency": int(row["frequency"]),
+            "latest": None if latest.at[name, "total_score"] is None else {
+                "timestamp": str(latest.at[name, "timestamp"]),
+                **{label: latest.at[name, column] for column, label in SCORE_COLUMNS.items()},
+            },
+            "average": None if averages.at[name, "total_score"] is None else {
+                label: averages.at[name, column] for column, label in SCORE_COLUMNS.items()
+            },
+        })
+    return result_template
+
 # 获取学生提问频率
 def get_frequency(db_url: str, student_identifier: Union[int, str], starttime: datetime, endtime: datetime) -> Dict[str, Union[str, int]]:
     # Return:
@@ -287,17 +509,14 @@ def get_frequency(db_url: str, student_identifier: Union[int, str], starttime: d
         if starttime > endtime:
             raise ValueError("起始时间不能晚于结束时间")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
 
         with Session() as session:
-            if isinstance(student_identifier, int):
-                student = session.query(Student).get(student_identifier)
-            else:
-                student = session.query(Student).filter(Student.studentname == student_identifier).first()
+            student = resolve_identity(session, "student", student_identifier)
             if not student:
                 raise ValueError("学生账号不存在")
-            frequency = session.query(ConversationScore).filter(ConversationScore.studentname == student.studentname, ConversationScore.timestamp >= starttime, ConversationScore.timestamp <= endtime).count()
+            # 按天从每日汇总表统计，避免扫描原始评分记录
+            frequency = count_questions(session, student.studentname, starttime, endtime)
             # 构建结果
             result.update({
                 "studentid": student.studentid,
@@ -306,8 +525,8 @@ def get_frequency(db_url: str, student_identifier: Union[int, str], starttime: d
             })
             return result
 
-    except SQLAlchemyError as e:
-        session.rollback()
+    except SQLAlchemyError:
+        # 会话已由上下文管理器关闭并回滚
         raise
 
 # 获取学生身份
@@ -317,14 +536,10 @@ def get_studentname(db_url: str, student_identifier: Union[int, str]) -> str:
         if not isinstance(student_identifier, (int, str)):
             raise ValueError("学生标识符必须是整数或字符串")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
 
         with Session() as session:
-            if isinstance(student_identifier, int):
-                student = session.query(Student).get(student_identifier)
-            else:
-                student = session.query(Student).filter(Student.studentname == student_identifier).first()
+            student = resolve_identity(session, "student", student_identifier)
             if not student:
                 raise ValueError("学生账号不存在")
 
@@ -339,14 +554,10 @@ def get_teachername(db_url: str, teacher_identifier: Union[int, str]) -> str:
         if not isinstance(teacher_identifier, (int, str)):
             raise ValueError("教师标识符必须是整数或字符串")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
 
         with Session() as session:
-            if isinstance(teacher_identifier, int):
-                teacher = session.query(Teacher).get(teacher_identifier)
-            else:
-                teacher = session.query(Teacher).filter(Teacher.teachername == teacher_identifier).first()
+            teacher = resolve_identity(session, "teacher", teacher_identifier)
             if not teacher:
                 raise ValueError("教师账号不存在")
 
@@ -365,57 +576,40 @@ def join_class(db_url: str, teacher_identifier: Union[int, str], student_identif
         if not isinstance(student_identifier, (int, str)):
             raise TypeError("学生标识符类型错误")
 
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
+        Session = get_session_factory(db_url)
         with Session() as session:
             try:
                 # 验证教师权限
-                if isinstance(teacher_identifier, int):
-                    teacher = session.query(Teacher).get(teacher_identifier)
-                else:
-                    teacher = session.query(Teacher).filter(Teacher.teachername == teacher_identifier).first()
+                teacher = resolve_identity(session, "teacher", teacher_identifier)
                 if not teacher:
                     print("教师账号不存在")
                     return False
 
                 # 查询目标班级
-                target_class = session.query(Class).filter(Class.teacherid == teacher.teacherid,
-                                                           Class.classname == classname).first()
-                if not target_class:
+                classroom = _find_classroom(session, teacher.teacherid, classname)
+                if classroom is None:
                     print(f"教师 {teacher.teachername} 未创建班级 {classname}")
                     return False
                 # 查询要加入的学生
-                if isinstance(student_identifier, int):
-                    student = session.query(Student).get(student_identifier)
-                else:
-                    student = session.query(Student).filter(Student.studentname == student_identifier).first()
+                student = resolve_identity(session, "student", student_identifier)
                 if not student:
                     print("学生账号不存在")
                     return False
-                # 执行加入操作
                 # 检查学生是否已加入
-                existing_student = session.query(Class).filter(Class.teacherid == teacher.teacherid,Class.classname == classname,Student.studentid == student.studentid).first()
-
-                if existing_student:
-                    print(f"班级 {classname} 已存在")
-                    return True
-                else:
-                    # 创建班级记录
-                    new_class = Class(
-                        teacherid=teacher.teacherid,
-                        classname=classname,
-                        studentid=student.studentid
-                    )
-                    session.add(new_class)
-                    session.commit()
-                    print(f"学生: {student.studentname}(ID:{student.studentid})")
-                    print(f"加入 {teacher.teachername} 的 {classname} 成功")
+                if _is_member(session, classroom.id, student.studentid):
+                    print(f"学生 {student.studentname} 已在班级 {classname} 中")
                     return True
+                # 执行加入操作
+                session.add(ClassMembership(class_id=classroom.id, studentid=student.studentid))
+                session.commit()
+                print(f"学生: {student.studentname}(ID:{student.studentid})")
+                print(f"加入 {teacher.teachername} 的 {classname} 成功")
+                return True
             except Exception as inner_e:
                 session.rollback()  # 回滚事务
                 print(f"数据库操作失败: {inner_e}")
+                return False
 
     except Exception as e:
         print(f"发生错误: {e}")
-    finally:
-        session.close()
\ No newline at end of file
+        return False
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+
+from .config import TEACHER_UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE
+from .metrics import incr
+
+# 上传资料按内容去重：每个目录下的 .upload_hashes.json 记录 {文件名: {"sha256", "size", "mtime_ns"}}，
+# 同名文件内容未变时不再重复写入；不同文件名之间不共享数据（应用会原地改写部分文件，硬链接会相互影响）
+INDEX_NAME = ".upload_hashes.json"
+
+_locks = defaultdict(threading.Lock)
+
+def _load_index(folder: Path) -> dict:
+    try:
+        with open(folder / INDEX_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_index(folder: Path, index: dict):
+    tmp_path = folder / f"{INDEX_NAME}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, folder / INDEX_NAME)
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 索引项对应的文件仍存在且未被改动时才视为有效
+def _entry_valid(folder: Path, filename: str, entry: dict) -> bool:
+    try:
+        stat = (folder / filename).stat()
+    except OSError:
+        return False
+    return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+def _record(index: dict, folder: Path, filename: str, sha256: str):
+    stat = (folder / filename).stat()
+    index[filename] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+# 同名文件已是相同内容时丢弃临时文件，否则原子替换；在线程中执行（可能需要对旧文件计算哈希）
+def _commit_upload(folder: Path, tmp_path: Path, filename: str, sha256: str, size: int) -> bool:
+    target = folder / filename
+    with _locks[str(folder)]:
+        # 旧版索引以哈希为键，直接丢弃
+        index = {name: entry for name, entry in _load_index(folder).items() if "sha256" in entry}
+        entry = index.get(filename)
+        if entry and _entry_valid(folder, filename, entry):
+            unchanged = entry["sha256"] == sha256
+        else:
+            # 旧文件不在索引中或已被改动：大小一致时补算哈希
+            unchanged = target.exists() and target.stat().st_size == size and _file_sha256(target) == sha256
+        if not unchanged:
+            os.replace(tmp_path, target)
+        if not unchanged or not entry or entry.get("sha256") != sha256:
+            _record(index, folder, filename, sha256)
+            _save_index(folder, index)
+        return unchanged
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+# 分块写入临时文件并同时计算哈希，超过上限返回 413；完成后去重或原子替换到目标文件名。
+# 写盘与哈希在线程中执行，大文件上传不阻塞事件循环
+async def save_upload(file: UploadFile, folder: Path, filename: str, max_bytes: int = TEACHER_UPLOAD_MAX_BYTES) -> dict:
+    folder = Path(folder)
+    filename = Path(filename).name   # 去掉客户端传入的路径部分
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=folder, prefix=".upload-", suffix=".tmp")
+    tmp_path = Path(tmp_name)
+    try:
+        buffer = os.fdopen(fd, "wb")
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"文件不能超过 {max_bytes // 1024 // 1024} MB")
+                await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+        finally:
+            await asyncio.to_thread(buffer.close)
+        sha256 = digest.hexdigest()
+        if await asyncio.to_thread(_commit_upload, folder, tmp_path, filename, sha256, size):
+            incr("uploads.deduplicated")
+            incr("uploads.bytes_saved", size)
+            return {"filename": filename, "size": size, "sha256": sha256, "deduplicated": True}
+        incr("uploads.bytes_written", size)
+        return {"filename": filename, "size": size, "sha256": sha256, "deduplicated": False}
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,116 @@
+import itertools
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .chat_log import read_last
+from .config import ENVPATH, HISTORY_MAX_USERS, HISTORY_MAX_BYTES, HISTORY_MAX_TURNS, HISTORY_LOAD_TURNS
+from .metrics import incr
+
+def _message_size(message: str) -> int:
+    return len(message.encode("utf-8"))
+
+# 通过聊天记录索引只读取最近 turns 轮，转换为 ["用户: ...", "AI: ..."] 列表
+def load_recent_history(username: str, turns: int = HISTORY_LOAD_TURNS) -> list:
+    history = []
+    for turn in read_last(Path(ENVPATH) / username, username, turns):
+        history.append(f"用户: {turn['user']}")
+        history.append(f"AI: {turn['ai']}")
+    return history
+
+# 按用户缓存最近的对话历史，超过用户数或总字节数上限时淘汰最久未使用的用户
+class HistoryStore:
+    def __init__(self, max_users: int = HISTORY_MAX_USERS, max_bytes: int = HISTORY_MAX_BYTES, max_turns: int = HISTORY_MAX_TURNS):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self._entries = OrderedDict()   # {username: [消息]}
+        self._sizes = {}                # {username: 字节数}
+        self._total_bytes = 0
+        self._offsets = {}              # {username: (加载批次, 已从列表头部裁掉的消息数)}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # 获取用户历史，首次访问时从磁盘懒加载最近的若干轮
+    def get(self, username: str) -> list:
+        with self._lock:
+            if username in self._entries:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                incr("history_store.hits")
+                return self._entries[username]
+            self.misses += 1
+            incr("history_store.misses")
+        history = load_recent_history(username)
+        with self._lock:
+            # 并发加载时以先写入的为准
+            if username not in self._entries:
+                self._entries[username] = history
+                self._offsets[username] = (next(self._generations), 0)
+                self._sizes[username] = sum(_message_size(m) for m in history)
+                self._total_bytes += self._sizes[username]
+                self._trim_user(username)
+                self._evict()
+            self._entries.move_to_end(username)
+            return self._entries[username]
+
+    def append(self, username: str, *messages: str):
+        history = self.get(username)
+        with self._lock:
+            history.extend(messages)
+            added = sum(_message_size(m) for m in messages)
+            if username in self._entries:
+                self._sizes[username] += added
+                self._total_bytes += added
+                self._trim_user(username)
+                self._evict()
+
+    # 列表第 0 条在本批次历史中的绝对位置：(加载批次, 偏移)；裁剪头部后偏移增加，重新加载后批次改变
+    def offset(self, username: str) -> tuple:
+        with self._lock:
+            return self._offsets.get(username, (0, 0))
+
+    def invalidate(self, username: str):
+        with self._lock:
+            if username in self._entries:
+                self._remove(username)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, username: str):
+        self._entries.pop(username)
+        self._offsets.pop(username, None)
+        self._total_bytes -= self._sizes.pop(username)
+
+    # 单个用户的历史只保留最近 max_turns 轮（更早的内容已落盘并折叠进摘要）
+    def _trim_user(self, username: str):
+        history = self._entries[username]
+        overflow = len(history) - self.max_turns * 2
+        if overflow > 0:
+            overflow += overflow % 2
+            removed = sum(_message_size(m) for m in history[:overflow])
+            del history[:overflow]
+            generation, trimmed = self._offsets[username]
+            self._offsets[username] = (generation, trimmed + overflow)
+            self._sizes[username] -= removed
+            self._total_bytes -= removed
+
+    def _evict(self):
+        while len(self._entries) > 1 and (len(self._entries) > self.max_users or self._total_bytes > self.max_bytes):
+            username = next(iter(self._entries))
+            self._remove(username)
+            self.evictions += 1
+            incr("history_store.evictions")
+
+history_store = HistoryStore()
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Union
+
+from .config import IDENTITY_CACHE_MAX_ENTRIES, IDENTITY_CACHE_TTL
+from .metrics import incr
+
+# 学生/教师身份缓存：按 ID（int）或姓名（str）双向查找 (id, name)，过期时间 + LRU 淘汰
+# 只缓存存在的账号；注册、改名等写操作后调用 invalidate
+class IdentityCache:
+    def __init__(self, max_entries: int = IDENTITY_CACHE_MAX_ENTRIES, ttl: float = IDENTITY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # {(角色, 标识): (id, name, 过期时间)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, role: str, identifier: Union[int, str]) -> Optional[tuple]:
+        key = (role, identifier)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                incr("identity_cache.hits")
+                return entry[:2]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        incr("identity_cache.misses")
+        return None
+
+    # 返回 ({标识: (id, name)}, [未命中的标识])
+    def get_many(self, role: str, identifiers: list) -> tuple:
+        found, missing = {}, []
+        for identifier in dict.fromkeys(identifiers):
+            entry = self.get(role, identifier)
+            if entry is None:
+                missing.append(identifier)
+            else:
+                found[identifier] = entry
+        return found, missing
+
+    def put(self, role: str, id_: int, name: str):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key in ((role, id_), (role, name)):
+                self._entries[key] = (id_, name, expires)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # 失效单个账号（同时清除 ID 与姓名两个方向），identifier 为空时清空该角色
+    def invalidate(self, role: str, identifier: Union[int, str, None] = None):
+        with self._lock:
+            if identifier is None:
+                for key in [key for key in self._entries if key[0] == role]:
+                    del self._entries[key]
+                return
+            entry = self._entries.pop((role, identifier), None)
+            if entry is not None:
+                self._entries.pop((role, entry[0]), None)
+                self._entries.pop((role, entry[1]), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            }
+
+identity_cache = IdentityCache()
@@ -0,0 +1,84 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from .config import (VL_CACHE_MAX_ENTRIES, VL_CACHE_MAX_BYTES, VL_CACHE_DIR, VL_CACHE_DISK, VL_CACHE_DISK_MAX_ENTRIES,
+                     VL_CACHE_NEAR_DUPLICATE, VL_CACHE_PHASH_DISTANCE)
+from .metrics import incr
+from .result_cache import ResultCache
+
+# 拍照识题结果缓存：以解码后图片字节的 SHA-256 + prompt + 模型为键，
+# 同班学生拍同一道题时直接复用识别结果，不再调用视觉模型
+vl_cache = ResultCache(
+    "vl_cache",
+    max_entries=VL_CACHE_MAX_ENTRIES,
+    max_bytes=VL_CACHE_MAX_BYTES,
+    disk_dir=VL_CACHE_DIR if VL_CACHE_DISK else None,
+    disk_max_entries=VL_CACHE_DISK_MAX_ENTRIES,
+)
+
+# 近似重复索引 {缓存键: (感知哈希, prompt+模型作用域)}，仅覆盖本进程内写入或命中过的条目
+_phash_index = OrderedDict()
+_phash_lock = threading.Lock()
+
+def _scope(prompt: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+def image_cache_key(image_bytes: bytes, prompt: str, model: str) -> str:
+    return hashlib.sha256(hashlib.sha256(image_bytes).digest() + _scope(prompt, model).encode("ascii")).hexdigest()
+
+# 差值哈希（dHash）：缩放为 9x8 灰度图，逐行比较相邻像素，得到 64 位指纹
+def perceptual_hash(image_bytes: bytes) -> int:
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def _remember_phash(key: str, phash: int, scope: str):
+    with _phash_lock:
+        _phash_index[key] = (phash, scope)
+        _phash_index.move_to_end(key)
+        while len(_phash_index) > VL_CACHE_MAX_ENTRIES:
+            _phash_index.popitem(last=False)
+
+def _find_near_duplicate(phash: int, scope: str):
+    with _phash_lock:
+        candidates = [(bin(phash ^ other).count("1"), key) for key, (other, other_scope) in _phash_index.items() if other_scope == scope]
+    candidates = [c for c in candidates if c[0] <= VL_CACHE_PHASH_DISTANCE]
+    return min(candidates)[1] if candidates else None
+
+def _safe_phash(image_bytes: bytes):
+    try:
+        return perceptual_hash(image_bytes)
+    except Exception as e:
+        print(f"计算感知哈希失败: {e}")
+        return None
+
+def get_cached_result(image_bytes: bytes, prompt: str, model: str):
+    key = image_cache_key(image_bytes, prompt, model)
+    value = vl_cache.get(key)
+    if value is not None or not VL_CACHE_NEAR_DUPLICATE:
+        return value
+    phash = _safe_phash(image_bytes)
+    if phash is None:
+        return None
+    near_key = _find_near_duplicate(phash, _scope(prompt, model))
+    if near_key is None:
+        return None
+    value = vl_cache.get(near_key)
+    if value is not None:
+        incr("vl_cache.near_duplicate_hits")
+    return value
+
+def put_cached_result(image_bytes: bytes, prompt: str, model: str, value):
+    key = image_cache_key(image_bytes, prompt, model)
+    vl_cache.put(key, value)
+    if VL_CACHE_NEAR_DUPLICATE:
+        phash = _safe_phash(image_bytes)
+        if phash is not None:
+            _remember_phash(key, phash, _scope(prompt, model))
@@ -0,0 +1,126 @@
+import base64
+import io
+import math
+import os
+import time
+from typing import Union
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+from .config import (IMAGE_PREP_ENABLED, IMAGE_PREP_MAX_PIXELS, IMAGE_PREP_JPEG_QUALITY, IMAGE_PREP_CROP_BORDERS,
+                     IMAGE_PREP_BORDER_TOLERANCE, IMAGE_PREP_GRAYSCALE, IMAGE_PREP_GRAYSCALE_SATURATION)
+from .metrics import incr, observe
+
+# Qwen2.5-VL：14x14 的图像块再 2x2 合并，每 28x28 像素对应 1 个视觉 token
+VISUAL_PATCH = 28
+
+# 预处理耗时分桶（毫秒）
+PREP_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000)
+
+def visual_tokens(width: int, height: int) -> int:
+    return math.ceil(width / VISUAL_PATCH) * math.ceil(height / VISUAL_PATCH)
+
+# 透明背景铺白后转为 RGB，灰度图保持单通道
+def _to_rgb(image: Image.Image) -> Image.Image:
+    if image.mode == "L":
+        return image
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+# 裁掉与左上角颜色相近的纯色边框（扫描件白边、截图黑边），保留少量边距
+def _crop_borders(image: Image.Image) -> Image.Image:
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    diff = ImageChops.difference(image, background).convert("L").point(lambda v: 255 if v > IMAGE_PREP_BORDER_TOLERANCE else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return image
+    margin = max(4, min(image.size) // 100)
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - margin), max(0, top - margin), min(image.width, right + margin), min(image.height, bottom + margin))
+    # 边框过窄时不裁剪，避免无意义的重新编码
+    if (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) > image.width * image.height * 0.95:
+        return image
+    return image.crop(bbox)
+
+# 低饱和度视为试卷/作业等文字页
+def _is_text_page(image: Image.Image) -> bool:
+    if image.mode == "L":
+        return False
+    sample = image.copy()
+    sample.thumbnail((256, 256))
+    return ImageStat.Stat(sample.convert("HSV")).mean[1] < IMAGE_PREP_GRAYSCALE_SATURATION
+
+def _downscale(image: Image.Image) -> Image.Image:
+    pixels = image.width * image.height
+    if pixels <= IMAGE_PREP_MAX_PIXELS:
+        return image
+    scale = math.sqrt(IMAGE_PREP_MAX_PIXELS / pixels)
+    size = (max(VISUAL_PATCH, int(image.width * scale)), max(VISUAL_PATCH, int(image.height * scale)))
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+# 预处理图片，返回 (图片字节, 格式)；处理后没有变小时原样返回，失败时也原样返回
+def prepare_image(image_bytes: bytes, image_format: str) -> tuple:
+    if not IMAGE_PREP_ENABLED:
+        return image_bytes, image_format
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as original:
+            before = original.size
+            rotated = original.getexif().get(0x0112, 1) != 1
+            image = _to_rgb(ImageOps.exif_transpose(original))
+        if IMAGE_PREP_CROP_BORDERS:
+            image = _crop_borders(image)
+        if IMAGE_PREP_GRAYSCALE and _is_text_page(image):
+            image = image.convert("L")
+        image = _downscale(image)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=IMAGE_PREP_JPEG_QUALITY, optimize=True)
+        prepared = output.getvalue()
+    except Exception as e:
+        print(f"图片预处理失败，使用原图: {e}")
+        incr("image_prep.failures")
+        return image_bytes, image_format
+
+    tokens_before = visual_tokens(*before)
+    if len(prepared) >= len(image_bytes) and image.size == before and not rotated:
+        prepared, image_format, tokens_after = image_bytes, image_format, tokens_before
+    else:
+        image_format, tokens_after = "jpeg", visual_tokens(*image.size)
+    incr("image_prep.bytes_before", len(image_bytes))
+    incr("image_prep.bytes_after", len(prepared))
+    incr("image_prep.tokens_before", tokens_before)
+    incr("image_prep.tokens_after", tokens_after)
+    observe("image_prep.ms", (time.perf_counter() - started) * 1000, PREP_BUCKETS)
+    print(f"图片预处理: {before[0]}x{before[1]} -> {image.width}x{image.height}，"
+          f"{len(image_bytes)} -> {len(prepared)} 字节，视觉 token {tokens_before} -> {tokens_after}")
+    return prepared, image_format
+
+# 离线识题入口：图片字节、Base64 data URI 或本地路径预处理后以 PIL 图片交给 qwen_vl_utils，URL 等其他输入原样返回
+def prepare_photograph(photograph: Union[bytes, str]):
+    if isinstance(photograph, bytes):
+        image_bytes = photograph
+    elif not IMAGE_PREP_ENABLED:
+        return photograph
+    elif photograph.startswith("data:image"):
+        header, _, data = photograph.partition(",")
+        if ";base64" not in header:
+            return photograph
+        try:
+            image_bytes = base64.b64decode(data)
+        except ValueError:
+            return photograph
+    elif os.path.isfile(photograph.removeprefix("file://")):
+        with open(photograph.removeprefix("file://"), "rb") as f:
+            image_bytes = f.read()
+    else:
+        return photograph
+    prepared, _ = prepare_image(image_bytes, "")
+    try:
+        image = Image.open(io.BytesIO(prepared))
+        image.load()
+    except Exception:
+        return photograph
+    return image
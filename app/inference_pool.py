@@ -0,0 +1,337 @@
+import asyncio
+import itertools
+import multiprocessing
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+from .batching import MicroBatcher
+from .config import (OFFLINE_WORKERS, OFFLINE_TASK_TIMEOUT, OFFLINE_STREAM_IDLE_TIMEOUT, OFFLINE_MODEL_REAP_INTERVAL,
+                     TEXT_BATCH_MAX_SIZE, TEXT_BATCH_MAX_WAIT_MS)
+from .metrics import incr, observe
+
+# 离线推理运行在独立的工作进程中：API 进程维护任务队列并通过管道分发给空闲的工作进程，
+# 模型崩溃（如显存溢出被杀）只影响工作进程，进程池会自动拉起新的工作进程
+
+TASK_MS_BUCKETS = (100, 250, 500, 1000, 2000, 5000, 10000, 30000, 60000, 180000)
+
+class InferenceError(Exception):
+    pass
+
+class InferenceTimeout(InferenceError):
+    pass
+
+class ClientDisconnected(InferenceError):
+    pass
+
+class WorkerCrashed(InferenceError):
+    pass
+
+# --- 工作进程 ---
+# 每个工作进程通过自己的一对管道收发消息，一次只执行一个任务
+def _worker_main(worker_id: int, task_conn, result_conn, cancel_value):
+    from transformers import StoppingCriteria, StoppingCriteriaList
+    from .model_registry import model_registry
+
+    # 被取消的任务在下一个生成步停止
+    class CancelCriteria(StoppingCriteria):
+        def __init__(self, task_id: int):
+            self.task_id = task_id
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return cancel_value.value == self.task_id
+
+    while True:
+        # 空闲时上报模型驻留情况（空闲卸载在工作进程内发生）
+        if not task_conn.poll(OFFLINE_MODEL_REAP_INTERVAL):
+            result_conn.send(("stats", worker_id, model_registry.stats()))
+            continue
+        task = task_conn.recv()
+        if task is None:
+            break
+        task_id, kind, args = task
+        criteria = StoppingCriteriaList([CancelCriteria(task_id)])
+        try:
+            if kind == "text_batch":
+                from .offline_TXT_Question import text_response_batch
+                result = text_response_batch(*args, stopping_criteria=criteria)
+            elif kind == "text_stream":
+                from .offline_TXT_Question import text_response_stream
+                for chunk in text_response_stream(*args, stopping_criteria=criteria):
+                    result_conn.send(("chunk", task_id, chunk))
+                result = None
+            elif kind == "vl":
+                from .offline_VL_Get import vl_question
+                result = vl_question(*args, stopping_criteria=criteria)
+            else:
+                raise ValueError(f"未知的任务类型: {kind}")
+            result_conn.send(("done", task_id, result))
+        except Exception as e:
+            result_conn.send(("error", task_id, f"{type(e).__name__}: {e}"))
+        result_conn.send(("stats", worker_id, model_registry.stats()))
+
+# --- API 进程侧 ---
+class InferencePool:
+    def __init__(self, num_workers: int = OFFLINE_WORKERS):
+        self.num_workers = num_workers
+        self._ctx = multiprocessing.get_context("spawn")    # 避免 fork 后继承 CUDA 上下文
+        self._workers = {}          # {worker_id: {"process", "task_conn", "result_conn", "cancel", "task_id"}}
+        self._pending = deque()     # 等待空闲工作进程的任务 ID
+        self._tasks = {}            # {task_id: {"kind", "args", "future"/"chunks", "worker", "submitted"}}
+        self._worker_stats = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._dispatcher = None
+        self._running = False
+        self.crashes = 0
+
+    # 启动工作进程并返回其记录，由调用方登记到 self._workers
+    def _spawn(self, worker_id: int) -> dict:
+        task_recv, task_send = self._ctx.Pipe(duplex=False)
+        result_recv, result_send = self._ctx.Pipe(duplex=False)
+        cancel_value = self._ctx.Value("q", -1)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, task_recv, result_send, cancel_value),
+            name=f"inference-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        # 子进程已持有的一端在父进程中关闭，子进程退出时父进程可读到 EOF
+        task_recv.close()
+        result_send.close()
+        return {"process": process, "task_conn": task_send, "result_conn": result_recv, "cancel": cancel_value, "task_id": None}
+
+    def _ensure_started(self):
+        if self._running:
+            return
+        self._loop = asyncio.get_running_loop()
+        for worker_id in range(self.num_workers):
+            self._workers[worker_id] = self._spawn(worker_id)
+        self._running = True
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="inference-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    # 把排队任务分配给空闲的工作进程（调用方持有 self._lock）
+    def _schedule(self):
+        for worker in self._workers.values():
+            while worker["task_id"] is None and self._pending:
+                task_id = self._pending.popleft()
+                task = self._tasks.get(task_id)
+                if task is None:
+                    continue
+                worker["task_id"] = task_id
+                task["worker"] = worker
+                task["started"] = time.perf_counter()
+                observe("inference_pool.queue_wait_ms", (task["started"] - task["submitted"]) * 1000, TASK_MS_BUCKETS)
+                worker["task_conn"].send((task_id, task["kind"], task["args"]))
+
+    # 分发线程：把工作进程的结果转交给事件循环，并检测崩溃的工作进程
+    def _dispatch_loop(self):
+        while self._running:
+            with self._lock:
+                by_conn = {w["result_conn"]: (wid, w["process"]) for wid, w in self._workers.items()}
+                by_sentinel = {w["process"].sentinel: (wid, w["process"]) for wid, w in self._workers.items()}
+            ready = wait(list(by_conn) + list(by_sentinel), timeout=0.5)
+            for handle in ready:
+                if handle in by_conn:
+                    worker_id, process = by_conn[handle]
+                    try:
+                        while handle.poll():
+                            self._handle(worker_id, handle.recv())
+                    except (EOFError, OSError):
+                        self._restart(worker_id, process)
+                elif handle in by_sentinel:
+                    self._restart(*by_sentinel[handle])
+
+    def _handle(self, worker_id: int, message):
+        kind, key, payload = message
+        if kind == "stats":
+            self._worker_stats[key] = payload
+            return
+        with self._lock:
+            task = self._tasks.get(key)
+            if kind in ("done", "error"):
+                worker = self._workers.get(worker_id)
+                if worker is not None and worker["task_id"] == key:
+                    worker["task_id"] = None
+                self._tasks.pop(key, None)
+                self._schedule()
+        # 已取消的任务直接丢弃结果
+        if task is None:
+            return
+        if kind == "chunk":
+            self._loop.call_soon_threadsafe(task["chunks"].put_nowait, ("chunk", payload))
+        elif kind == "done":
+            observe("inference_pool.task_ms", (time.perf_counter() - task["started"]) * 1000, TASK_MS_BUCKETS)
+            self._resolve(task, result=payload)
+        elif kind == "error":
+            self._resolve(task, error=InferenceError(payload))
+
+    def _resolve(self, task, result=None, error=None):
+        if "chunks" in task:
+            item = ("error", error) if error else ("end", None)
+            self._loop.call_soon_threadsafe(task["chunks"].put_nowait, item)
+        else:
+            def settle():
+                if not task["future"].done():
+                    if error:
+                        task["future"].set_exception(error)
+                    else:
+                        task["future"].set_result(result)
+            self._loop.call_soon_threadsafe(settle)
+
+    # 工作进程异常退出：仅让其正在执行的任务失败，然后拉起新的进程继续处理队列。
+    # 锁内只摘下旧进程与其任务，等待退出、启动新进程在锁外进行，不阻塞事件循环提交任务
+    def _restart(self, worker_id: int, process):
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            # 同一次退出可能同时触发管道 EOF 与进程句柄，已重启过或正在关闭时忽略
+            if not self._running or worker is None or worker["process"] is not process:
+                return
+            del self._workers[worker_id]
+            task = self._tasks.pop(worker["task_id"], None) if worker["task_id"] is not None else None
+            self.crashes += 1
+        incr("inference_pool.crashes")
+        process.join(1)
+        if process.is_alive():
+            process.terminate()
+            process.join(1)
+        print(f"推理工作进程 {worker_id} 异常退出（exitcode={process.exitcode}），正在重启")
+        worker["task_conn"].close()
+        worker["result_conn"].close()
+        if task is not None:
+            self._resolve(task, error=WorkerCrashed(f"推理进程异常退出（exitcode={process.exitcode}）"))
+        replacement = self._spawn(worker_id)
+        with self._lock:
+            if self._running:
+                self._workers[worker_id] = replacement
+                self._schedule()
+                return
+        # 重启期间已关闭
+        replacement["process"].terminate()
+
+    def _submit(self, kind: str, args: tuple, stream: bool):
+        self._ensure_started()
+        task_id = next(self._ids)
+        task = {"kind": kind, "args": args, "worker": None, "submitted": time.perf_counter(), "started": None}
+        if stream:
+            task["chunks"] = asyncio.Queue()
+        else:
+            task["future"] = self._loop.create_future()
+        with self._lock:
+            self._tasks[task_id] = task
+            self._pending.append(task_id)
+            self._schedule()
+        incr("inference_pool.submitted")
+        return task_id, task
+
+    # 取消任务：排队中的直接移除，执行中的通过停止条件在下一个生成步中断
+    def cancel(self, task_id: int):
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return
+            if task["worker"] is not None:
+                # 保留工作进程的占用状态，直到它回报 done/error
+                task["worker"]["cancel"].value = task_id
+        incr("inference_pool.cancelled")
+
+    async def run(self, kind: str, *args, timeout: float = OFFLINE_TASK_TIMEOUT, request=None):
+        task_id, task = self._submit(kind, args, stream=False)
+        try:
+            return await wait_for_request(task["future"], request, timeout)
+        except (asyncio.CancelledError, InferenceError):
+            self.cancel(task_id)
+            raise
+
+    # 流式任务：逐段产出文本，调用方关闭生成器（如客户端断开）时取消任务
+    async def stream(self, kind: str, *args, idle_timeout: float = OFFLINE_STREAM_IDLE_TIMEOUT):
+        task_id, task = self._submit(kind, args, stream=True)
+        finished = False
+        try:
+            while True:
+                try:
+                    item, payload = await asyncio.wait_for(task["chunks"].get(), idle_timeout)
+                except asyncio.TimeoutError:
+                    incr("inference_pool.timeouts")
+                    raise InferenceTimeout("离线模型响应超时")
+                if item == "chunk":
+                    yield payload
+                elif item == "error":
+                    finished = True
+                    raise payload
+                else:
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                self.cancel(task_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": {worker_id: {"pid": worker["process"].pid, "alive": worker["process"].is_alive(),
+                                        "busy": worker["task_id"] is not None, "models": self._worker_stats.get(worker_id)}
+                            for worker_id, worker in self._workers.items()},
+                "pending": len(self._pending),
+                "crashes": self.crashes,
+            }
+
+    def shutdown(self, timeout: float = 5):
+        if not self._running:
+            return
+        self._running = False
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            try:
+                worker["task_conn"].send(None)
+            except OSError:
+                pass
+        for worker in workers:
+            worker["process"].join(timeout)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+
+# 等待结果，同时在超时或客户端断开时放弃等待
+async def wait_for_request(awaitable, request=None, timeout: float = OFFLINE_TASK_TIMEOUT):
+    waiter = asyncio.ensure_future(awaitable)
+    watchers = {waiter}
+    watcher = None
+    if request is not None:
+        async def watch_disconnect():
+            while not await request.is_disconnected():
+                await asyncio.sleep(0.5)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        watchers.add(watcher)
+    try:
+        done, _ = await asyncio.wait(watchers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if waiter in done:
+            return waiter.result()
+        waiter.cancel()
+        if watcher is not None and watcher in done:
+            incr("inference_pool.disconnects")
+            raise ClientDisconnected("客户端已断开连接")
+        incr("inference_pool.timeouts")
+        raise InferenceTimeout("离线模型响应超时")
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+inference_pool = InferencePool()
+
+# 并发的解题请求经微批调度合并后，作为一个批量任务交给工作进程，按 max_new_tokens 分组
+async def _run_text_batch(max_new_tokens: int, items: list) -> list:
+    return await inference_pool.run("text_batch", items, max_new_tokens)
+
+text_batcher = MicroBatcher(
+    _run_text_batch,
+    max_batch_size=TEXT_BATCH_MAX_SIZE,
+    max_wait_ms=TEXT_BATCH_MAX_WAIT_MS,
+    name="offline_text.batch",
+    max_concurrency=OFFLINE_WORKERS,
+)
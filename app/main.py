@@ -1,10 +1,32 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
-from .config import FRONT_URL
+from .advice_jobs import advice_jobs
+from .config import FRONT_URL, DB_AUTO_MIGRATE, IMAGE_UPLOAD_MAX_BYTES, TEACHER_UPLOAD_MAX_BYTES
+from .dashscope_client import close_client
+from .inference_pool import inference_pool
+from .migrations import run_migrations
 from .routes import router
+from .score_buffer import score_buffer
+from .upload_limit import UploadLimitMiddleware
 
-app = FastAPI()
+# 应用生命周期：启动时补齐数据库迁移，关闭时释放共享资源
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_AUTO_MIGRATE:
+        try:
+            await asyncio.to_thread(run_migrations)
+        except Exception as e:
+            print(f"数据库迁移失败: {str(e)}")
+    yield
+    await advice_jobs.shutdown()
+    await asyncio.to_thread(score_buffer.close)
+    await close_client()
+    inference_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # 引入路由
 app.include_router(router)
@@ -16,4 +38,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许的 HTTP 方法
     allow_headers=["*"],  # 允许的请求头
-)
\ No newline at end of file
+)
+
+# 上传接口在读取请求体前按大小拒绝（Base64 接口按编码后约 4/3 倍计算）
+app.add_middleware(UploadLimitMiddleware, limits={
+    "/upload-image": IMAGE_UPLOAD_MAX_BYTES * 4 // 3,
+    "/upload-image-file": IMAGE_UPLOAD_MAX_BYTES,
+    "/student-photograph-question": IMAGE_UPLOAD_MAX_BYTES * 4 // 3,
+    "/student-photograph-question-file": IMAGE_UPLOAD_MAX_BYTES,
+    "/teacher-upload-file": TEACHER_UPLOAD_MAX_BYTES,
+})
@@ -0,0 +1,46 @@
+import threading
+from collections import defaultdict
+
+# 进程内轻量指标：计数器与直方图，通过 /metrics 接口查看
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+
+# 默认分桶（上界，含），超出最后一个上界的记入 "+Inf"
+DEFAULT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+def observe(name: str, value: float, buckets: tuple = DEFAULT_BUCKETS):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = {"buckets": tuple(buckets), "counts": [0] * (len(buckets) + 1), "count": 0, "sum": 0.0, "min": None, "max": None}
+            _histograms[name] = hist
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+                break
+        else:
+            hist["counts"][-1] += 1
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["min"] = value if hist["min"] is None else min(hist["min"], value)
+        hist["max"] = value if hist["max"] is None else max(hist["max"], value)
+
+def snapshot() -> dict:
+    with _lock:
+        histograms = {}
+        for name, hist in _histograms.items():
+            labels = [str(b) for b in hist["buckets"]] + ["+Inf"]
+            histograms[name] = {
+                "count": hist["count"],
+                "sum": hist["sum"],
+                "avg": hist["sum"] / hist["count"] if hist["count"] else 0,
+                "min": hist["min"],
+                "max": hist["max"],
+                "buckets": dict(zip(labels, hist["counts"])),
+            }
+        return {"counters": dict(_counters), "histograms": histograms}
@@ -0,0 +1,195 @@
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime
+from sqlalchemy import Column, DateTime, MetaData, String, Table, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from .config import DATABASE_URL, DB_MIGRATION_LOCK_TIMEOUT
+from .database import classroom_query, get_engine, latest_score_query, membership_query, remove_member_statement
+from .activity import backfill_daily_activity, count_questions_query, daily_counts_query
+from .models import Base, Class, ClassMembership, Classroom, ConversationScore, Student, StudentDailyActivity, StudentProfile, Teacher
+
+# 轻量结构迁移：schema_migrations 表记录已执行的版本，启动时按顺序补齐未执行的迁移
+# 用法：python -m app.migrations [upgrade|status|check|backfill [studentname]]
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", String(64), primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# 已存在的表上补建索引（新表由 create_all 连同索引一起创建）
+def _create_missing_indexes(conn, *tables):
+    inspector = inspect(conn)
+    for table in tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"创建索引 {table.name}.{index.name}")
+                index.create(conn)
+
+def _baseline(conn):
+    Base.metadata.create_all(conn, checkfirst=True)
+
+def _score_and_class_indexes(conn):
+    _create_missing_indexes(conn, ConversationScore.__table__, Class.__table__)
+
+def _daily_activity(conn):
+    StudentDailyActivity.__table__.create(conn, checkfirst=True)
+
+# 旧版 class 表（每行一个教师+班级名+学生）拆分为 classroom 与 class_membership；
+# 丢弃教师或学生已不存在的行，旧表保留不删除，便于回退
+def _normalize_classes(conn):
+    Classroom.__table__.create(conn, checkfirst=True)
+    ClassMembership.__table__.create(conn, checkfirst=True)
+    legacy, classroom, membership = Class.__table__, Classroom.__table__, ClassMembership.__table__
+    conn.execute(insert(classroom).from_select(
+        ["teacherid", "classname"],
+        select(legacy.c.teacherid, legacy.c.classname)
+        .join(Teacher.__table__, Teacher.__table__.c.teacherid == legacy.c.teacherid)
+        .distinct(),
+    ))
+    conn.execute(insert(membership).from_select(
+        ["class_id", "studentid"],
+        select(classroom.c.id, legacy.c.studentid)
+        .join(classroom, (classroom.c.teacherid == legacy.c.teacherid) & (classroom.c.classname == legacy.c.classname))
+        .join(Student.__table__, Student.__table__.c.studentid == legacy.c.studentid)
+        .distinct(),
+    ))
+
+def _student_profile(conn):
+    StudentProfile.__table__.create(conn, checkfirst=True)
+
+# 按版本号顺序执行，已发布的迁移不要修改，只追加新版本
+MIGRATIONS = [
+    ("0001", "创建缺失的数据表", _baseline),
+    ("0002", "conversation_scores(studentname, timestamp) 与 class(teacherid, classname, studentid) 复合索引", _score_and_class_indexes),
+    ("0003", "student_daily_activity 每日提问汇总表", _daily_activity),
+    ("0004", "班级拆分为 classroom 与 class_membership", _normalize_classes),
+    ("0005", "student_profile 学生画像表", _student_profile),
+]
+
+# 迁移完成后需要执行的数据回填 {版本: 函数(db_url)}
+BACKFILLS = {
+    "0003": lambda db_url: print(f"回填每日提问汇总 {backfill_daily_activity(db_url)} 行"),
+}
+
+def applied_versions(db_url: str = DATABASE_URL) -> set:
+    engine = get_engine(db_url)
+    _meta.create_all(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+# 多个进程同时启动时串行执行迁移：MySQL 的 DDL 不在事务内，仅靠版本表主键冲突无法阻止重复建表、建索引。
+# MySQL 用 GET_LOCK，PostgreSQL 用 advisory lock；SQLite 的 DDL 在事务内，版本表主键冲突即可
+MIGRATION_LOCK_NAME = "schema_migrations"
+
+@contextmanager
+def _migration_lock(engine):
+    dialect = engine.dialect.name
+    if dialect not in ("mysql", "postgresql"):
+        yield
+        return
+    with engine.connect() as conn:
+        if dialect == "mysql":
+            acquired = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                    {"name": MIGRATION_LOCK_NAME, "timeout": DB_MIGRATION_LOCK_TIMEOUT}).scalar()
+            if acquired != 1:
+                raise TimeoutError(f"等待数据库迁移锁超过 {DB_MIGRATION_LOCK_TIMEOUT} 秒")
+        else:
+            conn.execute(text("SELECT set_config('lock_timeout', :timeout, false)"), {"timeout": f"{DB_MIGRATION_LOCK_TIMEOUT}s"})
+            conn.execute(text("SELECT pg_advisory_lock(hashtext(:name))"), {"name": MIGRATION_LOCK_NAME})
+        try:
+            yield
+        finally:
+            if dialect == "mysql":
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK_NAME})
+            else:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": MIGRATION_LOCK_NAME})
+
+def run_migrations(db_url: str = DATABASE_URL) -> list:
+    engine = get_engine(db_url)
+    applied = []
+    with _migration_lock(engine):
+        # 取得锁后再建版本表、读取已执行的版本，先启动的进程执行过的迁移不会重复执行
+        done = applied_versions(db_url)
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                with engine.begin() as conn:
+                    migrate(conn)
+                    conn.execute(schema_migrations.insert().values(version=version, description=description, applied_at=datetime.now()))
+            except IntegrityError:
+                # 未加锁的数据库上，其他进程已记录该版本
+                continue
+            print(f"数据库迁移 {version} 完成: {description}")
+            if version in BACKFILLS:
+                BACKFILLS[version](db_url)
+            applied.append(version)
+    return applied
+
+# 主键索引在各数据库中名称不同，HOT_QUERIES 中用 PRIMARY 表示
+PRIMARY = "PRIMARY"
+
+# 高频查询及其应当使用的索引；语句由业务代码中的同一构造函数生成，查询改动后检查随之更新
+HOT_QUERIES = [
+    ("evaluation", "ix_conversation_scores_student_time", latest_score_query("")),
+    ("recentlyask", PRIMARY, daily_counts_query("", date(2000, 1, 1))),
+    ("get_frequency", PRIMARY, count_questions_query("", date(2000, 1, 1), date(2000, 1, 1))),
+    ("classroom", "uq_classroom_teacher_classname", classroom_query(0, "")),
+    ("class_member", "uq_class_membership_class_student", membership_query(0, 0)),
+    ("remove_member", "uq_class_membership_class_student", remove_member_statement(0, "", 0)),
+]
+
+# 用 EXPLAIN 检查高频查询是否命中索引，返回 [(查询名, 期望索引, 是否命中, 执行计划)]
+def explain_hot_queries(db_url: str = DATABASE_URL) -> list:
+    engine = get_engine(db_url)
+    sqlite = engine.dialect.name == "sqlite"
+    results = []
+    with engine.connect() as conn:
+        for name, index, statement in HOT_QUERIES:
+            # 按当前数据库方言编译，参数以字面值内联
+            sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.exec_driver_sql(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + sql).mappings().all()
+            if sqlite:
+                plan = "; ".join(row["detail"] for row in rows)
+                # SQLite 复合主键对应自动索引 sqlite_autoindex_<表名>_N
+                used = ("sqlite_autoindex_" in plan or "PRIMARY KEY" in plan) if index == PRIMARY else index in plan
+            else:
+                plan = "; ".join(f"{row.get('table')}: key={row.get('key')} rows={row.get('rows')}" for row in rows)
+                used = any(row.get("key") == index for row in rows)
+            results.append((name, index, used, plan))
+    return results
+
+def main(argv: list) -> int:
+    command = argv[0] if argv else "upgrade"
+    try:
+        if command == "upgrade":
+            applied = run_migrations()
+            print(f"已执行 {len(applied)} 个迁移" if applied else "数据库结构已是最新")
+        elif command == "status":
+            done = applied_versions()
+            for version, description, _ in MIGRATIONS:
+                print(f"[{'x' if version in done else ' '}] {version} {description}")
+        elif command == "check":
+            failed = 0
+            for name, index, used, plan in explain_hot_queries():
+                print(f"{'OK  ' if used else 'FAIL'} {name}: 期望 {index} | {plan}")
+                failed += not used
+            return 1 if failed else 0
+        elif command == "backfill":
+            # 重新由原始评分记录生成每日提问汇总
+            rows = backfill_daily_activity(studentname=argv[1] if len(argv) > 1 else None)
+            print(f"已回填 {rows} 行每日提问汇总")
+        else:
+            print("用法: python -m app.migrations [upgrade|status|check|backfill [studentname]]")
+            return 2
+    except SQLAlchemyError as e:
+        print(f"数据库迁移出错: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
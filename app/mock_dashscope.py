@@ -0,0 +1,59 @@
+import asyncio
+import json
+import os
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+# DashScope 本地替身服务，用于离线联调与压测：
+#   uvicorn app.mock_dashscope:app --port 8001
+#   DASHSCOPE_BASE_URL=http://127.0.0.1:8001
+# MOCK_DASHSCOPE_LATENCY 可模拟模型耗时（秒）
+MOCK_LATENCY = float(os.environ.get('MOCK_DASHSCOPE_LATENCY', 0))
+
+app = FastAPI()
+
+# 对话/识题的固定回复，格式与 routes 中的 Preprompt 和识题 prompt 保持一致
+CHAT_REPLY = {
+    "用户画像": {"学段": "初中", "教材": "人教版", "困难的知识点": ["一元二次方程"]},
+    "学习状态分数": {"学习深度": 6, "响应及时性": 7, "自我修正主动性": 5, "情感参与度": 6, "学习状态总分": 6},
+    "回复内容": "这是本地替身服务的回复。",
+}
+VL_REPLY = {
+    "题目": "解方程 x^2 - 5x + 6 = 0",
+    "正确答案": {"详细解析": "因式分解得 (x-2)(x-3)=0，所以 x=2 或 x=3。", "考察知识点": ["一元二次方程", "因式分解"]},
+}
+ADVICE_REPLY = {
+    "advice": [{"method": "整理错题并归纳解题步骤", "schedule": "每周复习两次一元二次方程专题"}]
+}
+
+def _has_image(messages: list) -> bool:
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+# 流式模式：按固定长度切分回复，以 SSE 分块返回
+async def _stream_reply(content: str, model: str):
+    for i in range(0, len(content), 8):
+        chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": content[i:i + 8]}, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(0.01)
+    yield "data: [DONE]\n\n"
+
+@app.post("/compatible-mode/v1/chat/completions")
+async def chat_completions(payload: dict):
+    await asyncio.sleep(MOCK_LATENCY)
+    reply = VL_REPLY if _has_image(payload.get("messages", [])) else CHAT_REPLY
+    if payload.get("stream"):
+        return StreamingResponse(_stream_reply(json.dumps(reply, ensure_ascii=False), payload.get("model")), media_type="text/event-stream")
+    return {
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(reply, ensure_ascii=False)}, "finish_reason": "stop"}],
+    }
+
+@app.post("/api/v1/services/aigc/text-generation/generation")
+async def text_generation(payload: dict):
+    await asyncio.sleep(MOCK_LATENCY)
+    content = "```json\n" + json.dumps(ADVICE_REPLY, ensure_ascii=False) + "\n```"
+    return {"output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": content}}]}}
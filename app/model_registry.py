@@ -0,0 +1,159 @@
+import gc
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .config import OFFLINE_MODEL_IDLE_SECONDS, OFFLINE_MODEL_MEMORY_BUDGET_MB, OFFLINE_MODEL_REAP_INTERVAL
+from .metrics import incr
+
+# 离线模型生命周期管理：首次使用时加载，空闲超时卸载，
+# 加载新模型会超出显存/内存预算时先卸载最久未使用且空闲的模型（如数学模型与视觉模型互相换入换出）
+class ModelRegistry:
+    def __init__(self, memory_budget_mb: float = OFFLINE_MODEL_MEMORY_BUDGET_MB, idle_seconds: float = OFFLINE_MODEL_IDLE_SECONDS):
+        self.memory_budget_mb = memory_budget_mb   # 0 表示不限制
+        self.idle_seconds = idle_seconds           # 0 表示不自动卸载
+        self._specs = {}        # {name: {"loader": 加载函数, "estimate_mb": 预估占用}}
+        self._resident = {}     # {name: {"objects": 加载结果, "memory_mb": 实际占用, "last_used": 时间, "in_use": 引用数}}
+        self._loading = {}      # {name: 预留的预算 MB}，加载在锁外进行，期间其他模型照常使用
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=50)
+        self._reaper = None
+
+    # loader() 返回 (model, tokenizer/processor)
+    def register(self, name: str, loader, estimate_mb: float = 0):
+        with self._cond:
+            self._specs[name] = {"loader": loader, "estimate_mb": estimate_mb}
+
+    def _resident_mb(self) -> float:
+        return sum(entry["memory_mb"] for entry in self._resident.values())
+
+    # 已加载的占用加上正在加载的模型预留的预算
+    def _reserved_mb(self) -> float:
+        return self._resident_mb() + sum(self._loading.values())
+
+    def _record(self, event: str, name: str, memory_mb: float, seconds: float = 0, reason: str = ""):
+        self._events.append({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "event": event, "model": name,
+                             "memory_mb": round(memory_mb, 1), "seconds": round(seconds, 2), "reason": reason})
+        incr(f"model_registry.{event}s")
+        if event == "load":
+            print(f"模型 {name} 加载完成，占用 {memory_mb:.0f} MB，耗时 {seconds:.1f} 秒")
+        else:
+            print(f"模型 {name} 已卸载（{reason}），释放 {memory_mb:.0f} MB")
+
+    def _unload(self, name: str, reason: str):
+        entry = self._resident.pop(name)
+        entry["objects"] = None
+        gc.collect()
+        # 仅在已导入 torch 时释放 CUDA 缓存
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self._record("unload", name, entry["memory_mb"], reason=reason)
+        self._cond.notify_all()
+
+    # 为即将加载的模型腾出预算，必要时等待正在使用的模型释放
+    def _make_room(self, name: str):
+        need = self._specs[name]["estimate_mb"]
+        while (self.memory_budget_mb and name not in self._resident and name not in self._loading
+               and (self._resident or self._loading) and self._reserved_mb() + need > self.memory_budget_mb):
+            idle = [n for n, entry in self._resident.items() if entry["in_use"] == 0]
+            if idle:
+                victim = min(idle, key=lambda n: self._resident[n]["last_used"])
+                self._unload(victim, f"为加载 {name} 释放预算")
+            else:
+                self._cond.wait()
+
+    def _start_reaper(self):
+        if self._reaper is None and self.idle_seconds > 0:
+            self._reaper = threading.Thread(target=self._reap_loop, name="model-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(OFFLINE_MODEL_REAP_INTERVAL)
+            self.evict_idle()
+
+    # 卸载空闲超时的模型
+    def evict_idle(self):
+        now = time.time()
+        with self._cond:
+            for name in [n for n, entry in self._resident.items()
+                         if entry["in_use"] == 0 and now - entry["last_used"] > self.idle_seconds]:
+                self._unload(name, "空闲超时")
+
+    # 模型未加载时先标记为加载中，释放锁后执行耗时的加载函数，完成后再加锁登记；
+    # 同一模型的其他请求等待加载完成，stats、空闲卸载与其他模型的使用不受影响
+    def _load(self, name: str) -> dict:
+        started = time.time()
+        try:
+            objects = self._specs[name]["loader"]()
+        except BaseException:
+            with self._cond:
+                self._loading.pop(name, None)
+                self._cond.notify_all()
+            raise
+        model = objects[0]
+        with self._cond:
+            memory_mb = model.get_memory_footprint() / 1024 / 1024 if hasattr(model, "get_memory_footprint") else self._specs[name]["estimate_mb"]
+            # 记录实测占用，下次换入时按实测值预留预算
+            self._specs[name]["estimate_mb"] = memory_mb
+            self._loading.pop(name, None)
+            # 加载者直接持有一个引用，返回前不会被卸载
+            entry = self._resident[name] = {"objects": objects, "memory_mb": memory_mb, "last_used": time.time(), "in_use": 1}
+            self._record("load", name, memory_mb, time.time() - started)
+            self._cond.notify_all()
+            return entry
+
+    # 使用期间持有模型，防止被卸载
+    @contextmanager
+    def acquire(self, name: str):
+        entry = None
+        while entry is None:
+            with self._cond:
+                self._start_reaper()
+                while name in self._loading:
+                    self._cond.wait()
+                if name in self._resident:
+                    entry = self._resident[name]
+                    entry["in_use"] += 1
+                    break
+                self._make_room(name)
+                if name in self._resident or name in self._loading:
+                    continue
+                self._loading[name] = self._specs[name]["estimate_mb"]
+            entry = self._load(name)
+        objects = entry["objects"]
+        try:
+            yield objects
+        finally:
+            with self._cond:
+                entry["in_use"] -= 1
+                entry["last_used"] = time.time()
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.time()
+            result = {
+                "memory_budget_mb": self.memory_budget_mb,
+                "resident_mb": round(self._resident_mb(), 1),
+                "models": {
+                    name: {
+                        "resident": name in self._resident,
+                        "loading": name in self._loading,
+                        "memory_mb": round(self._resident[name]["memory_mb"] if name in self._resident else spec["estimate_mb"], 1),
+                        "in_use": self._resident[name]["in_use"] if name in self._resident else 0,
+                        "idle_seconds": round(now - self._resident[name]["last_used"], 1) if name in self._resident else None,
+                    }
+                    for name, spec in self._specs.items()
+                },
+                "events": list(self._events),
+            }
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            result["cuda_allocated_mb"] = round(torch.cuda.memory_allocated() / 1024 / 1024, 1)
+        return result
+
+model_registry = ModelRegistry()
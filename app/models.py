@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Date, Float, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Float, ForeignKey, Index, PrimaryKeyConstraint, UniqueConstraint
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -16,13 +16,37 @@ class Teacher(Base):
     teachername = Column(String(50), nullable=False, unique=True)
     password_hash = Column(String(60), nullable=False)
 
+# 旧版班级表：每行一个（教师, 班级名, 学生），仅作为迁移 0004 的数据来源保留，业务代码使用 Classroom / ClassMembership
 class Class(Base):
     __tablename__ = "class"
+    # 名单查询均按 教师 + 班级名 (+ 学生) 过滤
+    __table_args__ = (Index("ix_class_teacher_classname_student", "teacherid", "classname", "studentid"),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     teacherid = Column(Integer, nullable=True)
     classname = Column(String(255), nullable=False)
     studentid = Column(Integer, nullable=True)
 
+# 班级：同一教师名下班级名唯一
+class Classroom(Base):
+    __tablename__ = "classroom"
+    __table_args__ = (Index("uq_classroom_teacher_classname", "teacherid", "classname", unique=True),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    teacherid = Column(Integer, ForeignKey("teacher.teacherid"), nullable=False)
+    classname = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+# 班级成员：同一学生在同一班级只出现一次，按学生反查所在班级走 studentid 索引
+class ClassMembership(Base):
+    __tablename__ = "class_membership"
+    __table_args__ = (
+        Index("uq_class_membership_class_student", "class_id", "studentid", unique=True),
+        Index("ix_class_membership_student", "studentid"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    class_id = Column(Integer, ForeignKey("classroom.id", ondelete="CASCADE"), nullable=False)
+    studentid = Column(Integer, ForeignKey("student.studentid", ondelete="CASCADE"), nullable=False)
+    joined_at = Column(DateTime, default=datetime.now)
+
 class AdministratorMechanism(Base):
     __tablename__ = "administrator_mechanism"
     AdministratorInstitution = Column(String(255), primary_key=True)
@@ -30,11 +54,30 @@ class AdministratorMechanism(Base):
 
 class ConversationScore(Base):
     __tablename__ = "conversation_scores"
+    # 评分查询均按 学生 + 时间范围 过滤/排序
+    __table_args__ = (Index("ix_conversation_scores_student_time", "studentname", "timestamp"),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     studentname = Column(String(50), nullable=False)
-    timestamp = Column(Date, default=datetime.now())
+    timestamp = Column(Date, default=datetime.now)
     question_depth = Column(Float, nullable=False)
     response_timeliness = Column(Float, nullable=False)
     correction_proactivity = Column(Float, nullable=False)
     emotional_engagement = Column(Float, nullable=False)
     total_score = Column(Float, nullable=False)
+
+# 学生每日提问汇总：/chat 写入评分时同步累加，看板按天读取，无需扫描原始评分记录
+class StudentDailyActivity(Base):
+    __tablename__ = "student_daily_activity"
+    __table_args__ = (PrimaryKeyConstraint("studentname", "day"),)
+    studentname = Column(String(50), nullable=False)
+    day = Column(Date, nullable=False)
+    question_count = Column(Integer, nullable=False, default=0)
+    total_score_sum = Column(Float, nullable=False, default=0)
+
+# 学生画像（PROFILE_STORE_BACKEND=db 时使用）：内容每次变化 version 加 1，其他模块按版本号缓存派生结果
+class StudentProfile(Base):
+    __tablename__ = "student_profile"
+    studentname = Column(String(50), primary_key=True)
+    content = Column(Text, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
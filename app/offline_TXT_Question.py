@@ -1,47 +1,117 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from queue import Empty
+from threading import Event, Thread
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 import torch
-from app.config import Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir
+from app.config import Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir, OFFLINE_MATH_MODEL_MB, OFFLINE_STREAM_IDLE_TIMEOUT
+from app.model_registry import model_registry
 
-# --- 模型与分词器加载 ---
+# --- 模型与分词器加载（首次使用时由 model_registry 懒加载） ---
 model_name_or_path = Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir
-model = AutoModelForCausalLM.from_pretrained(
-    model_name_or_path,
-    torch_dtype="auto",
-    device_map="auto"
-)
-tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
-model.eval()  # 切换到评估模式
+
+def _load_model():
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name_or_path,
+        torch_dtype="auto",
+        device_map="auto"
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+    # 批量推理时左侧填充，保证生成部分在右侧对齐
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model.eval()  # 切换到评估模式
+    return model, tokenizer
+
+model_registry.register("math", _load_model, OFFLINE_MATH_MODEL_MB)
+
+# --- 批量解题 ---
+# items: [(system_message, prompt), ...]，同一批共用 max_new_tokens
+def text_response_batch(items: list, max_new_tokens: int, stopping_criteria=None) -> list:
+    with model_registry.acquire("math") as (model, tokenizer):
+        # 构建 messagesTIR 格式
+        texts = [
+            tokenizer.apply_chat_template(
+                conversation=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": prompt}
+                ],
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            for system_message, prompt in items
+        ]
+        # 编码输入（填充为同一长度）
+        model_inputs = tokenizer(
+            texts,
+            return_tensors="pt",
+            padding=True,
+        ).to(model.device)
+
+        # 生成回答
+        with torch.no_grad():
+            generated_ids = model.generate(
+                **model_inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=tokenizer.pad_token_id,
+                stopping_criteria=stopping_criteria,
+            )
+
+        generated_ids = [
+            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+        ]
+
+        return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
 
 # --- 解题API ---
 def text_response(system_message: str, prompt: str, max_new_tokens: int):
-    # 构建 messagesTIR 格式
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": prompt}
-    ]
-
-    text = tokenizer.apply_chat_template(
-        conversation=messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-    # 编码输入
-    model_inputs = tokenizer(
-        [text],
-        return_tensors="pt",
-    ).to("cuda")
-
-    # 生成回答
-    with torch.no_grad():
-        generated_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=max_new_tokens,
-        )
+    return text_response_batch([(system_message, prompt)], max_new_tokens)[0]
 
-    generated_ids = [
-        output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-    ]
+# --- 流式解题 ---
+# 调用方放弃读取（超时）时让后台生成在下一步停止
+class _StopEvent(StoppingCriteria):
+    def __init__(self, event: Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+# 生成在后台线程中进行，逐段产出已解码的文本；生成出错时结束流并把异常抛给调用方，
+# 超过 OFFLINE_STREAM_IDLE_TIMEOUT 秒没有新文本时报超时，避免工作进程一直阻塞
+def text_response_stream(system_message: str, prompt: str, max_new_tokens: int, stopping_criteria=None):
+    with model_registry.acquire("math") as (model, tokenizer):
+        text = tokenizer.apply_chat_template(
+            conversation=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=OFFLINE_STREAM_IDLE_TIMEOUT)
+        errors = []
+        stop = Event()
+        criteria = StoppingCriteriaList([*(stopping_criteria or []), _StopEvent(stop)])
 
-    response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        def generate():
+            try:
+                with torch.no_grad():
+                    model.generate(**model_inputs, max_new_tokens=max_new_tokens, streamer=streamer,
+                                   pad_token_id=tokenizer.pad_token_id, stopping_criteria=criteria)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
 
-    return response
\ No newline at end of file
+        thread = Thread(target=generate, daemon=True)
+        thread.start()
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        except Empty:
+            stop.set()
+            thread.join(OFFLINE_STREAM_IDLE_TIMEOUT)
+            raise TimeoutError(f"流式生成超过 {OFFLINE_STREAM_IDLE_TIMEOUT} 秒没有输出")
+        thread.join()
+        if errors:
+            raise errors[0]
\ No newline at end of file
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import insert, select, update
+
+from .config import ENVPATH, DATABASE_URL, PROFILE_STORE_BACKEND, PROFILE_CACHE_MAX_USERS
+from .database import get_session_factory
+from .metrics import incr
+from .models import StudentProfile
+
+try:
+    import fcntl
+except ImportError:     # Windows 下没有 fcntl，只在进程内加锁
+    fcntl = None
+
+# 学生画像存储：内存缓存 + 写穿（先写后端再更新缓存），每次内容变化版本号加 1；
+# 内容未变化时跳过写入，版本号不变，学习建议等派生结果可按 (用户, 版本号) 缓存
+# 缓存命中时比对后端的轻量标记，多个进程各自缓存也能读到其他进程写入的画像
+# 后端为 file 时画像保存在 {用户}_profile.txt，版本号与内容摘要保存在 {用户}_profile.json；
+# 读写都在 {用户}_profile.lock 文件锁内进行，版本号以磁盘上的为准递增，多个进程同时写入时不会产生重复版本
+
+def _digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+# 先写临时文件再替换，读取方不会看到写了一半的文件
+def _write_atomic(path: Path, data: str):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class FileProfileBackend:
+    def __init__(self):
+        self._locks = defaultdict(threading.Lock)
+
+    def _paths(self, username: str) -> tuple:
+        user_folder = Path(ENVPATH) / username
+        return user_folder / f"{username}_profile.txt", user_folder / f"{username}_profile.json"
+
+    @contextmanager
+    def _locked(self, username: str):
+        profile_path, _ = self._paths(username)
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._locks[username], open(profile_path.with_name(f"{username}_profile.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    # 须在锁内调用；画像文件被直接改写（如教师上传）或上次写入中断在两个文件之间时版本号加 1
+    def _read(self, username: str) -> tuple:
+        profile_path, meta_path = self._paths(username)
+        if not profile_path.exists():
+            return "", 0
+        with open(profile_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {"version": 0, "digest": None}
+        if meta.get("digest") != _digest(content):
+            meta = {"version": meta.get("version", 0) + 1, "digest": _digest(content)}
+            _write_atomic(meta_path, json.dumps(meta))
+        return content, meta["version"]
+
+    # 缓存校验用的标记：画像文件原子替换后 inode 与修改时间都会变化，不存在时为 None
+    def stamp(self, username: str):
+        try:
+            stat = self._paths(username)[0].stat()
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    # 返回 (内容, 版本号)，画像不存在时为 ("", 0)
+    def load(self, username: str) -> tuple:
+        if not self._paths(username)[0].exists():
+            return "", 0
+        with self._locked(username):
+            return self._read(username)
+
+    # 在磁盘上的版本号基础上加 1（传入的 version 仅作参考）；磁盘上已是相同内容时不写入，返回现有版本号
+    def save(self, username: str, content: str, version: int) -> int:
+        profile_path, meta_path = self._paths(username)
+        with self._locked(username):
+            current, current_version = self._read(username)
+            if current == content and profile_path.exists():
+                return current_version
+            version = current_version + 1
+            _write_atomic(profile_path, content)
+            _write_atomic(meta_path, json.dumps({"version": version, "digest": _digest(content)}))
+            return version
+
+class DbProfileBackend:
+    def __init__(self, db_url: str = DATABASE_URL):
+        self.db_url = db_url
+        self._files = FileProfileBackend()
+
+    # 表中没有记录时导入旧的画像文件
+    def load(self, username: str) -> tuple:
+        Session = get_session_factory(self.db_url)
+        with Session() as session:
+            row = session.execute(
+                select(StudentProfile.content, StudentProfile.version).where(StudentProfile.studentname == username)
+            ).first()
+        if row is not None:
+            return row.content, row.version
+        content, _ = self._files.load(username)
+        if not content:
+            return "", 0
+        return content, self.save(username, content, 1)
+
+    # 缓存校验用的标记：数据库中的版本号，没有记录时为 None
+    def stamp(self, username: str):
+        Session = get_session_factory(self.db_url)
+        with Session() as session:
+            return session.execute(select(StudentProfile.version).where(StudentProfile.studentname == username)).scalar()
+
+    # 以数据库中的版本号为准递增；首次写入用各数据库的 upsert，多个请求同时创建同一学生的画像时不会主键冲突
+    def save(self, username: str, content: str, version: int) -> int:
+        profile = StudentProfile.__table__
+        values = {"studentname": username, "content": content, "version": version, "updated_at": datetime.now()}
+        Session = get_session_factory(self.db_url)
+        with Session() as session, session.begin():
+            dialect = session.get_bind().dialect.name
+            if dialect == "mysql":
+                from sqlalchemy.dialects.mysql import insert as mysql_insert
+                stmt = mysql_insert(profile).values(**values)
+                session.execute(stmt.on_duplicate_key_update(
+                    content=stmt.inserted.content, version=profile.c.version + 1, updated_at=stmt.inserted.updated_at,
+                ))
+            elif dialect in ("sqlite", "postgresql"):
+                if dialect == "sqlite":
+                    from sqlalchemy.dialects.sqlite import insert as upsert_insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert as upsert_insert
+                stmt = upsert_insert(profile).values(**values)
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=["studentname"],
+                    set_={"content": stmt.excluded.content, "version": profile.c.version + 1, "updated_at": stmt.excluded.updated_at},
+                ))
+            else:
+                # 其他数据库：先更新，不存在再插入
+                updated = session.execute(
+                    update(profile).where(profile.c.studentname == username)
+                    .values(content=content, version=profile.c.version + 1, updated_at=values["updated_at"])
+                ).rowcount
+                if not updated:
+                    session.execute(insert(profile).values(**values))
+            return session.execute(select(profile.c.version).where(profile.c.studentname == username)).scalar_one()
+
+_UNKNOWN = object()
+
+class ProfileStore:
+    def __init__(self, backend=None, max_users: int = PROFILE_CACHE_MAX_USERS):
+        self.backend = backend or (DbProfileBackend() if PROFILE_STORE_BACKEND == "db" else FileProfileBackend())
+        self.max_users = max_users
+        self._entries = OrderedDict()   # {username: (内容, 版本号, 后端标记)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.writes = 0
+        self.unchanged = 0
+
+    # 返回 (画像内容, 版本号)，画像不存在时为 ("", 0)。
+    # 命中缓存时先比对后端标记（文件状态或数据库版本号），其他进程改写过画像时重新读取
+    def get(self, username: str) -> tuple:
+        stamp = self.backend.stamp(username)
+        with self._lock:
+            cached = self._entries.get(username)
+            if cached is not None and cached[2] == stamp:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                incr("profile_store.hits")
+                return cached[:2]
+            if cached is not None:
+                self.stale += 1
+                incr("profile_store.stale")
+            self.misses += 1
+        incr("profile_store.misses")
+        # 标记在读取前获取：读取期间又被改写时下次校验不一致，会再读一次
+        content, version = self.backend.load(username)
+        with self._lock:
+            self._entries[username] = (content, version, stamp)
+            self._entries.move_to_end(username)
+            self._evict()
+        return content, version
+
+    def version(self, username: str) -> int:
+        return self.get(username)[1]
+
+    # 写入画像并返回新版本号；内容与当前画像相同时不写入
+    def put(self, username: str, content: str) -> int:
+        current, version = self.get(username)
+        if content == current:
+            with self._lock:
+                self.unchanged += 1
+            incr("profile_store.unchanged")
+            return version
+        version = self.backend.save(username, content, version + 1)
+        with self._lock:
+            # 写入后的后端标记未知（可能已被其他进程再次改写），下次读取时重新校验
+            self._entries[username] = (content, version, _UNKNOWN)
+            self._entries.move_to_end(username)
+            self._evict()
+            self.writes += 1
+        incr("profile_store.writes")
+        return version
+
+    # 画像被绕过本模块改写后调用
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "unchanged": self.unchanged,
+                "stale": self.stale,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+profile_store = ProfileStore()
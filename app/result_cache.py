@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from .metrics import incr
+
+# 两级结果缓存：内存 LRU（按条数与字节数淘汰）+ 可选的磁盘 JSON 层（重启后仍然有效）
+# 值必须可序列化为 JSON
+class ResultCache:
+    def __init__(self, name: str, max_entries: int, max_bytes: int, disk_dir: Optional[Path] = None, disk_max_entries: int = 0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = disk_max_entries   # 0 表示不限制
+        self._entries = OrderedDict()   # {key: (value, size)}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                incr(f"{self.name}.hits")
+                return self._entries[key][0]
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+            except (FileNotFoundError, ValueError):
+                value = None
+            if value is not None:
+                # 磁盘命中后提升到内存层
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                self._put_memory(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+                incr(f"{self.name}.disk_hits")
+                return value
+        with self._lock:
+            self.misses += 1
+        incr(f"{self.name}.misses")
+        return None
+
+    def put(self, key: str, value):
+        self._put_memory(key, value)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_writes += 1
+                prune = self.disk_max_entries and self._disk_writes % 100 == 0
+            if prune:
+                self._prune_disk()
+
+    def _put_memory(self, key: str, value):
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                incr(f"{self.name}.evictions")
+
+    # 磁盘层超过上限时删除最久未访问的文件（按修改时间）
+    def _prune_disk(self):
+        files = sorted(self.disk_dir.glob("*/*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files[:max(0, len(files) - self.disk_max_entries)]:
+            path.unlink(missing_ok=True)
+
+    def purge(self) -> dict:
+        with self._lock:
+            memory = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        disk = 0
+        if self.disk_dir is not None and self.disk_dir.exists():
+            for path in self.disk_dir.glob("*/*.json"):
+                path.unlink(missing_ok=True)
+                disk += 1
+        return {"memory": memory, "disk": disk}
+
+    # 最近使用的内存条目（新的在前）
+    def recent(self, limit: int = 20) -> list:
+        with self._lock:
+            keys = list(reversed(self._entries))[:limit]
+            return [{"key": key, "value": self._entries[key][0], "bytes": self._entries[key][1]} for key in keys]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0,
+            }
@@ -1,31 +1,50 @@
+import asyncio
 import base64
 import re
 import bcrypt
 import json
 import logging
-from typing import Union, Optional
+import math
+import time
+from contextlib import aclosing
+from typing import List, Union, Optional
 from datetime import datetime, timedelta
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, File, UploadFile
+from fastapi import APIRouter, HTTPException, File, Form, UploadFile, Depends, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
-from starlette.responses import RedirectResponse, FileResponse
-from sqlalchemy.orm import sessionmaker
+from starlette.responses import RedirectResponse, FileResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
 
-from .config import ENVPATH, DATABASE_URL
-from .offline_TXT_Question import text_response
-from .offline_VL_Get import vl_question
-from .services import call_qwen, call_qwen_vl, call_deepseek_r1_distill_download
+from .config import ENVPATH, DATABASE_URL, Qwen2_5_VL_3B_Instruct_gptq_Int4_dir, IMAGE_UPLOAD_MAX_BYTES, ROSTER_BULK_MAX
+from .chat_log import append_turn, export_txt, read_page
+from .context_window import build_context
+from .history_store import history_store
+from .profile_store import profile_store
+from .score_buffer import score_buffer
+from .identity_cache import identity_cache
+from .image_prep import prepare_image
+from .image_cache import get_cached_result, put_cached_result, vl_cache
+from .metrics import snapshot, observe
+from .inference_pool import inference_pool, InferenceTimeout, ClientDisconnected, WorkerCrashed
+from .text_cache import text_cache, cached_text_response, get_cached_text, put_cached_text
+from .services import QWEN_VL_MODEL, call_qwen, stream_qwen, call_qwen_vl
+from .advice_jobs import advice_jobs, job_view
 from .models import Student, ConversationScore, Teacher, AdministratorMechanism
-from .database import export_studentname_to_excel, engine, create_or_add_class, dissolve_class, delete_member_from_class, join_class, get_class_details, get_frequency, get_studentname, get_teachername
-from .utils import mkdir, encode_image, extract_json_content
+from .database import bulk_add_to_class, bulk_remove_from_class, bulk_move_between_classes, get_db, create_or_add_class, dissolve_class, delete_member_from_class, join_class, get_class_details, get_class_analytics, get_frequency, get_studentname, get_teachername, latest_score_query
+from .activity import daily_counts
+from .file_store import save_upload
+from .score_export import score_export_response
+from .utils import mkdir, extract_json_content
 
 router = APIRouter()
 
-# 创建会话工厂
-SessionLocal = sessionmaker(bind=engine)
+# 离线视觉模型标识（用于识题结果缓存键）
+OFFLINE_VL_MODEL = f"offline:{Qwen2_5_VL_3B_Instruct_gptq_Int4_dir}"
+
+# 流式接口耗时分桶（毫秒）
+LATENCY_BUCKETS = (50, 100, 250, 500, 1000, 2000, 5000, 10000, 30000, 60000)
 
 # --- 通用业务 ---
 # 登录请求模型
@@ -70,18 +89,17 @@ class GetsourceRequest(BaseModel):
     studentname: str
     sourcenumber: int
 
-# 存储用户对话历史（简单实现，使用内存中的字典）
-conversation_history = {}
+# 学习建议生成任务（学生与教师共用，学生 ID 或姓名）
+class AdviceJobRequest(BaseModel):
+    student_identifier: Union[int, str]
 
 # 创建文件路径
 filepath = ENVPATH
 
 # 登录
 @router.post("/login")
-async def login(request: LoginRequest):
+async def login(request: LoginRequest, db: Session = Depends(get_db)):
     try:
-        # 连接数据库
-        db = SessionLocal()
         # 查询用户
         if request.userrole == "student":
             user = db.query(Student).filter(Student.studentname == request.username).first()
@@ -90,22 +108,9 @@ async def login(request: LoginRequest):
             # 验证密码
             if not bcrypt.checkpw(request.password.encode('utf-8'), user.password_hash.encode('utf-8')):
                 raise HTTPException(status_code=401, detail="学生用户名或密码错误")
-            # 确保用户文件夹存在
+            # 确保用户文件夹存在（聊天记录在首次对话时懒加载）
             user_folder = Path(ENVPATH) / request.username
             mkdir(user_folder)
-            # 读取用户的聊天记录
-            file_path = user_folder / f"{request.username}_chat_history.txt"
-            if file_path.exists():
-                with open(file_path, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-                    conversation_history[request.username] = []
-                    for line in lines:
-                        if line.startswith("用户: "):
-                            conversation_history[request.username].append(line.strip()[4:])
-                        elif line.startswith("AI: "):
-                            conversation_history[request.username].append(line.strip()[3:])
-            else:
-                conversation_history[request.username] = []
             return {"status": "success", "message": "学生登录成功"}
         elif request.userrole == "teacher":
             user = db.query(Teacher).filter(Teacher.teachername == request.username).first()
@@ -118,15 +123,15 @@ async def login(request: LoginRequest):
             user_folder = Path(ENVPATH) / request.username
             mkdir(user_folder)
             return {"status": "success", "message": "教师登录成功"}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"在登录时发生错误: {str(e)}")
         raise HTTPException(status_code=500, detail="服务器内部错误，请稍后再试")
 
 # 学生注册
 @router.post("/student-register")
-async def register(request: StudentRegisterRequest):
-    # 连接数据库
-    db = SessionLocal()
+async def register(request: StudentRegisterRequest, db: Session = Depends(get_db)):
     # 检查用户名是否已存在
     student = db.query(Student).filter(Student.studentname == request.username).first()
     if student:
@@ -143,14 +148,14 @@ async def register(request: StudentRegisterRequest):
         db.add(new_student)
         db.commit()
         db.refresh(new_student)
+        identity_cache.invalidate("student", request.username)
         return {"status": "success", "message": "学生身份注册成功"}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
 
 @router.post("/teacher-register")
-async def register(request: TeacherRegisterRequest):
-    db = SessionLocal()
+async def register(request: TeacherRegisterRequest, db: Session = Depends(get_db)):
     InviteCode = db.query(AdministratorMechanism).filter(AdministratorMechanism.InvitationCode == request.Invite).first()
     if not InviteCode:
         raise HTTPException(status_code=400, detail="邀请码错误")
@@ -166,7 +171,7 @@ async def register(request: TeacherRegisterRequest):
     try:
         db.add(new_teacher)
         db.commit()
-        db.close()
+        identity_cache.invalidate("teacher", request.username)
         return {"status": "success", "message": "教师身份注册成功"}
     except Exception as e:
         db.rollback()
@@ -174,13 +179,11 @@ async def register(request: TeacherRegisterRequest):
 
 # 修改密码
 @router.post("/change-password")
-async def change_password(request: ChangePasswordRequest):
-    db = SessionLocal()
+async def change_password(request: ChangePasswordRequest, db: Session = Depends(get_db)):
     try:
         if request.userrole == "student":
             user = db.query(Student).filter(Student.studentname == request.username).first()
             if not bcrypt.checkpw(request.oldpassword.encode('utf-8'), user.password_hash.encode('utf-8')):
-                db.close()
                 raise HTTPException(status_code=401, detail="旧密码错误")
             # 加密密码
             salt = bcrypt.gensalt()
@@ -191,152 +194,240 @@ async def change_password(request: ChangePasswordRequest):
         elif request.userrole == "teacher":
             user = db.query(Teacher).filter(Teacher.teachername == request.username).first()
             if not bcrypt.checkpw(request.oldpassword.encode('utf-8'), user.password_hash.encode('utf-8')):
-                db.close()
                 raise HTTPException(status_code=401, detail="旧密码错误")
             salt = bcrypt.gensalt()
             hashed_password = bcrypt.hashpw(request.newpassword.encode('utf-8'), salt).decode('utf-8')
             db.query(Teacher).filter(Teacher.teachername == request.username).update({"password_hash": hashed_password})
             db.commit()
             return {"status": "success", "detail": "密码修改成功"}
+    except HTTPException:
+        raise
     except SQLAlchemyError as e:
         db.rollback()  # 回滚事务
         raise HTTPException(status_code=500, detail=f"数据库操作失败: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
-    finally:
-        db.close()  # 确保关闭会话
+
+# 千问问答 Preprompt
+CHAT_PREPROMPT = (
+    "你是一个侧重逆向学习的教育助手，负责分析用户的对话内容，有逻辑地引导学生正向积极地学习。"
+    "请按照以下 JSON 格式返回结果："
+    "{"
+    '    "用户画像": {'
+    '        "学段": "小学/初中/高中/大学",'
+    '        "教材": "如人教版、苏教版等",'
+    '        "困难的知识点": ["知识点1", "知识点2"]'
+    '    },'
+    '    "学习状态分数": {'
+    '        "学习深度": 0,'
+    '        "响应及时性": 0,'
+    '        "自我修正主动性": 0,'
+    '        "情感参与度": 0,'
+    '        "学习状态总分": 0'
+    '    },'
+    '    "回复内容": "用教师语气,对用户输入的回复"'
+    "}"
+    "计算学习状态分数规则如下(均为10分制，无法测出就返回0)："
+    "学习深度(分数占比30％)：基于问题链长度（平均值）。"
+    "响应及时性(分数占比20％)：基于用户的平均提问时间差。"
+    "自我修正主动性(分数占比25％)：基于用户对错误的自我修正次数。"
+    "情感参与度(分数占比25％)：基于用户对话中的情感词汇密度。"
+)
+
+# 组装发送给模型的 prompt 与历史窗口
+def _prepare_chat(username: str, prompt: str):
+    # 从 LRU 缓存获取对话历史（未命中时读取聊天记录末尾）
+    history = history_store.get(username)
+    # 创建用户文件夹和用户画像文件路径
+    user_folder = Path(ENVPATH) / username
+    mkdir(user_folder)
+    # 加载用户画像（内存缓存，不存在时为空）
+    user_profile, _ = profile_store.get(username)
+    # 仅保留 token 预算内的最近对话，更早的对话折叠为摘要
+    context = build_context(username, user_folder, history, history_store.offset(username))
+    summary_part = f"\n\n历史对话摘要：\n{context['summary']}" if context["summary"] else ""
+    # 调用AI时，将Preprompt，用户画像，历史摘要拼接到用户输入
+    full_prompt_for_ai = f"{CHAT_PREPROMPT}\n\n用户画像：\n{user_profile}{summary_part}\n\n用户输入内容:\n{prompt}"
+    return user_folder, full_prompt_for_ai, context["window"]
+
+# 模型返回的分数可能为 null、字符串或非法值，统一转为浮点数，无法解析时记 0
+def _to_score(value) -> float:
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return score if math.isfinite(score) else 0.0
+
+# 读取评分相关数据前写出缓冲中的评分，保证读到刚产生的评分；不指定学生时只要有未写入的评分就写出
+async def _flush_scores(studentname: str = None):
+    if score_buffer.has_pending(studentname):
+        await asyncio.to_thread(score_buffer.flush)
+
+# 解析模型回复：更新用户画像、保存学习状态分数、记录对话，返回回复内容
+def _finish_chat(username: str, user_folder: Path, prompt: str, response_text: str) -> str:
+    # 解析 JSON 数据
+    try:
+        response_text = response_text.replace("\\", "\\\\")
+        ai_response = json.loads(response_text)
+        # 解析用户画像
+        if "用户画像" in ai_response:
+            user_profile_data = ai_response["用户画像"]
+            grade = user_profile_data.get("学段", "")
+            textbook = user_profile_data.get("教材", "")
+            difficult_topics = user_profile_data.get("困难的知识点", [])
+            # 更新用户画像
+            user_profile_content = (
+                f"学生信息：\n"
+                f"- 学段：{grade}\n"
+                f"- 教材：{textbook}\n"
+            )
+            if difficult_topics:
+                user_profile_content += f"- 困难的知识点：{'， '.join(difficult_topics)}\n"
+            # 写入用户画像（内容未变化时不写入，版本号不变）
+            profile_store.put(username, user_profile_content)
+                # 解析学习状态分数
+        if "学习状态分数" in ai_response:
+            score_data = ai_response["学习状态分数"]
+            if not isinstance(score_data, dict):
+                score_data = {}
+            question_depth = _to_score(score_data.get("学习深度"))
+            response_timeliness = _to_score(score_data.get("响应及时性"))
+            correction_proactivity = _to_score(score_data.get("自我修正主动性"))
+            emotional_engagement = _to_score(score_data.get("情感参与度"))
+            total_score = _to_score(score_data.get("学习状态总分"))
+
+            # 输出分数
+            print(question_depth, response_timeliness, correction_proactivity, emotional_engagement, total_score)
+
+            # 放入评分缓冲，由后台线程批量写入评分记录与每日汇总
+            score_buffer.add({
+                "studentname": username,
+                "timestamp": datetime.now().date(),
+                "question_depth": question_depth,
+                "response_timeliness": response_timeliness,
+                "correction_proactivity": correction_proactivity,
+                "emotional_engagement": emotional_engagement,
+                "total_score": total_score,
+            })
+        # 提取回复内容
+        reply_content = ai_response.get("回复内容", "").strip()
+        response_text = reply_content  # 将回复内容作为最终返回值
+
+    except json.JSONDecodeError as e:
+        print(f"AI 返回的内容不是有效的 JSON 格式: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"AI 返回的内容不是有效的 JSON 格式: {str(e)}")
+    history_store.append(username, f"用户: {prompt}", f"AI: {response_text}")
+    # 追加写入聊天记录（仅保存用户原始输入和 AI 回复）
+    append_turn(user_folder, username, prompt, response_text)
+    return response_text
+
+# SSE 事件格式
+def _sse(data: dict) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# 从模型流式输出的 JSON 中增量取出 "回复内容" 字段的值，用户画像、学习状态分数等其他字段不会发给前端
+# 与 _finish_chat 的解析保持一致：模型输出中的反斜杠按原样保留，字段值在下一个双引号处结束
+REPLY_KEY = '"回复内容"'
+_REPLY_VALUE_START = re.compile(r'\s*:\s*"')
+_REPLY_VALUE_PARTIAL = re.compile(r'\s*(:\s*)?')
+
+class _ReplyExtractor:
+    def __init__(self):
+        self.buffer = ""
+        self.state = "key"      # key -> colon -> value -> done
+        self.started = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.state == "key":
+            index = self.buffer.find(REPLY_KEY)
+            if index < 0:
+                # 保留末尾可能是字段名前半段的内容
+                self.buffer = self.buffer[-len(REPLY_KEY):]
+                return ""
+            self.buffer, self.state = self.buffer[index + len(REPLY_KEY):], "colon"
+        if self.state == "colon":
+            match = _REPLY_VALUE_START.match(self.buffer)
+            if match is None:
+                if not _REPLY_VALUE_PARTIAL.fullmatch(self.buffer):
+                    # 不是字段定义（例如出现在其他字段的值里），继续查找
+                    self.state = "key"
+                    return self.feed("")
+                return ""
+            self.buffer, self.state = self.buffer[match.end():], "value"
+        if self.state == "value":
+            index = self.buffer.find('"')
+            text = self.buffer if index < 0 else self.buffer[:index]
+            self.buffer = ""
+            if index >= 0:
+                self.state = "done"
+            if not self.started:
+                text = text.lstrip()
+                self.started = bool(text)
+            return text
+        return ""
 
 # 千问问答
 @router.post("/chat")
 async def qwenchat(request: ChatRequest):
     try:
-        # 定义 Preprompt
-        Preprompt = (
-            "你是一个侧重逆向学习的教育助手，负责分析用户的对话内容，有逻辑地引导学生正向积极地学习。"
-            "请按照以下 JSON 格式返回结果："
-            "{"
-            '    "用户画像": {'
-            '        "学段": "小学/初中/高中/大学",'
-            '        "教材": "如人教版、苏教版等",'
-            '        "困难的知识点": ["知识点1", "知识点2"]'
-            '    },'
-            '    "学习状态分数": {'
-            '        "学习深度": 0,'
-            '        "响应及时性": 0,'
-            '        "自我修正主动性": 0,'
-            '        "情感参与度": 0,'
-            '        "学习状态总分": 0'
-            '    },'
-            '    "回复内容": "用教师语气,对用户输入的回复"'
-            "}"
-            "计算学习状态分数规则如下(均为10分制，无法测出就返回0)："
-            "学习深度(分数占比30％)：基于问题链长度（平均值）。"
-            "响应及时性(分数占比20％)：基于用户的平均提问时间差。"
-            "自我修正主动性(分数占比25％)：基于用户对错误的自我修正次数。"
-            "情感参与度(分数占比25％)：基于用户对话中的情感词汇密度。"
-        )
-        # 获取用户印记 建立数据库连接
+        # 获取用户印记
         username = request.studentname
         prompt = request.prompt
-        # 确保初始化数据存储
-        if username not in conversation_history:
-            conversation_history[username] = []
-        # 创建用户文件夹和用户画像文件路径
-        user_folder = Path(ENVPATH) / username
-        mkdir(user_folder)
-        user_profile_path = user_folder / f"{username}_profile.txt"
-        # 加载用户画像（如果存在）
-        user_profile = ""
-        if user_profile_path.exists():
-            with open(user_profile_path, "r", encoding="utf-8") as f:
-                user_profile = f.read()
-        # 调用AI时，将Preprompt，用户画像拼接到用户输入
-        full_prompt_for_ai = f"{Preprompt}\n\n用户画像：\n{user_profile}\n\n用户输入内容:\n{prompt}"
+        user_folder, full_prompt_for_ai, window = _prepare_chat(username, prompt)
         try:
-            response_text = call_qwen(full_prompt_for_ai, conversation_history[username])
+            response_text = await call_qwen(full_prompt_for_ai, window)
             print("AI 返回的内容:", response_text)
         except Exception as e:
             print(f"服务器错误: {str(e)}")
             raise HTTPException(status_code=500, detail=f"调用 AI 失败: {str(e)}")
-
-        # 解析 JSON 数据
-        try:
-            response_text = response_text.replace("\\", "\\\\")
-            ai_response = json.loads(response_text)
-            # 解析用户画像
-            if "用户画像" in ai_response:
-                user_profile_data = ai_response["用户画像"]
-                grade = user_profile_data.get("学段", "")
-                textbook = user_profile_data.get("教材", "")
-                difficult_topics = user_profile_data.get("困难的知识点", [])
-                # 更新用户画像
-                user_profile_content = (
-                    f"学生信息：\n"
-                    f"- 学段：{grade}\n"
-                    f"- 教材：{textbook}\n"
-                )
-                if difficult_topics:
-                    user_profile_content += f"- 困难的知识点：{'， '.join(difficult_topics)}\n"
-                    # 将用户画像写入文件
-                with open(user_profile_path, "w", encoding="utf-8") as f:
-                    f.write(user_profile_content)
-                    # 解析学习状态分数
-            if "学习状态分数" in ai_response:
-                score_data = ai_response["学习状态分数"]
-                question_depth = score_data.get("学习深度", 0)
-                response_timeliness = score_data.get("响应及时性", 0)
-                correction_proactivity = score_data.get("自我修正主动性", 0)
-                emotional_engagement = score_data.get("情感参与度", 0)
-                total_score = score_data.get("学习状态总分", 0)
-
-                # 输出分数
-                print(question_depth, response_timeliness, correction_proactivity, emotional_engagement, total_score)
-
-                # 存入数据库
-                db = SessionLocal()
-                new_score = ConversationScore(
-                    studentname=username,
-                    question_depth=question_depth,
-                    response_timeliness=response_timeliness,
-                    correction_proactivity=correction_proactivity,
-                    emotional_engagement=emotional_engagement,
-                    total_score=total_score
-                )
-                db.add(new_score)
-                db.commit()
-                db.close()
-            # 提取回复内容
-            reply_content = ai_response.get("回复内容", "").strip()
-            response_text = reply_content  # 将回复内容作为最终返回值
-
-        except json.JSONDecodeError as e:
-            print(f"AI 返回的内容不是有效的 JSON 格式: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"AI 返回的内容不是有效的 JSON 格式: {str(e)}")
-        conversation_history[username].append(f"用户: {prompt}")
-        conversation_history[username].append(f"AI: {response_text}")
-        # 写入文件（仅保存用户原始输入和 AI 回复）
-        file_path = user_folder / f"{username}_chat_history.txt"
-        with open(file_path, "a", encoding="utf-8") as f:
-            f.write(f"用户: {prompt}\n\nAI: {response_text}\n\n")
-
+        response_text = _finish_chat(username, user_folder, prompt, response_text)
         return {"status": "success", "response": response_text}
 
     except Exception as e:
         print(f"服务器错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
 
+# 千问问答（流式）：逐段推送回复内容 {"token": ...}（不含用户画像与评分），结束时推送 {"done": true, "response": 回复内容}
+@router.post("/chat-stream")
+async def qwenchat_stream(request: ChatRequest):
+    username = request.studentname
+    prompt = request.prompt
+    started = time.perf_counter()
+    user_folder, full_prompt_for_ai, window = _prepare_chat(username, prompt)
+
+    async def event_stream():
+        chunks = []
+        reply = _ReplyExtractor()
+        reply_sent = False
+        try:
+            async for delta in stream_qwen(full_prompt_for_ai, window):
+                chunks.append(delta)
+                token = reply.feed(delta)
+                if not token:
+                    continue
+                if not reply_sent:
+                    observe("chat.stream.ttft_ms", (time.perf_counter() - started) * 1000, LATENCY_BUCKETS)
+                    reply_sent = True
+                yield _sse({"token": token})
+            response_text = _finish_chat(username, user_folder, prompt, "".join(chunks))
+            observe("chat.stream.total_ms", (time.perf_counter() - started) * 1000, LATENCY_BUCKETS)
+            yield _sse({"done": True, "response": response_text})
+        except Exception as e:
+            print(f"服务器错误: {str(e)}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield _sse({"error": f"服务器错误: {detail}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # 数据库获取最新得分
 @router.get("/evaluation/{studentname}")
-async def get_evaluation(studentname: str):
+async def get_evaluation(studentname: str, db: Session = Depends(get_db)):
     # 从数据库获取用户的最新评估数据
     try:
-        db = SessionLocal()
-        latest_score = (
-            db.query(ConversationScore)
-            .filter(ConversationScore.studentname == studentname)
-            .order_by(ConversationScore.timestamp.desc())
-            .first()
-        )
+        # 该学生还有未写入的评分时先写出，保证读到刚产生的评分
+        await _flush_scores(studentname)
+        latest_score = db.execute(latest_score_query(studentname)).scalar_one_or_none()
         # 未提取到
         if not latest_score:
             raise HTTPException(status_code=404, detail="用户评估数据不存在")
@@ -351,15 +442,131 @@ async def get_evaluation(studentname: str):
         }
 
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
-    finally:
-        db.close()
 
 # 图片拍照解题(大模型识别图片并解题)
+# 归档原始图片（在响应返回后由后台任务执行）
+def _archive_image(image_path: Path, image_data: bytes):
+    try:
+        with open(image_path, "wb") as f:
+            f.write(image_data)
+    except OSError as e:
+        print(f"图片归档失败 {image_path}: {str(e)}")
+
+# 拍照搜题的识别要求
+VIEW_PROMPT = (
+    "请按照以下 JSON 格式返回结果，不要使用markdown格式，需保证转化为JSON后数学符号、换行符号不影响或干扰包解析："
+    "{"
+    '    "题目": "识别到的完整题目，如果是选择题，需要加入选项",'
+    '    "正确答案": {'
+    '        "详细解析": "详细的解答过程",'
+    '        "考察知识点": ["知识点1", "知识点2"]'
+    "    }"
+    "}"
+)
+
+# 按文件头识别图片格式，只检查前几个字节
+def _sniff_image_format(head: bytes) -> Optional[str]:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    return None
+
+# 读取上传的图片：请求体大小已由 UploadLimitMiddleware 在接收时限制，框架已把文件暂存在临时文件中，
+# 这里先按文件大小判断再一次性读出（模型请求与缓存键都需要完整字节），不再额外复制一份
+async def _read_upload(file: UploadFile, max_bytes: int = IMAGE_UPLOAD_MAX_BYTES) -> bytes:
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"图片不能超过 {max_bytes // 1024 // 1024} MB")
+    image_data = await file.read(max_bytes + 1)
+    if len(image_data) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"图片不能超过 {max_bytes // 1024 // 1024} MB")
+    return image_data
+
+# 拍照搜题公共流程：缓存 -> 预处理 -> 视觉模型 -> 解析并记录；base64_data 为调用方已有的 Base64 编码，可省去重新编码
+async def _recognize_image(username: str, image_data: bytes, file_extension: str, background_tasks: BackgroundTasks, base64_data: Optional[str] = None) -> dict:
+    prompt = VIEW_PROMPT
+    # 生成唯一的文件名（避免文件名冲突）
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    unique_filename = f"{timestamp}.{file_extension}"
+
+    # 创建用户文件夹和用户画像文件路径
+    user_folder = Path(ENVPATH) / username
+    mkdir(user_folder)
+    problem_folder = user_folder / "Problem"
+    mkdir(problem_folder)
+
+    # 拼接完整图片路径；成功时在响应后归档，失败时（后台任务不会执行）在抛出错误前归档
+    image_path = problem_folder / unique_filename
+    # 调用模型
+    try:
+        # 同一张图片、同一 prompt 与模型的识别结果直接复用缓存（磁盘缓存读写在线程中执行）
+        cached = await asyncio.to_thread(get_cached_result, image_data, prompt, QWEN_VL_MODEL)
+        if cached is not None:
+            ai_response = cached
+        else:
+            # 预处理（旋转、裁边、缩放、压缩），图片未变化时仍直接使用原始 Base64
+            prepared, image_format = await asyncio.to_thread(prepare_image, image_data, file_extension)
+            if prepared is not image_data or base64_data is None:
+                base64_data = base64.b64encode(prepared).decode("ascii")
+            response_text = await call_qwen_vl(base64_data, prompt, image_format)
+            if not response_text:
+                raise ValueError("模型未返回有效响应")
+        # 解析 JSON 数据
+        try:
+            # 提取 content 字段
+            if cached is None:
+                ai_response = extract_json_content(response_text)
+            # 提取题目部分
+            question = ai_response.get("题目", "").strip()
+            if not question:
+                raise ValueError("无法从模型响应中提取题目内容")
+            # 提取正确答案部分
+            correct_answer = ai_response.get("正确答案", {})
+            detailed_explanation = correct_answer.get("详细解析", "").strip()
+            knowledge_points = correct_answer.get("考察知识点", [])
+            if cached is None:
+                await asyncio.to_thread(put_cached_result, image_data, prompt, QWEN_VL_MODEL, {
+                    "题目": question,
+                    "正确答案": {"详细解析": detailed_explanation, "考察知识点": knowledge_points}
+                })
+            # 存储题目和答案
+            date_str = datetime.now().strftime("%Y-%m-%d")
+            user_problem_path = user_folder / f"{username}_problem.md"
+            with open(user_problem_path, "a", encoding="utf-8") as f:
+                f.write(f"日期: {date_str}\n\n")
+                f.write(f"题目: {question}\n\n")
+                f.write(f"正确答案:\n")
+                f.write(f"- 详细解析: {detailed_explanation}\n")
+                f.write(f"- 考察知识点: {'，'.join(knowledge_points)}\n\n")
+            background_tasks.add_task(_archive_image, image_path, image_data)
+            # 返回标准化的响应
+            return {
+                "status": "success",
+                "message": "图片解析成功",
+                "response": {
+                    "题目": question,
+                    "正确答案": {
+                        "详细解析": detailed_explanation,
+                        "考察知识点": knowledge_points
+                    }
+                }
+            }
+        except json.JSONDecodeError as e:
+            await asyncio.to_thread(_archive_image, image_path, image_data)
+            raise HTTPException(status_code=500, detail=f"模型返回的内容不是有效的 JSON 格式: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        await asyncio.to_thread(_archive_image, image_path, image_data)
+        raise HTTPException(status_code=500, detail=f"模型调用失败: {str(e)}")
+
 @router.post("/upload-image")
-async def qwenview(request: ViewRequest):
-    logging.info(f"Received request: {request}")
+async def qwenview(request: ViewRequest, background_tasks: BackgroundTasks):
+    logging.info(f"Received request: studentname={request.studentname}, size={len(request.file)}")
     try:
         username = request.studentname
         if not request.studentname:
@@ -368,95 +575,54 @@ async def qwenview(request: ViewRequest):
         # 检查文件类型是否为图片
         if not file.startswith("data:image/"):
             return JSONResponse(status_code=400, content={"message": "只支持图片文件！"})
-        prompt = (
-            "请按照以下 JSON 格式返回结果，不要使用markdown格式，需保证转化为JSON后数学符号、换行符号不影响或干扰包解析："
-            "{"
-            '    "题目": "识别到的完整题目，如果是选择题，需要加入选项",'
-            '    "正确答案": {'
-            '        "详细解析": "详细的解答过程",'
-            '        "考察知识点": ["知识点1", "知识点2"]'
-            "    }"
-            "}"
-        )
-        # 提取 Base64 数据和 MIME 类型
-        match = re.match(r"data:(image/(\w+));base64,(.*)", file)
+        # 提取 Base64 数据和 MIME 类型（只匹配头部，避免对整段图片数据做正则扫描）
+        header, _, base64_data = file.partition(",")
+        match = re.fullmatch(r"data:(image/(\w+));base64", header)
         if not match:
             return JSONResponse(status_code=400, content={"status": "error", "message": "无效的图片数据！"})
 
-        mime_type, file_extension, base64_data = match.groups()
+        mime_type, file_extension = match.groups()
         file_extension = file_extension.lower()
         if file_extension.lower() not in ["png", "jpg", "jpeg"]:
             return JSONResponse(status_code=400, content={"status": "error", "message": "不支持的图片格式！"})
 
-        # 解码 Base64 数据
-        base64_data = base64_data.replace("\n", "").replace("\r", "")  # 清理空白字符
-        image_data = base64.b64decode(base64_data)
-
-        # 生成唯一的文件名（避免文件名冲突）
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_filename = f"{timestamp}.{file_extension}"
+        # 解码 Base64 数据（仅解码一次，用于校验、缓存键和归档）；校验通过的原始 Base64 直接发给模型
+        if "\n" in base64_data or "\r" in base64_data:
+            base64_data = base64_data.replace("\n", "").replace("\r", "")  # 清理空白字符
+        try:
+            image_data = base64.b64decode(base64_data, validate=True)
+        except ValueError:
+            return JSONResponse(status_code=400, content={"status": "error", "message": "无效的图片数据！"})
 
-        # 创建用户文件夹和用户画像文件路径
-        user_folder = Path(ENVPATH) / username
-        mkdir(user_folder)
-        problem_folder = user_folder / "Problem"
-        mkdir(problem_folder)
+        return await _recognize_image(username, image_data, file_extension, background_tasks, base64_data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"拍照搜题报错: {str(e)}")
 
-        # 拼接完整图片路径
-        image_path = problem_folder / unique_filename
-        # 读取文件内容并保存到指定路径
-        with open(image_path, "wb") as f:
-            f.write(image_data)
-        # 调用模型
-        try:
-            # 将xxxx/eagle.png替换为你本地图像的绝对路径
-            Image_path = encode_image(image_path)
-            response_text = call_qwen_vl(Image_path, prompt, file_extension)
-            if not response_text:
-                raise ValueError("模型未返回有效响应")
-            # 解析 JSON 数据
-            try:
-                # 提取 content 字段
-                ai_response = extract_json_content(response_text)
-                # 提取题目部分
-                question = ai_response.get("题目", "").strip()
-                if not question:
-                    raise ValueError("无法从模型响应中提取题目内容")
-                # 提取正确答案部分
-                correct_answer = ai_response.get("正确答案", {})
-                detailed_explanation = correct_answer.get("详细解析", "").strip()
-                knowledge_points = correct_answer.get("考察知识点", [])
-                # 存储题目和答案
-                date_str = datetime.now().strftime("%Y-%m-%d")
-                user_problem_path = user_folder / f"{username}_problem.md"
-                with open(user_problem_path, "a", encoding="utf-8") as f:
-                    f.write(f"日期: {date_str}\n\n")
-                    f.write(f"题目: {question}\n\n")
-                    f.write(f"正确答案:\n")
-                    f.write(f"- 详细解析: {detailed_explanation}\n")
-                    f.write(f"- 考察知识点: {'，'.join(knowledge_points)}\n\n")
-                # 返回标准化的响应
-                return {
-                    "status": "success",
-                    "message": "图片解析成功",
-                    "response": {
-                        "题目": question,
-                        "正确答案": {
-                            "详细解析": detailed_explanation,
-                            "考察知识点": knowledge_points
-                        }
-                    }
-                }
-            except json.JSONDecodeError as e:
-                raise HTTPException(status_code=500, detail=f"模型返回的内容不是有效的 JSON 格式: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"模型调用失败: {str(e)}")
+# 拍照搜题（multipart/form-data 直接上传图片二进制，省去 Base64 膨胀和大字符串 JSON 解析）
+@router.post("/upload-image-file")
+async def qwenview_file(background_tasks: BackgroundTasks, studentname: str = Form(...), file: UploadFile = File(...)):
+    if not studentname:
+        raise HTTPException(status_code=400, detail="Username is required.")
+    image_data = await _read_upload(file)
+    file_extension = _sniff_image_format(image_data[:8])
+    if file_extension is None:
+        return JSONResponse(status_code=400, content={"status": "error", "message": "不支持的图片格式！"})
+    try:
+        return await _recognize_image(studentname, image_data, file_extension, background_tasks)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"拍照搜题报错: {str(e)}")
 
 # --- Student业务 ---    资源下载
+# 学习建议下载：已有当前画像版本的建议时返回文件，否则提交生成任务并立即返回 202，不在下载请求中等待模型
+async def _advice_download(username: str, user_folder: Path) -> Response:
+    job = await advice_jobs.submit(username)
+    if job["status"] == "done":
+        filename = f"{username}_advice.txt"
+        return FileResponse(user_folder / filename, media_type="application/octet-stream", filename=filename)
+    return JSONResponse(status_code=202, content={**job_view(job), "detail": f"学习建议生成中，请稍后通过 /advice-jobs/{job['job_id']} 查询"})
+
 @router.post("/student-get-source")
-async def student_get_source(request: GetsourceRequest):
+async def student_get_source(request: GetsourceRequest, raw_request: Request):
     username = request.studentname
     sourcenumber = request.sourcenumber
     user_folder = Path(ENVPATH) / username
@@ -464,7 +630,7 @@ async def student_get_source(request: GetsourceRequest):
         match sourcenumber:
             # 聊天记录
             case 1:
-                file_path = user_folder / f"{username}_chat_history.txt"
+                file_path = export_txt(user_folder, username)
                 filename = f"{username}_chat_history.txt"
                 return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
             # 错题
@@ -472,48 +638,72 @@ async def student_get_source(request: GetsourceRequest):
                 file_path = user_folder / f"{username}_problem.md"
                 filename = f"{username}_problem.md"
                 return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
-            # 学习建议
+            # 学习建议（画像未变化时直接下载，否则返回 202 与任务 ID，由前端轮询 /advice-jobs/{job_id}）
             case 3:
-                call_deepseek_r1_distill_download(username)
-                file_path = user_folder / f"{username}_advice.txt"
-                filename = f"{username}_advice.txt"
-                return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
-            # 导出学习状态分数记录execl表
+                return await _advice_download(username, user_folder)
+            # 导出学习状态分数记录execl表（数据未变化时复用上次导出的文件）
             case 4:
-                file_path = user_folder / f"{username}_conversation_scores.xlsx"
-                filename = f"{username}_conversation_scores.xlsx"
-                export_studentname_to_excel(DATABASE_URL, username, file_path)
-                return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename=filename)
+                await _flush_scores(username)
+                return await asyncio.to_thread(score_export_response, DATABASE_URL, username, user_folder, "xlsx", raw_request.headers.get("if-none-match"))
+            # 导出学习状态分数记录csv表（边查询边发送）
+            case 5:
+                await _flush_scores(username)
+                return await asyncio.to_thread(score_export_response, DATABASE_URL, username, user_folder, "csv", raw_request.headers.get("if-none-match"))
     except Exception as e:
         raise  HTTPException(status_code=500, detail=f"资源下载报错: {str(e)}")
 
+# 提交学习建议生成任务，画像未变化时直接返回已完成的任务
+@router.post("/advice-jobs")
+async def submit_advice_job(request: AdviceJobRequest):
+    try:
+        studentname = await asyncio.to_thread(get_studentname, DATABASE_URL, request.student_identifier)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return job_view(await advice_jobs.submit(studentname))
+
+# 查询学习建议任务状态
+@router.get("/advice-jobs/{job_id}")
+async def get_advice_job(job_id: str):
+    job = advice_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job_view(job)
+
+# 获取学习建议任务结果
+@router.get("/advice-jobs/{job_id}/result")
+async def get_advice_job_result(job_id: str):
+    job = advice_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"学习建议生成失败: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="学习建议仍在生成中")
+    return {**job_view(job), **job["result"]}
+
+# 分页获取聊天记录（第 1 页为最近的对话）
+@router.get("/chat-history/{studentname}")
+async def get_chat_history(studentname: str, page: int = 1, page_size: int = 20):
+    if page < 1 or not 1 <= page_size <= 100:
+        raise HTTPException(status_code=400, detail="分页参数错误")
+    try:
+        return read_page(Path(ENVPATH) / studentname, studentname, page, page_size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取聊天记录出错: {str(e)}")
+
 # 从 MySQL 数据库获取询问次数和时间
 @router.post("/recentlyask/{studentname}")
-async def recentlyAsk(studentname: str):
+async def recentlyAsk(studentname: str, db: Session = Depends(get_db)):
     try:
-        db = SessionLocal()
+        await _flush_scores(studentname)
         # 获取当前日期，不包含时间部分
         current_date = datetime.now().date()
         # 计算七天前的日期
         seven_days_ago = current_date - timedelta(days=7)
-        # 查询选定用户在最近七天内的插入记录
-        result = (
-            db.query(
-                func.date(ConversationScore.timestamp).label("date"),  # 按日期分组
-                func.count(ConversationScore.id).label("count")  # 统计每天的插入次数
-            )
-            .filter(
-                ConversationScore.studentname == studentname,  # 筛选用户名
-                ConversationScore.timestamp >= seven_days_ago  # 筛选最近七天
-            )
-            .group_by(func.date(ConversationScore.timestamp))  # 按日期分组
-            .order_by(func.date(ConversationScore.timestamp))  # 按日期排序
-            .all()
-        )
+        # 从每日汇总表读取选定用户最近七天的提问次数（按日期排序）
+        result = daily_counts(db, studentname, seven_days_ago)
         # 将结果转换为列表字典格式
-        stats = [{"date": row.date.strftime('%Y-%m-%d'), "count": row.count} for row in result]
-        # 关闭数据库会话
-        db.close()
+        stats = [{"date": day.strftime('%Y-%m-%d'), "count": count} for day, count in result]
         # 返回 JSON 响应
         return {"username": studentname, "recent_stats": stats}
     except Exception as e:
@@ -524,6 +714,21 @@ async def recentlyAsk(studentname: str):
 async def redirect_to_docs():
     return RedirectResponse(url="/docs")
 
+# 运行指标
+@router.get("/metrics")
+async def get_metrics():
+    return {**snapshot(), "history_store": history_store.stats(), "offline_models": inference_pool.stats(), "vl_cache": vl_cache.stats(), "text_cache": text_cache.stats(), "identity_cache": identity_cache.stats(), "advice_jobs": advice_jobs.stats(), "score_buffer": score_buffer.stats(), "profile_store": profile_store.stats()}
+
+# 查看离线解题缓存
+@router.get("/admin/text-cache")
+async def inspect_text_cache(limit: int = 20):
+    return {"stats": text_cache.stats(), "recent": text_cache.recent(limit)}
+
+# 清空离线解题缓存
+@router.delete("/admin/text-cache")
+async def purge_text_cache():
+    return {"status": "success", "removed": text_cache.purge()}
+
 # --- Teacher业务 ---
 # 创建班级/拉学生进班级
 class CreateClassRequest(BaseModel):
@@ -542,11 +747,31 @@ class DeleteMemberFromClassRequest(BaseModel):
     student_identifier: Union[int, str]
     classname: str
 
+# 批量添加/移出班级成员
+class BulkRosterRequest(BaseModel):
+    teacher_identifier: Union[int, str]
+    classname: str
+    student_identifiers: List[Union[int, str]]
+
+# 批量调班
+class BulkMoveRequest(BaseModel):
+    teacher_identifier: Union[int, str]
+    from_classname: str
+    to_classname: str
+    student_identifiers: List[Union[int, str]]
+
 # 教师获取班级学生成员列表
 class GetClassDetailsRequest(BaseModel):
     teacherid: int
     classname: str
 
+# 班级整体学情（时间窗口默认为最近七天）
+class GetClassAnalyticsRequest(BaseModel):
+    teacherid: int
+    classname: str
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
 # 获取学生提问频率
 class GetStudentFrequencyRequest(BaseModel):
     student_identifier: Union[int, str]
@@ -594,6 +819,33 @@ async def teacher_delete_member_from_class(request: DeleteMemberFromClassRequest
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"函数逻辑错误或网络问题: {str(e)}")
 
+# 批量名单操作公共处理：限制单次人数，参数错误返回 400
+async def _bulk_roster(func, *args):
+    if len(args[-1]) > ROSTER_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"单次最多处理 {ROSTER_BULK_MAX} 名学生")
+    try:
+        result = await asyncio.to_thread(func, DATABASE_URL, *args)
+        return {"status": "success", "data": result}
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"{str(ve)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量操作失败: {str(e)}")
+
+# 教师批量拉学生进班级（班级不存在时自动创建）
+@router.post("/teacher-bulk-add-students")
+async def teacher_bulk_add_students(request: BulkRosterRequest):
+    return await _bulk_roster(bulk_add_to_class, request.teacher_identifier, request.classname, request.student_identifiers)
+
+# 教师批量移出班级成员
+@router.post("/teacher-bulk-remove-students")
+async def teacher_bulk_remove_students(request: BulkRosterRequest):
+    return await _bulk_roster(bulk_remove_from_class, request.teacher_identifier, request.classname, request.student_identifiers)
+
+# 教师批量调班
+@router.post("/teacher-bulk-move-students")
+async def teacher_bulk_move_students(request: BulkMoveRequest):
+    return await _bulk_roster(bulk_move_between_classes, request.teacher_identifier, request.from_classname, request.to_classname, request.student_identifiers)
+
 # 教师获取班级学生成员列表
 @router.post("/teacher-get-class-details")
 async def teacher_get_class_details(request: GetClassDetailsRequest):
@@ -606,10 +858,26 @@ async def teacher_get_class_details(request: GetClassDetailsRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
+# 教师获取班级整体学情：一次请求返回全部成员的最新评分、平均分与提问次数
+@router.post("/teacher-get-class-analytics")
+async def teacher_get_class_analytics(request: GetClassAnalyticsRequest):
+    end = request.end or datetime.now()
+    start = request.start or end - timedelta(days=7)
+    try:
+        await _flush_scores()
+        result = await asyncio.to_thread(get_class_analytics, DATABASE_URL, request.teacherid, request.classname, start, end)
+        return {"status": "success", "data": result}
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"{str(ve)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取班级学情失败: {str(e)}")
+
 # 教师获取学生提问频率
 @router.post("/teacher-get-student-frequency")
 async def teacher_get_student_frequency(request: GetStudentFrequencyRequest):
     try:
+        # 学生标识可能是学号，无法按姓名判断，有未写入的评分就先写出
+        await _flush_scores()
         result = get_frequency(DATABASE_URL, request.student_identifier, request.start, request.end)
         if result["studentname"] != 0:
             return {"status": "success", "data": result}
@@ -624,7 +892,7 @@ async def teacher_get_student_frequency(request: GetStudentFrequencyRequest):
 
 # 教师获取学生文件     学习建议/画像/错题
 @router.post("/teacher-get-student-file")
-async def teacher_get_student_file(request: GetStudentSourceRequest) -> FileResponse:
+async def teacher_get_student_file(request: GetStudentSourceRequest, raw_request: Request) -> Response:
     studentname = get_studentname(DATABASE_URL, request.student_identifier)
     username = studentname
     sourcenumber = request.sourcenumber
@@ -635,7 +903,7 @@ async def teacher_get_student_file(request: GetStudentSourceRequest) -> FileResp
         match sourcenumber:
             # 聊天记录
             case 1:
-                file_path = user_folder / f"{username}_chat_history.txt"
+                file_path = export_txt(user_folder, username)
                 filename = f"{username}_chat_history.txt"
                 return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
             # 错题
@@ -643,18 +911,17 @@ async def teacher_get_student_file(request: GetStudentSourceRequest) -> FileResp
                 file_path = user_folder / f"{username}_problem.md"
                 filename = f"{username}_problem.md"
                 return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
-            # 学习建议
+            # 学习建议（画像未变化时直接下载，否则返回 202 与任务 ID，由前端轮询 /advice-jobs/{job_id}）
             case 3:
-                call_deepseek_r1_distill_download(username)
-                file_path = user_folder / f"{username}_advice.txt"
-                filename = f"{username}_advice.txt"
-                return FileResponse(file_path, media_type="application/octet-stream", filename=filename)
-            # 导出学习状态分数记录execl表
+                return await _advice_download(username, user_folder)
+            # 导出学习状态分数记录execl表（数据未变化时复用上次导出的文件）
             case 4:
-                file_path = user_folder / f"{username}_conversation_scores.xlsx"
-                filename = f"{username}_conversation_scores.xlsx"
-                export_studentname_to_excel(DATABASE_URL, username, file_path)
-                return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename=filename)
+                await _flush_scores(username)
+                return await asyncio.to_thread(score_export_response, DATABASE_URL, username, user_folder, "xlsx", raw_request.headers.get("if-none-match"))
+            # 导出学习状态分数记录csv表（边查询边发送）
+            case 5:
+                await _flush_scores(username)
+                return await asyncio.to_thread(score_export_response, DATABASE_URL, username, user_folder, "csv", raw_request.headers.get("if-none-match"))
     except Exception as e:
         raise  HTTPException(status_code=500, detail=f"资源下载报错: {str(e)}")
 
@@ -673,17 +940,15 @@ async def teacher_upload_file(teacher_identifier: Union[int, str], target_is_stu
         if target_is_student:
             target = get_studentname(DATABASE_URL, target_identifier)
             target_folder = Path(ENVPATH) / f"{target}"
-            mkdir(target_folder)
-            file_path = Path(ENVPATH) / f"{target}" / f"{file.filename}"
         else:
-            user_folder = Path(ENVPATH) / f"{teachername}"
-            mkdir(user_folder)
-            file_path = Path(ENVPATH) / f"{teachername}" / f"{file.filename}"
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        return {"status": "success", "filename": f"{file.filename}"}
+            target_folder = Path(ENVPATH) / f"{teachername}"
+        mkdir(target_folder)
+        # 分块保存文件（限制大小，内容相同的资料不重复写入）
+        saved = await save_upload(file, target_folder, file.filename)
+        # 直接覆盖了学生画像文件时，下次读取重新加载
+        if target_is_student and file.filename == f"{target}_profile.txt":
+            profile_store.invalidate(target)
+        return {"status": "success", **saved}
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -733,27 +998,110 @@ async def student_join_class(request: JoinClassRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"函数逻辑错误或网络问题: {str(e)}")
 
+# 离线推理异常转换为 HTTP 错误
+def _offline_error(e: Exception) -> HTTPException:
+    if isinstance(e, InferenceTimeout):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, ClientDisconnected):
+        return HTTPException(status_code=499, detail=str(e))
+    if isinstance(e, WorkerCrashed):
+        return HTTPException(status_code=503, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
 # 学生离线询问
 @router.post("/student-offline-text-question", response_model=QueryResponse)
-async def student_offline_text_question(request: TextQueryRequest):
+async def student_offline_text_question(request: TextQueryRequest, raw_request: Request):
     try:
-        # 解题
-        response = text_response(request.system_message, request.prompt, request.max_new_tokens)
+        # 解题（在推理进程中执行，客户端断开或超时即取消）
+        response = await cached_text_response(request.system_message, request.prompt, request.max_new_tokens, raw_request)
         # 返回结果
         return {"response": response}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _offline_error(e)
+
+# 学生离线询问（流式）：逐段推送 {"token": ...}，结束时推送 {"done": true, "response": 完整解答}
+@router.post("/student-offline-text-question-stream")
+async def student_offline_text_question_stream(request: TextQueryRequest):
+    started = time.perf_counter()
+
+    async def event_stream():
+        # 命中缓存时一次性返回完整解答
+        cached = await asyncio.to_thread(get_cached_text, request.system_message, request.prompt, request.max_new_tokens)
+        if cached is not None:
+            observe("offline_text.stream.ttft_ms", (time.perf_counter() - started) * 1000, LATENCY_BUCKETS)
+            yield _sse({"token": cached})
+            yield _sse({"done": True, "response": cached})
+            return
+        chunks = []
+        try:
+            # 客户端断开时关闭生成器，推理进程随之停止生成
+            async with aclosing(inference_pool.stream("text_stream", request.system_message, request.prompt, request.max_new_tokens)) as tokens:
+                async for chunk in tokens:
+                    if not chunks:
+                        observe("offline_text.stream.ttft_ms", (time.perf_counter() - started) * 1000, LATENCY_BUCKETS)
+                    chunks.append(chunk)
+                    yield _sse({"token": chunk})
+            observe("offline_text.stream.total_ms", (time.perf_counter() - started) * 1000, LATENCY_BUCKETS)
+            await asyncio.to_thread(put_cached_text, request.system_message, request.prompt, request.max_new_tokens, "".join(chunks))
+            yield _sse({"done": True, "response": "".join(chunks)})
+        except Exception as e:
+            yield _sse({"error": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+# 解析 data:image/...;base64, 形式的图片，路径或网址返回 None
+def _decode_data_uri(photograph: str) -> Optional[bytes]:
+    if not photograph.startswith("data:image"):
+        return None
+    header, _, data = photograph.partition(",")
+    if ";base64" not in header:
+        return None
+    try:
+        return base64.b64decode(data)
+    except ValueError:
+        return None
+
+# 离线拍照解题公共流程：photograph 为图片字节，或路径/网址
+async def _solve_photograph(photograph: Union[bytes, str], system_message: str, vl_max_new_tokens: int, math_max_new_tokens: int, raw_request: Request) -> str:
+    # 获取图片题目内容（图片字节按内容哈希复用识别结果）
+    image_bytes = photograph if isinstance(photograph, bytes) else None
+    cache_prompt = f"{system_message}\n{vl_max_new_tokens}"
+    question = await asyncio.to_thread(get_cached_result, image_bytes, cache_prompt, OFFLINE_VL_MODEL) if image_bytes else None
+    if question is None:
+        question = await inference_pool.run("vl", photograph, system_message, vl_max_new_tokens, request=raw_request)
+        if image_bytes:
+            await asyncio.to_thread(put_cached_result, image_bytes, cache_prompt, OFFLINE_VL_MODEL, question)
+    # 解题
+    return await cached_text_response(system_message, question, math_max_new_tokens, raw_request)
 
 @router.post("/student-photograph-question", response_model=QueryResponse)
-async def student_photograph_question(request: PhotographQueryRequest):
+async def student_photograph_question(request: PhotographQueryRequest, raw_request: Request):
     try:
-        # 获取图片题目内容
-        question = vl_question(request.Photograph, request.system_message, request.vl_max_new_tokens)
-        # 解题
-        response = text_response(request.system_message, question, request.math_max_new_tokens)
+        # Base64 图片解码后以字节交给推理进程，路径或网址原样传递
+        photograph = _decode_data_uri(request.Photograph) or request.Photograph
+        response = await _solve_photograph(photograph, request.system_message, request.vl_max_new_tokens, request.math_max_new_tokens, raw_request)
         # 返回结果
         return {"response": response}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise _offline_error(e)
+
+# 离线拍照解题（multipart/form-data 上传图片）
+@router.post("/student-photograph-question-file", response_model=QueryResponse)
+async def student_photograph_question_file(
+    raw_request: Request,
+    file: UploadFile = File(...),
+    vl_max_new_tokens: int = Form(256),
+    math_max_new_tokens: int = Form(615),
+    system_message: str = Form("请你描述一下这张图片。"),
+):
+    image_bytes = await _read_upload(file)
+    if _sniff_image_format(image_bytes[:8]) is None:
+        raise HTTPException(status_code=400, detail="不支持的图片格式！")
+    try:
+        response = await _solve_photograph(image_bytes, system_message, vl_max_new_tokens, math_max_new_tokens, raw_request)
+        return {"response": response}
+
+    except Exception as e:
+        raise _offline_error(e)
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import defaultdict, deque
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError
+
+from .config import (DATABASE_URL, SCORE_BUFFER_ENABLED, SCORE_BUFFER_MAX_ROWS, SCORE_BUFFER_FLUSH_INTERVAL,
+                     SCORE_BUFFER_MAX_RETRIES, SCORE_BUFFER_MAX_PENDING)
+from .activity import add_daily_activity
+from .database import get_session_factory
+from .metrics import incr, observe
+from .models import ConversationScore
+
+# 学习状态分数延迟写入：各请求只把评分放入内存缓冲，后台线程攒满 max_rows 条或每隔 flush_interval 秒
+# 以一条多行 INSERT 连同每日汇总在一个事务内写入；数据库临时不可用时重试，应用关闭时写完剩余数据
+
+FLUSH_ROWS_BUCKETS = (1, 5, 10, 50, 100, 200, 500, 1000)
+FLUSH_MS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+SCORE_FIELDS = ("question_depth", "response_timeliness", "correction_proactivity", "emotional_engagement", "total_score")
+
+# 评分字段须为数值，学生名与日期不能为空
+def _valid_row(row: dict) -> bool:
+    if not row.get("studentname") or row.get("timestamp") is None:
+        return False
+    return all(isinstance(row.get(field), (int, float)) and not isinstance(row.get(field), bool) for field in SCORE_FIELDS)
+
+# 连接断开、锁等待超时等可重试的错误
+def _is_transient(e: SQLAlchemyError) -> bool:
+    return isinstance(e, OperationalError) or (isinstance(e, DBAPIError) and e.connection_invalidated)
+
+class ScoreBuffer:
+    def __init__(self, db_url: str = DATABASE_URL, enabled: bool = SCORE_BUFFER_ENABLED, max_rows: int = SCORE_BUFFER_MAX_ROWS,
+                 flush_interval: float = SCORE_BUFFER_FLUSH_INTERVAL, max_retries: int = SCORE_BUFFER_MAX_RETRIES,
+                 max_pending: int = SCORE_BUFFER_MAX_PENDING):
+        self.db_url = db_url
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._rows = deque()
+        self._inflight = []     # 正在写入（含重试等待中）的评分，写完前仍视为未写入
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()   # 保证批次按顺序写入
+        self._thread = None
+        self._running = False
+        self.flushed = 0
+        self.dropped = 0
+
+    def _ensure_thread(self):
+        if not self._running or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="score-buffer", daemon=True)
+            self._thread.start()
+
+    # 放入一条评分 {"studentname", "timestamp", 各评分列...}；关闭延迟写入时同步写入
+    def add(self, row: dict):
+        if not self.enabled:
+            self._write([row])
+            return
+        with self._lock:
+            self._ensure_thread()
+            self._rows.append(row)
+            self._trim()
+            if len(self._rows) >= self.max_rows:
+                self._wakeup.notify()
+
+    # 缓冲超出上限（数据库长时间不可用）时丢弃最早的评分
+    def _trim(self):
+        while len(self._rows) > self.max_pending:
+            self._rows.popleft()
+            self.dropped += 1
+            incr("score_buffer.dropped")
+
+    # studentname 为 None 时判断是否有任何未写入的评分
+    def has_pending(self, studentname: str = None) -> bool:
+        with self._lock:
+            if studentname is None:
+                return bool(self._rows or self._inflight)
+            return any(row.get("studentname") == studentname for row in (*self._rows, *self._inflight))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._rows) < self.max_rows:
+                    self._wakeup.wait(self.flush_interval)
+                if not self._running:
+                    return
+            # 任何异常都不能让后台线程退出，否则之后的评分只会堆积在缓冲中
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"评分缓冲写入线程出错: {str(e)}")
+
+    # 写出当前缓冲的全部评分，返回写入的条数；重试耗尽后放回缓冲等待下次写入。
+    # 其他线程正在写入时先等其写完，因此读取前调用 flush 能读到此前产生的全部评分
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._rows)
+                self._rows.clear()
+                self._inflight = rows
+            try:
+                return self._flush_rows(rows)
+            finally:
+                with self._lock:
+                    self._inflight = []
+
+    def _flush_rows(self, rows: list) -> int:
+        invalid = [row for row in rows if not _valid_row(row)]
+        if invalid:
+            # 只丢弃格式错误的评分，同批其他评分照常写入
+            rows = [row for row in rows if _valid_row(row)]
+            self.dropped += len(invalid)
+            incr("score_buffer.dropped", len(invalid))
+            print(f"丢弃 {len(invalid)} 条格式错误的评分: {invalid}")
+        if not rows:
+            return 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(rows)
+                self.flushed += len(rows)
+                return len(rows)
+            except SQLAlchemyError as e:
+                if not _is_transient(e):
+                    # 数据本身有问题，重试无意义
+                    self.dropped += len(rows)
+                    incr("score_buffer.dropped", len(rows))
+                    print(f"评分写入失败，丢弃 {len(rows)} 条: {str(e)}")
+                    return 0
+                incr("score_buffer.retries")
+                print(f"评分写入失败（第 {attempt + 1} 次）: {str(e)}")
+                if attempt < self.max_retries:
+                    time.sleep(min(0.5 * 2 ** attempt, 5))
+            except Exception as e:
+                # 非数据库错误：放回缓冲，下次再写
+                print(f"评分写入出错，稍后重试: {str(e)}")
+                break
+        with self._lock:
+            self._rows.extendleft(reversed(rows))
+            self._trim()
+        return 0
+
+    def _write(self, rows: list):
+        started = time.perf_counter()
+        # 每日汇总按 (学生, 日期) 合并后累加
+        totals = defaultdict(lambda: [0, 0])
+        for row in rows:
+            total = totals[(row["studentname"], row["timestamp"])]
+            total[0] += 1
+            total[1] += row["total_score"]
+        Session = get_session_factory(self.db_url)
+        with Session() as session, session.begin():
+            session.execute(insert(ConversationScore), rows)
+            for (studentname, day), (count, score_sum) in totals.items():
+                add_daily_activity(session, studentname, day, count, score_sum)
+        incr("score_buffer.rows", len(rows))
+        observe("score_buffer.flush_rows", len(rows), FLUSH_ROWS_BUCKETS)
+        observe("score_buffer.flush_ms", (time.perf_counter() - started) * 1000, FLUSH_MS_BUCKETS)
+
+    # 停止后台线程并写出剩余评分
+    def close(self):
+        with self._lock:
+            running, self._running = self._running, False
+            self._wakeup.notify()
+        if running and self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": self.enabled, "pending": len(self._rows), "flushed": self.flushed, "dropped": self.dropped}
+
+score_buffer = ScoreBuffer()
@@ -0,0 +1,123 @@
+import csv
+import io
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+from openpyxl import Workbook
+from sqlalchemy import func, select
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from .config import EXPORT_BATCH_SIZE
+from .database import get_engine
+from .metrics import incr
+from .models import ConversationScore
+
+# 学习状态分数导出：服务端游标分批读取，CSV 边读边写入响应，xlsx 以 write_only 模式逐行写入；
+# 导出文件按（记录数, 最大 ID）缓存，数据未变化时直接返回上次的文件或 304
+EXPORT_HEADERS = ["ID", "用户名", "时间戳", "问题深度", "响应及时性", "纠正主动性", "情感参与度", "总分"]
+
+MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+}
+
+def _score_query(studentname: str):
+    return (
+        select(ConversationScore.id, ConversationScore.studentname, ConversationScore.timestamp,
+               ConversationScore.question_depth, ConversationScore.response_timeliness,
+               ConversationScore.correction_proactivity, ConversationScore.emotional_engagement, ConversationScore.total_score)
+        .where(ConversationScore.studentname == studentname)
+        .order_by(ConversationScore.timestamp, ConversationScore.id)
+    )
+
+# 评分记录只追加不修改，记录数与最大 ID 不变即内容不变
+def export_key(db_url: str, studentname: str) -> str:
+    with get_engine(db_url).connect() as conn:
+        count, max_id = conn.execute(
+            select(func.count(ConversationScore.id), func.max(ConversationScore.id)).where(ConversationScore.studentname == studentname)
+        ).one()
+    return f"{count}-{max_id or 0}"
+
+# 按批产出记录（每批 EXPORT_BATCH_SIZE 行）
+def iter_score_rows(db_url: str, studentname: str):
+    with get_engine(db_url).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(_score_query(studentname))
+        for batch in result.partitions():
+            yield batch
+
+def _key_path(path: Path) -> Path:
+    return path.with_name(path.name + ".key")
+
+def _cached(path: Path, key: str) -> bool:
+    try:
+        return path.exists() and _key_path(path).read_text(encoding="utf-8") == key
+    except OSError:
+        return False
+
+def _commit(tmp_path: Path, path: Path, key: str):
+    os.replace(tmp_path, path)
+    _key_path(path).write_text(key, encoding="utf-8")
+
+def write_xlsx(db_url: str, studentname: str, path: Path, key: str):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(EXPORT_HEADERS)
+    for batch in iter_score_rows(db_url, studentname):
+        for row in batch:
+            sheet.append(list(row))
+    workbook.save(tmp_path)
+    _commit(tmp_path, path, key)
+
+# CSV 边生成边发送，同时写入缓存文件；客户端中途断开时丢弃未完成的缓存
+def iter_csv(db_url: str, studentname: str, path: Path, key: str):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM 便于 Excel 正确识别中文
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_HEADERS)
+    completed = False
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as cache:
+            for batch in iter_score_rows(db_url, studentname):
+                writer.writerows(batch)
+                chunk = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                cache.write(chunk)
+                yield chunk.encode("utf-8")
+            chunk = buffer.getvalue()
+            if chunk:
+                cache.write(chunk)
+                yield chunk.encode("utf-8")
+        _commit(tmp_path, path, key)
+        completed = True
+    finally:
+        if not completed:
+            tmp_path.unlink(missing_ok=True)
+
+def _disposition(filename: str) -> str:
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+# 生成下载响应：If-None-Match 与当前版本一致返回 304，缓存有效返回已有文件，否则重新导出
+def score_export_response(db_url: str, studentname: str, user_folder: Path, fmt: str, if_none_match: Optional[str] = None) -> Response:
+    key = export_key(db_url, studentname)
+    etag = f'"{fmt}-{key}"'
+    if if_none_match == etag:
+        incr("score_export.not_modified")
+        return Response(status_code=304, headers={"ETag": etag})
+    filename = f"{studentname}_conversation_scores.{fmt}"
+    path = Path(user_folder) / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if _cached(path, key):
+        incr("score_export.cache_hits")
+        return FileResponse(path, media_type=MEDIA_TYPES[fmt], filename=filename, headers={"ETag": etag})
+    incr("score_export.cache_misses")
+    if fmt == "xlsx":
+        write_xlsx(db_url, studentname, path, key)
+        return FileResponse(path, media_type=MEDIA_TYPES[fmt], filename=filename, headers={"ETag": etag})
+    return StreamingResponse(iter_csv(db_url, studentname, path, key), media_type=MEDIA_TYPES[fmt],
+                             headers={"ETag": etag, "Content-Disposition": _disposition(filename)})
@@ -1,56 +1,59 @@
-import requests
+import httpx
 from datetime import datetime
 from pathlib import Path
 from fastapi import HTTPException
 
 from .config import DASHSCOPE_API_KEY, ENVPATH
+from .profile_store import profile_store
+from .dashscope_client import post_json, stream_chat, CHAT_COMPLETIONS_PATH, TEXT_GENERATION_PATH
 from .utils import mkdir
 
+# 通义千问视觉模型名称
+QWEN_VL_MODEL = "qwen2.5-vl-32b-instruct"
+
 # --- 通用业务 ---
 # -- AI业务 --
 # 调用通义千问文字 API
-def call_qwen(prompt: str, history: list):
-    DASHSCOPE_API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-    if not DASHSCOPE_API_KEY:
-        raise HTTPException(status_code=500, detail="API Key 未设置")
-    # 构造请求头
-    headers = {
-        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    # 构造请求体
+def _build_qwen_payload(prompt: str, history: list) -> dict:
     messages = [{"role": "user", "content": msg} for msg in history]
     messages.append({"role": "user", "content": prompt})
-    data = {
+    return {
         "model": "qwen2.5-14b-instruct",
         "messages": messages
     }
 
+async def call_qwen(prompt: str, history: list):
+    if not DASHSCOPE_API_KEY:
+        raise HTTPException(status_code=500, detail="API Key 未设置")
+    # 构造请求体
+    data = _build_qwen_payload(prompt, history)
+
     try:
-        response = requests.post(DASHSCOPE_API_URL, headers=headers, json=data)
+        response = await post_json(CHAT_COMPLETIONS_PATH, data)
         response.raise_for_status()
         response_json = response.json()
         if "choices" in response_json and len(response_json["choices"]) > 0:
             return response_json["choices"][0]["message"]["content"]
         else:
             return "AI 返回了空内容。"
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"调用 AI 失败: {str(e)}")
 
+# 流式调用通义千问文字 API，逐段返回增量文本
+async def stream_qwen(prompt: str, history: list):
+    if not DASHSCOPE_API_KEY:
+        raise HTTPException(status_code=500, detail="API Key 未设置")
+    async for delta in stream_chat(_build_qwen_payload(prompt, history)):
+        yield delta
+
 # 调用通义千问视觉API   qwen2.5-vl-72b-instruct
-def call_qwen_vl(image_path: str, prompt: str, imageform: str):
-    DASHSCOPE_API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+async def call_qwen_vl(base64_image: str, prompt: str, imageform: str):
     if not DASHSCOPE_API_KEY:
         raise HTTPException(status_code=500, detail="API Key 未设置")
 
-    # 构造请求头
-    headers = {
-        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-        "Content-Type": "application/json",
-    }
     # 构造请求体
     payload = {
-        "model": "qwen2.5-vl-32b-instruct",  # 指定模型名称
+        "model": QWEN_VL_MODEL,  # 指定模型名称
         "messages": [
             {"role": "system", "content": [{"type": "text", "text": "根据要求做出应答，保证格式正确"}], },
             {
@@ -59,7 +62,7 @@ def call_qwen_vl(image_path: str, prompt: str, imageform: str):
                     {
                         "type": "image_url", "image_url":
                         {
-                            "url": f"data:image/{imageform};base64,{image_path}"
+                            "url": f"data:image/{imageform};base64,{base64_image}"
                         },
                     },
                 # 需要注意，传入Base64，图像格式（即image/{format}）需要与支持的图片列表中的Content Type保持一致。"f"是字符串格式化的方法。
@@ -75,7 +78,7 @@ def call_qwen_vl(image_path: str, prompt: str, imageform: str):
     }
     try:
         # 发送 POST 请求
-        response = requests.post(DASHSCOPE_API_URL, headers=headers, json=payload)
+        response = await post_json(CHAT_COMPLETIONS_PATH, payload)
         # 检查响应状态码
         if response.status_code != 200:
             raise Exception(f"API 返回错误: {response.text}")
@@ -83,38 +86,23 @@ def call_qwen_vl(image_path: str, prompt: str, imageform: str):
         result = response.json()
         print(f"完整 API 响应:{result}\n\n")  # 打印完整响应以便调试
         return result
-    except FileNotFoundError:
-        print(f"图片文件不存在: {image_path}")
-        return None
     except Exception as e:
         print(f"Error calling visual API: {e}")
         return None
 
-# 指向学习建议下载部分的定向API
-def call_deepseek_r1_distill_download(username: str):
-    DASHSCOPE_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+# 读取用户画像，不存在时报错
+def load_user_profile(username: str) -> str:
+    user_profile, _ = profile_store.get(username)
+    if not user_profile:
+        raise FileNotFoundError("用户画像为空")
+    return user_profile
+
+# 根据用户画像生成学习建议，返回 advice 列表
+async def generate_study_advice(user_profile: str) -> list:
     # 检查 API Key 是否设置
     if not DASHSCOPE_API_KEY:
         raise HTTPException(status_code=500, detail="API Key 未设置")
 
-    # 创建用户文件夹和用户画像文件路径
-    user_folder = Path(ENVPATH) / username
-    mkdir(user_folder)
-    user_profile_path = user_folder / f"{username}_profile.txt"
-
-    # 加载用户画像（如果存在）
-    user_profile = ""
-    if user_profile_path.exists():
-        with open(user_profile_path, "r", encoding="utf-8") as f:
-            user_profile = f.read()
-    else:
-        raise Exception("用户画像为空")
-
-    # 构造请求头
-    headers = {
-        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-        "Content-Type": "application/json",
-    }
     # 构造请求体
     Preprompt = {
         "advice": [
@@ -142,7 +130,7 @@ def call_deepseek_r1_distill_download(username: str):
     }
     try:
         # 发送 POST 请求
-        response = requests.post(DASHSCOPE_API_URL, headers=headers, json=data)
+        response = await post_json(TEXT_GENERATION_PATH, data)
         # 检查响应状态码
         response.raise_for_status()
         # 解析响应内容
@@ -167,19 +155,30 @@ def call_deepseek_r1_distill_download(username: str):
         advice_list = advice_data.get("advice", [])
         if not isinstance(advice_list, list) or len(advice_list) == 0:
             raise ValueError("advice 列表为空或格式不正确")
-        # 写入文件并返回结果
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        file_path = user_folder / f"{username}_advice.txt"
-        with open(file_path, "a", encoding="utf-8") as f:
-            f"在{date_str}\n\n{username}获取学习建议：\n\n"
-            for advice in advice_list:
-                method = advice.get("method", "")
-                schedule = advice.get("schedule", "")
-                f.write(
-                    f"方法: {method}\n\n计划: {schedule}\n\n"
-                )
-        return {"status": "success", "response": advice_list}
-    except requests.exceptions.RequestException as e:
+        return advice_list
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"调用 AI 失败: {str(e)}")
     except ValueError as e:
-        raise HTTPException(status_code=500, detail=f"解析 API 响应失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"解析 API 响应失败: {str(e)}")
+
+# 学习建议追加写入 {username}_advice.txt，返回文件路径
+def append_advice_file(username: str, advice_list: list) -> Path:
+    user_folder = Path(ENVPATH) / username
+    mkdir(user_folder)
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    file_path = user_folder / f"{username}_advice.txt"
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write(f"在{date_str}\n\n{username}获取学习建议：\n\n")
+        for advice in advice_list:
+            method = advice.get("method", "")
+            schedule = advice.get("schedule", "")
+            f.write(
+                f"方法: {method}\n\n计划: {schedule}\n\n"
+            )
+    return file_path
+
+# 指向学习建议下载部分的定向API（同步生成并写入文件；接口中经由 advice_jobs 排队与缓存）
+async def call_deepseek_r1_distill_download(username: str):
+    advice_list = await generate_study_advice(load_user_profile(username))
+    append_advice_file(username, advice_list)
+    return {"status": "success", "response": advice_list}
@@ -0,0 +1,63 @@
+import asyncio
+import hashlib
+import json
+import unicodedata
+from pathlib import Path
+
+from .config import (TEXT_CACHE_MAX_ENTRIES, TEXT_CACHE_MAX_BYTES, TEXT_CACHE_DIR, TEXT_CACHE_DISK, TEXT_CACHE_DISK_MAX_ENTRIES,
+                     OFFLINE_MATH_MODEL_REVISION, Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir)
+from .inference_pool import text_batcher, wait_for_request
+from .result_cache import ResultCache
+
+# 离线解题结果记忆化：相同的（规范化后的）题目、系统消息、生成参数与模型版本直接返回上次的解答
+text_cache = ResultCache(
+    "text_cache",
+    max_entries=TEXT_CACHE_MAX_ENTRIES,
+    max_bytes=TEXT_CACHE_MAX_BYTES,
+    disk_dir=TEXT_CACHE_DIR if TEXT_CACHE_DISK else None,
+    disk_max_entries=TEXT_CACHE_DISK_MAX_ENTRIES,
+)
+
+_revision = None
+
+# 模型版本：优先使用配置，否则取模型目录下 config.json 的哈希，模型更换后缓存自动失效
+def model_revision() -> str:
+    global _revision
+    if _revision is None:
+        if OFFLINE_MATH_MODEL_REVISION:
+            _revision = OFFLINE_MATH_MODEL_REVISION
+        else:
+            config_path = Path(Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir or "") / "config.json"
+            try:
+                _revision = hashlib.sha256(config_path.read_bytes()).hexdigest()[:16]
+            except OSError:
+                _revision = str(Qwen2_5_Math_1_5B_Instruct_bnb_4bit_dir)
+    return _revision
+
+# 规范化：全角/半角统一（NFKC），折叠空白
+def normalize_prompt(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+def text_cache_key(system_message: str, prompt: str, max_new_tokens: int) -> str:
+    material = json.dumps([normalize_prompt(system_message), normalize_prompt(prompt), max_new_tokens, model_revision()], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def get_cached_text(system_message: str, prompt: str, max_new_tokens: int):
+    entry = text_cache.get(text_cache_key(system_message, prompt, max_new_tokens))
+    return entry["response"] if entry else None
+
+def put_cached_text(system_message: str, prompt: str, max_new_tokens: int, response: str):
+    text_cache.put(text_cache_key(system_message, prompt, max_new_tokens), {
+        "prompt": normalize_prompt(prompt)[:200],
+        "system_message": normalize_prompt(system_message)[:200],
+        "max_new_tokens": max_new_tokens,
+        "response": response,
+    })
+
+# 先查缓存，未命中时经微批调度交给推理进程，并写回缓存
+async def cached_text_response(system_message: str, prompt: str, max_new_tokens: int, request=None) -> str:
+    response = await asyncio.to_thread(get_cached_text, system_message, prompt, max_new_tokens)
+    if response is None:
+        response = await wait_for_request(text_batcher.submit((system_message, prompt), max_new_tokens), request)
+        await asyncio.to_thread(put_cached_text, system_message, prompt, max_new_tokens, response)
+    return response
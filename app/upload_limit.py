@@ -0,0 +1,37 @@
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+# multipart 边界、表单字段等额外开销
+MULTIPART_OVERHEAD = 64 * 1024
+
+# 上传接口请求体大小限制：在读取请求体之前按 Content-Length 拒绝，未声明长度（分块传输）时边接收边计数，
+# 超限立即中断，避免整个请求体先被框架缓冲再在接口内判断
+class UploadLimitMiddleware:
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits    # {路径: 最大字节数}
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"上传内容不能超过 {limit // 1024 // 1024} MB"
+        limit += MULTIPART_OVERHEAD
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)